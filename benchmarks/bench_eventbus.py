@@ -0,0 +1,85 @@
+"""Publish cost of EventBus against the number of subscribers.
+
+Compares the bus (one encode per message, shared string fanned out) with
+encoding the message separately for every subscriber, which is what each
+WebSocket handler used to do with send_json.
+
+    python benchmarks/bench_eventbus.py [--iterations N] [--queue-size N]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dashboard.events import EventBus, orjson  # noqa: E402
+
+SUBSCRIBER_COUNTS = (1, 10, 50, 200, 1000)
+
+
+def sample_state(queue_size: int) -> dict:
+    song = {
+        "title": "Some Artist - Some Fairly Long Track Title (Official Video)",
+        "url": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        "duration": 213,
+        "thumbnail": "https://i.ytimg.com/vi/dQw4w9WgXcQ/mqdefault.jpg",
+        "requester": "someone",
+    }
+    return {
+        "current": song,
+        "elapsed": 42.5,
+        "paused": False,
+        "playing": True,
+        "volume": 50,
+        "loop": "off",
+        "shuffle": False,
+        "filter": "",
+        "queue": [song] * queue_size,
+        "version": 1234,
+        "in_voice": True,
+        "timestamp": time.time(),
+    }
+
+
+def bench_bus(subscribers: int, state: dict, iterations: int) -> float:
+    bus = EventBus(coalesce_ms=0)
+    queues = [bus.subscribe(1) for _ in range(subscribers)]
+    started = time.perf_counter()
+    for _ in range(iterations):
+        bus.publish(1, "full_state", state)
+        for q in queues:
+            q.get_nowait()
+    return (time.perf_counter() - started) / iterations
+
+
+def bench_per_subscriber(subscribers: int, state: dict, iterations: int) -> float:
+    msg = {"type": "full_state", "data": state}
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for _ in range(subscribers):
+            json.dumps(msg)
+    return (time.perf_counter() - started) / iterations
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--queue-size", type=int, default=50)
+    args = parser.parse_args()
+
+    state = sample_state(args.queue_size)
+    print(f"encoder: {'orjson' if orjson else 'json'}, payload: {len(json.dumps(state))} bytes, "
+          f"{args.iterations} publishes per row\n")
+    print(f"{'subscribers':>11}  {'bus (ms)':>10}  {'per-sub encode (ms)':>20}  {'speedup':>8}")
+    for count in SUBSCRIBER_COUNTS:
+        bus = bench_bus(count, state, args.iterations) * 1000
+        naive = bench_per_subscriber(count, state, args.iterations) * 1000
+        print(f"{count:>11}  {bus:>10.3f}  {naive:>20.3f}  {naive / bus:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
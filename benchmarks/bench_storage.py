@@ -0,0 +1,107 @@
+"""Write and read throughput of Storage against one connection per store.
+
+Compares the shared database (one writer task committing queued writes in
+batches, WAL, a reader pool) with what each store used to do: its own
+aiosqlite connection in the default journal mode, committing every write.
+Writes are issued concurrently, as they are from many guilds at once.
+
+    python benchmarks/bench_storage.py [--ops N] [--concurrency N]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiosqlite
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.storage import Storage  # noqa: E402
+
+WRITE_SQL = "INSERT OR REPLACE INTO cache_entries (cache_key, file_path, size_bytes, last_accessed, created_at) VALUES (?, ?, ?, ?, ?)"
+READ_SQL = "SELECT file_path FROM cache_entries WHERE cache_key = ?"
+
+
+def row(i: int) -> tuple:
+    now = time.time()
+    return (f"key{i}", f"/cache/key{i}.opus", 4_000_000, now, now)
+
+
+async def run_concurrently(fn, ops: int, concurrency: int) -> float:
+    async def worker(offset: int):
+        for i in range(offset, ops, concurrency):
+            await fn(i)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return ops / (time.perf_counter() - started)
+
+
+async def bench_connection(cache_dir: str, ops: int, concurrency: int) -> tuple[float, float]:
+    db = await aiosqlite.connect(os.path.join(cache_dir, "cache.db"))
+    await db.execute("""
+        CREATE TABLE cache_entries (
+            cache_key TEXT PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            last_accessed REAL NOT NULL,
+            created_at REAL NOT NULL
+        )
+    """)
+    lock = asyncio.Lock()
+
+    async def write(i: int):
+        # The lock stands in for the stores never interleaving a write and its commit
+        async with lock:
+            await db.execute(WRITE_SQL, row(i))
+            await db.commit()
+
+    async def read(i: int):
+        async with db.execute(READ_SQL, (f"key{i}",)) as cursor:
+            await cursor.fetchone()
+
+    writes = await run_concurrently(write, ops, concurrency)
+    reads = await run_concurrently(read, ops, concurrency)
+    await db.close()
+    return writes, reads
+
+
+async def bench_storage(cache_dir: str, ops: int, concurrency: int) -> tuple[float, float, Storage]:
+    storage = Storage(cache_dir)
+    await storage.initialize()
+
+    async def write(i: int):
+        await storage.execute(WRITE_SQL, row(i))
+
+    async def read(i: int):
+        await storage.fetchone(READ_SQL, (f"key{i}",))
+
+    writes = await run_concurrently(write, ops, concurrency)
+    reads = await run_concurrently(read, ops, concurrency)
+    await storage.close()
+    return writes, reads, storage
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    os.environ.pop("CACHE_DIR", None)
+    with tempfile.TemporaryDirectory() as before_dir, tempfile.TemporaryDirectory() as after_dir:
+        before_writes, before_reads = await bench_connection(before_dir, args.ops, args.concurrency)
+        after_writes, after_reads, storage = await bench_storage(after_dir, args.ops, args.concurrency)
+
+    print(f"{args.ops} ops, {args.concurrency} concurrent callers, "
+          f"{storage.stats()['writes_per_commit']} writes per commit\n")
+    print(f"{'':>6}  {'per-store (ops/s)':>18}  {'storage (ops/s)':>16}  {'speedup':>8}")
+    for name, before, after in (("writes", before_writes, after_writes), ("reads", before_reads, after_reads)):
+        print(f"{name:>6}  {before:>18.0f}  {after:>16.0f}  {after / before:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
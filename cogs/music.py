@@ -1,8 +1,12 @@
 import asyncio
+import functools
+import itertools
+import json
 import logging
 import os
 import time
 import re
+from typing import Callable
 import aiohttp
 import discord
 from discord import app_commands
@@ -10,15 +14,51 @@ from discord.ext import commands, tasks
 
 log = logging.getLogger("bot.music")
 
-from utils.queue_manager import QueueManager, Song, LoopMode
+from utils.queue_manager import QueueManager, GuildQueue, Song, LoopMode
 from utils.youtube import YTDLSource
 from utils.spotify import SpotifyResolver
 from utils.lyrics import LyricsFetcher
 from utils.cache import CacheManager
 from utils.settings import GuildSettings
+from utils.queue_store import QueueStore
+from utils.search_cache import SearchCache
+from utils.ratelimit import RateLimiter
+from utils.http import close_http_session, get_http_session
+from utils.track_index import TrackIndex
+from utils.library import MusicLibrary
+from utils.storage import Storage
 
 YOUTUBE_PLAYLIST_RE = re.compile(r"(youtube\.com/.*[?&]list=|youtu\.be/.*[?&]list=)")
 DASHBOARD_URL = os.getenv("DASHBOARD_URL", "")
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_LINE = 64 * 1024
+# Queue rows sent with the full state and per page of /queue
+QUEUE_PAGE_SIZE = 100
+QUEUE_PAGE_MAX = 500
+# Autocomplete: choices returned, and how long to wait on remote suggestions
+# before answering from local sources (Discord drops answers after 3s)
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_BUDGET = 2.0
+# Seconds with nothing playing or queued before leaving voice (unless 24/7)
+IDLE_TIMEOUT = 600
+
+
+class RateLimited(commands.CheckFailure):
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"You're doing that too often. Try again in {retry_after:.0f}s.")
+
+
+def rate_limited(action: str):
+    """Command check: charge `action` to the caller's and guild's rate limit buckets."""
+    async def predicate(ctx: commands.Context) -> bool:
+        if ctx.guild is None:
+            return True
+        retry_after = ctx.cog.rate_limiter.check(ctx.author.id, ctx.guild.id, action)
+        if retry_after:
+            raise RateLimited(retry_after)
+        return True
+    return commands.check(predicate)
 
 
 def format_duration(seconds: int) -> str:
@@ -41,6 +81,19 @@ def parse_timestamp(ts: str) -> int:
     return parts[0]
 
 
+def _song_state(song) -> dict | None:
+    """A song as the dashboard sees it."""
+    if song is None:
+        return None
+    return {
+        "title": song.title,
+        "url": song.url,
+        "duration": song.duration,
+        "thumbnail": song.thumbnail,
+        "requester": song.requester,
+    }
+
+
 class NowPlayingView(discord.ui.View):
     def __init__(self, cog, ctx):
         super().__init__(timeout=None)
@@ -60,14 +113,19 @@ class NowPlayingView(discord.ui.View):
             await interaction.response.send_message("You need to be in the voice channel.", ephemeral=True)
             return
         vc = interaction.guild.voice_client
+        gq = self.cog.queue_manager.get(interaction.guild.id)
         if vc.is_playing():
             vc.pause()
+            gq.mark_paused()
             await interaction.response.send_message("Paused.", ephemeral=True)
         elif vc.is_paused():
             vc.resume()
+            gq.mark_resumed()
             await interaction.response.send_message("Resumed.", ephemeral=True)
         else:
             await interaction.response.send_message("Nothing is playing.", ephemeral=True)
+            return
+        self.cog._emit_event(interaction.guild.id, "player_update")
 
     @discord.ui.button(emoji="⏭️", style=discord.ButtonStyle.primary)
     async def skip(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -107,6 +165,8 @@ class NowPlayingView(discord.ui.View):
         cycle = [LoopMode.OFF, LoopMode.TRACK, LoopMode.QUEUE]
         current_idx = cycle.index(gq.loop_mode)
         gq.loop_mode = cycle[(current_idx + 1) % len(cycle)]
+        self.cog.settings.update(interaction.guild.id, loop_mode=gq.loop_mode.value)
+        self.cog._emit_event(interaction.guild.id, "loop_update", {"loop": gq.loop_mode.value})
         labels = {LoopMode.OFF: "Loop: Off", LoopMode.TRACK: "Loop: Track", LoopMode.QUEUE: "Loop: Queue"}
         await interaction.response.send_message(f"**{labels[gq.loop_mode]}**", ephemeral=True)
 
@@ -116,11 +176,12 @@ class NowPlayingView(discord.ui.View):
             await interaction.response.send_message("You need to be in the voice channel.", ephemeral=True)
             return
         gq = self.cog.queue_manager.get(interaction.guild.id)
-        if not gq.queue:
+        if not gq.queue and not gq.shuffled:
             await interaction.response.send_message("Queue is empty.", ephemeral=True)
             return
-        gq.shuffle()
-        await interaction.response.send_message("Queue shuffled.", ephemeral=True)
+        enabled = gq.shuffle()
+        self.cog._emit_event(interaction.guild.id, "shuffle_update", {"shuffle": enabled})
+        await interaction.response.send_message(f"Shuffle **{'on' if enabled else 'off'}**.", ephemeral=True)
 
 
 class SearchSelectView(discord.ui.View):
@@ -192,27 +253,133 @@ FILTER_MAP = {
 class Music(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.http = get_http_session(bot)
         self.queue_manager = QueueManager()
         self.spotify = SpotifyResolver()
-        self.lyrics_fetcher = LyricsFetcher()
-        self.cache_manager = CacheManager()
-        self.settings = GuildSettings()
+        # Cache entries, settings, queues and lyrics share one database
+        self.storage = Storage()
+        self.lyrics_fetcher = LyricsFetcher(self.storage)
+        self.cache_manager = CacheManager(self.storage, http=self.http)
+        self.settings = GuildSettings(self.storage)
+        self.queue_store = QueueStore(self.storage)
+        self.search_cache = SearchCache()
+        self.suggest_cache = SearchCache(max_entries=2048, ttl=300, env_prefix="SUGGEST_CACHE")
+        # Running suggestion lookups, and each user's latest keystroke number
+        self._autocomplete_tasks: set[asyncio.Task] = set()
+        self._autocomplete_latest: dict[int, int] = {}
+        self._autocomplete_seq = itertools.count()
+        self.rate_limiter = RateLimiter()
+        self.track_index = TrackIndex()
+        self.cache_manager.add_removal_listener(self.track_index.mark_uncached)
+        self.library = MusicLibrary(self.storage)
+        self.queue_manager.add_listener(self.queue_store.record)
+        self.queue_manager.add_listener(self._publish_queue_delta)
         asyncio.create_task(self._init_async())
         self._loaded_guilds: set[int] = set()
         self._restarting: set[int] = set()  # guild IDs currently restarting playback
-        self.auto_disconnect_task.start()
+        # Dashboard ETags: bumped per guild on every emitted event, and on guild
+        # membership changes for /guilds; the epoch separates process lifetimes
+        self.state_epoch = format(time.time_ns(), "x")
+        self._state_versions: dict[int, int] = {}
+        self.guilds_version = 0
+        # Idle-disconnect deadlines, armed when playback stops; the event
+        # loop's timer heap fires each one without polling the voice clients
+        self._idle_timers: dict[int, asyncio.TimerHandle] = {}
         log.info("Music cog loaded")
 
     async def _init_async(self):
+        await self.storage.initialize()
         await self.cache_manager.initialize()
         log.info("Cache manager initialized")
+        await self.track_index.initialize()
+        await self.library.initialize()
+        if self.library.enabled:
+            asyncio.create_task(self.library.scan())
         await self.settings.initialize()
         log.info("Guild settings DB initialized")
+        await self.queue_store.initialize()
+        sessions = await self.queue_store.restore(self.queue_manager)
+        await self._resume_sessions(sessions)
+        self.queue_persist_task.start()
+
+    async def cog_unload(self):
+        for handle in self._idle_timers.values():
+            handle.cancel()
+        self._idle_timers.clear()
+        self.queue_persist_task.cancel()
+        # Awaited in order, so unloading returns only once everything is written and closed
+        await self.track_index.flush()
+        await self.track_index.close()
+        # The library writes through storage, so it stops before storage closes
+        await self.library.close()
+        await self._close_stores()
+        await close_http_session(self.bot)
+
+    async def _close_stores(self):
+        # Stores write their buffered state through storage, so it closes last
+        await self.lyrics_fetcher.close()
+        await self.settings.close()
+        await self.queue_store.close()
+        await self.storage.close()
+
+    # Guild list changes invalidate the dashboard's /guilds ETag
+
+    @commands.Cog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        self.guilds_version += 1
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.guilds_version += 1
+
+    @commands.Cog.listener()
+    async def on_guild_update(self, before: discord.Guild, after: discord.Guild):
+        if before.name != after.name or before.icon != after.icon:
+            self.guilds_version += 1
+
+    async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, RateLimited):
+            await ctx.send(str(error), ephemeral=True)
+            return
+        log.error("Command %s failed: %s", ctx.command, error, exc_info=error)
 
-    def cog_unload(self):
-        self.auto_disconnect_task.cancel()
-        asyncio.create_task(self.cache_manager.close())
-        asyncio.create_task(self.settings.close())
+    async def _resume_sessions(self, sessions: dict[int, dict]):
+        """Rejoin voice channels and resume the current track of every guild
+        that was playing when the bot last went down."""
+        if not sessions:
+            return
+        await self.bot.wait_until_ready()
+        semaphore = asyncio.Semaphore(5)
+
+        async def resume(guild_id: int, session: dict):
+            async with semaphore:
+                guild = self.bot.get_guild(guild_id)
+                channel = guild.get_channel(session["voice_channel_id"]) if guild else None
+                gq = self.queue_manager.get(guild_id)
+                if not channel or not gq.current:
+                    return
+                try:
+                    if not guild.voice_client:
+                        await channel.connect()
+                        await guild.change_voice_state(channel=channel, self_deaf=True)
+                except Exception as e:
+                    log.warning("[Guild %d] Could not rejoin voice channel: %s", guild_id, e)
+                    return
+                await self._ensure_settings(guild_id)
+                gq.loop_mode = LoopMode(session["loop_mode"])
+                gq.audio_filter = session["audio_filter"]
+                gq.audio_filter_name = session["audio_filter_name"]
+                position = int(session["position"])
+                if gq.current.duration and position >= gq.current.duration:
+                    position = 0
+                log.info("[Guild %d] Resuming %s at %s", guild_id, gq.current.title, format_duration(position))
+                await self._api_play_song(guild_id, gq.current, seek_to=position)
+                if session["paused"] and guild.voice_client and guild.voice_client.is_playing():
+                    guild.voice_client.pause()
+                    gq.mark_paused()
+                    self._emit_event(guild_id, "player_update")
+
+        await asyncio.gather(*(resume(g, s) for g, s in sessions.items()), return_exceptions=True)
 
     # --- Helpers ---
 
@@ -222,6 +389,30 @@ class Music(commands.Cog):
         except (discord.Forbidden, discord.HTTPException, AttributeError):
             pass
 
+    async def _admit(self, ctx: commands.Context, action: str) -> bool:
+        """Charge an extra rate-limited action inside a command; tells the user if refused."""
+        retry_after = self.rate_limiter.check(ctx.author.id, ctx.guild.id, action)
+        if retry_after:
+            await ctx.send(str(RateLimited(retry_after)))
+            return False
+        return True
+
+    async def _make_song(self, query: str, requester: str) -> Song:
+        """A queue entry for a single URL or search; library tracks get their
+        catalog title and duration up front."""
+        if MusicLibrary.is_library_url(query):
+            found = await self.library.get(query)
+            if found:
+                _, data = found
+                return Song(title=data["title"], url=query, search_query=data["title"],
+                            requester=requester, duration=data["duration"])
+        return Song(title=query, url=query, search_query=query, requester=requester)
+
+    @staticmethod
+    def is_collection_url(query: str) -> bool:
+        """Whether a query expands to many tracks (Spotify or YouTube playlist)."""
+        return SpotifyResolver.is_spotify_url(query) or bool(YOUTUBE_PLAYLIST_RE.search(query))
+
     async def _ensure_voice(self, ctx: commands.Context) -> discord.VoiceClient | None:
         if not ctx.author.voice:
             await ctx.send("You need to be in a voice channel.")
@@ -243,58 +434,184 @@ class Music(commands.Cog):
             return True
         return dj_role in ctx.author.roles
 
-    def _emit_event(self, guild_id: int, event_type: str, data: dict | None = None):
+    def _touch_state(self, guild_id: int):
+        """Invalidate the guild's dashboard ETag."""
+        self._state_versions[guild_id] = self._state_versions.get(guild_id, 0) + 1
+
+    def state_etag(self, guild_id: int) -> str:
+        """ETag for the guild's dashboard state. Besides the event counter it
+        folds in the state itself, so a change made without an event (e.g. a
+        filter cleared while idle) still invalidates it."""
+        gq = self.queue_manager.peek(guild_id)
+        guild = self.bot.get_guild(guild_id)
+        vc = guild.voice_client if guild else None
+        fingerprint = (
+            gq.version, id(gq.current), gq.start_time, gq.paused_at, gq.volume, gq.loop_mode,
+            gq.shuffle_seed, gq.audio_filter_name, gq.twenty_four_seven,
+        ) if gq else ()
+        if vc:
+            fingerprint += (vc.is_connected(), vc.is_playing(), vc.is_paused())
+        return (f"{self.state_epoch}-{guild_id}-{self._state_versions.get(guild_id, 0)}"
+                f"-{hash(fingerprint) & 0xFFFFFFFF:08x}")
+
+    def _emit_event(self, guild_id: int, event_type: str, data: dict | Callable[[], dict] | None = None):
         """Push an event to the dashboard EventBus. No-op if dashboard not running."""
+        self._touch_state(guild_id)
         event_bus = getattr(self.bot, "_dashboard_event_bus", None)
         if not event_bus:
             return
         if data is None:
-            data = self._build_player_state(guild_id)
+            # Built only if a client is subscribed. Queue contents travel as
+            # queue_delta events, not with every update.
+            data = functools.partial(self._build_player_state, guild_id, include_queue=False)
         event_bus.publish(guild_id, event_type, data)
 
-    def _build_player_state(self, guild_id: int) -> dict:
+    def _publish_queue_delta(self, guild_id: int, op: str, payload: dict):
+        """QueueManager listener: forward each mutation to the dashboard as a
+        versioned delta. Clients apply it when `version` is exactly one past
+        theirs and resync from the full state otherwise."""
+        gq = self.queue_manager.peek(guild_id)
+        if gq is None:
+            return
+        version = gq.version
+        self._emit_event(guild_id, "queue_delta", lambda: {
+            "version": version,
+            "ops": [{"op": op, **payload}],
+            "up_next": _song_state(gq.peek_next()),
+        })
+
+    def _build_player_state(self, guild_id: int, include_queue: bool = True) -> dict:
         gq = self.queue_manager.get(guild_id)
         guild = self.bot.get_guild(guild_id)
         vc = guild.voice_client if guild else None
-        current = None
-        if gq.current:
-            current = {
-                "title": gq.current.title,
-                "url": gq.current.url,
-                "duration": gq.current.duration,
-                "thumbnail": gq.current.thumbnail,
-                "requester": gq.current.requester,
-            }
-        elapsed = 0
-        if gq.start_time and gq.current:
-            elapsed = time.time() - gq.start_time
-        return {
-            "current": current,
-            "elapsed": elapsed,
+        state = {
+            "current": _song_state(gq.current),
+            # What plays next, which with shuffle on isn't the head of the queue
+            "up_next": _song_state(gq.peek_next()),
+            "elapsed": gq.position() if gq.current else 0,
             "paused": vc.is_paused() if vc else False,
             "playing": vc.is_playing() if vc else False,
             "volume": int(gq.volume * 100),
             "loop": gq.loop_mode.value,
+            "shuffle": gq.shuffled,
             "filter": gq.audio_filter_name,
-            "queue": [
-                {"title": s.title, "url": s.url, "duration": s.duration,
-                 "thumbnail": s.thumbnail, "requester": s.requester}
-                for s in gq.queue
-            ],
             "in_voice": vc is not None and vc.is_connected(),
             "timestamp": time.time(),
         }
+        if include_queue:
+            # First page only; the dashboard fetches the rest as it scrolls
+            page = self.api_queue_page(guild_id, 0, QUEUE_PAGE_SIZE)
+            state["queue"] = page["items"]
+            state["queue_total"] = page["total"]
+            state["version"] = page["version"]
+        return state
+
+    def api_queue_page(self, guild_id: int, offset: int = 0, limit: int = QUEUE_PAGE_SIZE) -> dict:
+        gq = self.queue_manager.get(guild_id)
+        offset = max(0, offset)
+        limit = max(0, min(limit, QUEUE_PAGE_MAX))
+        return {
+            "items": [_song_state(s) for s in gq.queue[offset:offset + limit]],
+            "offset": offset,
+            "total": len(gq.queue),
+            "version": gq.version,
+        }
+
+    async def _search(self, query: str, count: int, user_id: int | None = None, guild_id: int | None = None) -> list[dict]:
+        """YouTube search through the shared search cache, led by matching
+        tracks from the music library and the local index (which play
+        without extraction).
+
+        With a user and guild, a search that has to go to YouTube is charged
+        to their rate limit (raising RateLimited); cache hits are free."""
+        if user_id is not None and guild_id is not None and not self.search_cache.would_hit(query, count):
+            retry_after = self.rate_limiter.check(user_id, guild_id, "search")
+            if retry_after:
+                raise RateLimited(retry_after)
+        local_count = (count + 1) // 2
+        local = await self.library.search(query, local_count)
+        local += self.track_index.search(query, local_count - len(local))
+        remote = await self.search_cache.get(
+            query, count, lambda q, n: YTDLSource.search_results(q, count=n, loop=self.bot.loop)
+        )
+        seen = {r.get("cache_key") for r in local}
+        results = list(local)
+        for r in remote:
+            if CacheManager.extract_cache_key(r.get("webpage_url", "")) not in seen:
+                results.append(r)
+        return results[:count]
+
+    async def _create_source(self, gq: GuildQueue, song: Song, seek_to: int = 0) -> YTDLSource:
+        """Build an audio source for a song with the guild's volume and filter.
+        Songs resolved before (replays, seeks, filters, history, or any URL in
+        the track index) skip extraction when their audio is cached."""
+        if MusicLibrary.is_library_url(song.url):
+            found = await self.library.get(song.url)
+            if not found:
+                raise ValueError("Track is no longer in the music library")
+            path, data = found
+            return YTDLSource.create_local_source(
+                path, data=data, volume=gq.volume, seek_to=seek_to, audio_filter=gq.audio_filter,
+            )
+
+        metadata = song.source_data() if song.cache_key else None
+        if not song.cache_key and song.url.startswith(("http://", "https://")):
+            key = CacheManager.extract_cache_key(song.url)
+            metadata = self.track_index.get(key)
+            if metadata:
+                song.cache_key = key
+        source = await YTDLSource.create_source(
+            song.url or song.search_query,
+            loop=self.bot.loop,
+            volume=gq.volume,
+            seek_to=seek_to,
+            audio_filter=gq.audio_filter,
+            cache_manager=self.cache_manager,
+            cache_key=song.cache_key,
+            metadata=metadata,
+            http=self.http,
+        )
+        song.cache_key = source.cache_key or song.cache_key
+        self.track_index.record(source.cache_key, source.data, cached=source.is_local)
+        return source
+
+    @staticmethod
+    def _track_id(song: Song) -> str:
+        """Stable ID for a song, resolved or not: its cache key, or the one its URL would get."""
+        if song.cache_key:
+            return song.cache_key
+        if song.url.startswith(("http://", "https://")):
+            return CacheManager.extract_cache_key(song.url)
+        if MusicLibrary.is_library_url(song.url):
+            return song.url
+        return ""
+
+    def _prefetch_lyrics(self, gq: GuildQueue):
+        """Warm the lyrics cache for the track after the one that just started."""
+        upcoming = gq.peek_next()
+        if upcoming and upcoming is not gq.current:
+            self.lyrics_fetcher.prefetch(upcoming.title, self._track_id(upcoming))
+
+    @staticmethod
+    def _is_repeat(gq: GuildQueue, cache_key: str) -> bool:
+        """True if no-repeat is on and this track is in the guild's recent history."""
+        if not gq.no_repeat or gq.loop_mode != LoopMode.OFF or not cache_key:
+            return False
+        return cache_key in gq.history
 
     async def _ensure_settings(self, guild_id: int):
         if guild_id in self._loaded_guilds:
             return
         self._loaded_guilds.add(guild_id)
-        saved = await self.settings.load(guild_id)
+        saved = self.settings.get(guild_id)
         if saved:
             gq = self.queue_manager.get(guild_id)
             gq.volume = saved["volume"]
             gq.twenty_four_seven = saved["twenty_four_seven"]
-            log.info("Loaded settings for guild %d: volume=%.2f, 24/7=%s", guild_id, gq.volume, gq.twenty_four_seven)
+            gq.loop_mode = LoopMode(saved["loop_mode"])
+            self._touch_state(guild_id)
+            log.info("Loaded settings for guild %d: volume=%.2f, 24/7=%s, loop=%s",
+                     guild_id, gq.volume, gq.twenty_four_seven, gq.loop_mode.value)
 
     async def _play_song(self, ctx: commands.Context, song: Song):
         await self._ensure_settings(ctx.guild.id)
@@ -303,25 +620,33 @@ class Music(commands.Cog):
         gq.skip_votes.clear()
 
         log.info("[Guild %d] Playing: %s (query=%s)", ctx.guild.id, song.title, song.url or song.search_query)
+        # Known tracks are checked before extraction; search queries only once resolved
+        track_id = self._track_id(song)
+        if self._is_repeat(gq, track_id):
+            log.info("[Guild %d] No-repeat: skipping recently played %s", ctx.guild.id, song.title)
+            await ctx.send(f"Skipping **{song.title}** (played recently).")
+            self._play_next(ctx)
+            return
         try:
-            source = await YTDLSource.create_source(
-                song.url or song.search_query,
-                loop=self.bot.loop,
-                volume=gq.volume,
-                audio_filter=gq.audio_filter,
-                cache_manager=self.cache_manager,
-            )
+            source = await self._create_source(gq, song)
         except Exception as e:
             log.error("[Guild %d] Failed to create source for '%s': %s", ctx.guild.id, song.title, e)
             await ctx.send(f"Error playing **{song.title}**: {e}")
             self._play_next(ctx)
             return
 
+        if not track_id and self._is_repeat(gq, source.cache_key):
+            source.cleanup()
+            log.info("[Guild %d] No-repeat: skipping recently played %s", ctx.guild.id, source.title)
+            await ctx.send(f"Skipping **{source.title}** (played recently).")
+            self._play_next(ctx)
+            return
+
         song.title = source.title
         song.duration = source.duration
         song.thumbnail = source.thumbnail
         song.url = source.webpage_url
-        gq.start_time = time.time()
+        gq.set_position(0)
         log.info("[Guild %d] Now playing: %s (%s)", ctx.guild.id, song.title, format_duration(song.duration))
 
         def after_play(error):
@@ -330,8 +655,9 @@ class Music(commands.Cog):
             asyncio.run_coroutine_threadsafe(self._play_next_async(ctx), self.bot.loop)
 
         ctx.voice_client.play(source, after=after_play)
+        self._cancel_idle_timer(ctx.guild.id)
         self._emit_event(ctx.guild.id, "player_update")
-        self._emit_event(ctx.guild.id, "queue_update")
+        self._prefetch_lyrics(gq)
 
         # Set voice channel status
         vc_status = f"🎵 {song.title}"
@@ -370,6 +696,7 @@ class Music(commands.Cog):
             await self._play_song(ctx, next_song)
         else:
             log.info("[Guild %d] Queue empty, playback finished", ctx.guild.id)
+            self._update_idle_timer(ctx.guild.id)
             self._emit_event(ctx.guild.id, "player_update")
             if ctx.voice_client:
                 await self._set_vc_status(ctx.voice_client, None)
@@ -390,25 +717,78 @@ class Music(commands.Cog):
         needed = len(members) // 2 + 1
         return len(gq.skip_votes) >= needed, len(gq.skip_votes), needed
 
-    @tasks.loop(seconds=30)
-    async def auto_disconnect_task(self):
+    # --- Idle disconnect ---
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        # Drop the deadline when the bot leaves voice some other way (stop, leave, kicked)
+        if member.id == self.bot.user.id and before.channel and not after.channel:
+            self._cancel_idle_timer(member.guild.id)
+
+    def _idle_voice_client(self, guild_id: int) -> discord.VoiceClient | None:
+        """The guild's voice client if it has nothing playing, paused or queued and isn't 24/7."""
+        guild = self.bot.get_guild(guild_id)
+        vc = guild.voice_client if guild else None
+        if not vc or vc.is_playing() or vc.is_paused():
+            return None
+        gq = self.queue_manager.peek(guild_id)
+        if gq and (gq.queue or gq.twenty_four_seven):
+            return None
+        return vc
+
+    def _update_idle_timer(self, guild_id: int):
+        """Arm the guild's idle-disconnect timer if it's idle, cancel it otherwise."""
+        if self._idle_voice_client(guild_id) is None:
+            self._cancel_idle_timer(guild_id)
+        elif guild_id not in self._idle_timers:
+            self._idle_timers[guild_id] = asyncio.get_running_loop().call_later(
+                IDLE_TIMEOUT, self._on_idle_timeout, guild_id
+            )
+
+    def _cancel_idle_timer(self, guild_id: int):
+        handle = self._idle_timers.pop(guild_id, None)
+        if handle:
+            handle.cancel()
+
+    def _on_idle_timeout(self, guild_id: int):
+        self._idle_timers.pop(guild_id, None)
+        # Re-checked in case playback changed without going through the timer
+        vc = self._idle_voice_client(guild_id)
+        if vc:
+            asyncio.create_task(self._idle_disconnect(guild_id, vc))
+
+    async def _idle_disconnect(self, guild_id: int, vc: discord.VoiceClient):
+        log.info("[Guild %d] Auto-disconnecting after %d min idle", guild_id, IDLE_TIMEOUT // 60)
+        gq = self.queue_manager.peek(guild_id)
+        if gq:
+            gq.clear()
+        self.queue_manager.remove(guild_id)
+        self._loaded_guilds.discard(guild_id)
+        await self._set_vc_status(vc, None)
+        await vc.disconnect()
+
+    @tasks.loop(seconds=10)
+    async def queue_persist_task(self):
+        """Flush the queue journal and record the playback position of every
+        active guild; also writes buffered settings and track index changes."""
+        now = time.time()
+        sessions = []
         for vc in self.bot.voice_clients:
-            gq = self.queue_manager.get(vc.guild.id)
-            if gq.twenty_four_seven:
+            gq = self.queue_manager.peek(vc.guild.id)
+            if not gq or not gq.current or not vc.channel:
                 continue
-            if not vc.is_playing() and not vc.is_paused() and not gq.queue:
-                if gq.start_time and (time.time() - gq.start_time) > 600:
-                    log.info("[Guild %d] Auto-disconnecting after 10min idle", vc.guild.id)
-                    gq.clear()
-                    self.queue_manager.remove(vc.guild.id)
-                    self._loaded_guilds.discard(vc.guild.id)
-                    await self._set_vc_status(vc, None)
-                    await vc.disconnect()
-                elif not gq.current and not gq.start_time:
-                    pass  # just connected, no timeout yet
-
-    @auto_disconnect_task.before_loop
-    async def before_auto_disconnect(self):
+            position = gq.position(now)
+            sessions.append((
+                vc.guild.id, vc.channel.id, position, int(vc.is_paused()),
+                gq.loop_mode.value, gq.audio_filter, gq.audio_filter_name, now,
+            ))
+        await self.queue_store.flush(self.queue_manager)
+        await self.queue_store.save_sessions(sessions)
+        await self.settings.flush()
+        await self.track_index.flush()
+
+    @queue_persist_task.before_loop
+    async def before_queue_persist(self):
         await self.bot.wait_until_ready()
 
     # --- Commands ---
@@ -416,10 +796,9 @@ class Music(commands.Cog):
     async def _youtube_suggestions(self, query: str) -> list[str]:
         url = "https://suggestqueries.google.com/complete/search"
         params = {"client": "firefox", "ds": "yt", "q": query}
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=2)) as resp:
-                data = await resp.json(content_type=None)
-                return data[1] if len(data) > 1 else []
+        async with self.http.get(url, params=params, timeout=aiohttp.ClientTimeout(total=2)) as resp:
+            data = await resp.json(content_type=None)
+            return data[1] if len(data) > 1 else []
 
     async def _spotify_suggestions(self, query: str, limit: int = 5) -> list[app_commands.Choice[str]]:
         if not self.spotify.sp:
@@ -439,31 +818,97 @@ class Music(commands.Cog):
             choices.append(app_commands.Choice(name=name[:100], value=f"https://open.spotify.com/album/{album['id']}"))
         return choices
 
-    async def play_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
-        if len(current) < 2:
-            return []
-        try:
-            yt_task = self._youtube_suggestions(current)
-            sp_task = self._spotify_suggestions(current, limit=5)
-            yt_results, sp_results = await asyncio.gather(yt_task, sp_task, return_exceptions=True)
-
-            choices: list[app_commands.Choice[str]] = []
+    async def _remote_suggestions(self, query: str, count: int) -> list[dict]:
+        """YouTube + Spotify suggestions as {"title", "value"} dicts (the
+        form kept in suggest_cache). Raises if YouTube failed, so a partial
+        answer isn't cached."""
+        yt_results, sp_results = await asyncio.gather(
+            self._youtube_suggestions(query),
+            self._spotify_suggestions(query, limit=5),
+            return_exceptions=True,
+        )
+        if isinstance(yt_results, BaseException):
+            raise yt_results
+
+        suggestions = []
+        max_yt = count - (len(sp_results) if isinstance(sp_results, list) else 0)
+        for s in yt_results[:max_yt]:
+            suggestions.append({"title": f"YouTube: {s}"[:100], "value": s})
+        if isinstance(sp_results, list):
+            suggestions.extend({"title": c.name, "value": c.value} for c in sp_results)
+        return suggestions[:count]
+
+    def _index_suggestions(self, query: str, count: int) -> list[dict]:
+        """Suggestions from the local track index, cached tracks first."""
+        return [
+            {"title": f"{'Cached' if r['cached'] else 'Played'}: {r['title']}"[:100], "value": r["webpage_url"]}
+            for r in self.track_index.search(query, count)
+            if len(r["webpage_url"]) <= 100
+        ]
 
-            # YouTube suggestions
-            if isinstance(yt_results, list):
-                max_yt = 10 - (len(sp_results) if isinstance(sp_results, list) else 0)
-                for s in yt_results[:max_yt]:
-                    choices.append(app_commands.Choice(name=f"YouTube: {s}"[:100], value=s))
+    async def _library_suggestions(self, query: str, count: int) -> list[dict]:
+        return [
+            {"title": f"Library: {r['title']}"[:100], "value": r["webpage_url"]}
+            for r in await self.library.search(query, count)
+        ]
 
-            # Spotify suggestions
-            if isinstance(sp_results, list):
-                choices.extend(sp_results)
+    def _local_suggestions(self, guild_id: int, query: str, count: int) -> list[dict]:
+        """Suggestions from what's already in memory: the track index, cached
+        suggestions and search results, then the guild's recently played tracks."""
+        suggestions = self._index_suggestions(query, count)
+        suggestions.extend(self.suggest_cache.matching(query, count))
+        for r in self.search_cache.matching(query, count):
+            suggestions.append({"title": f"YouTube: {r['title']}"[:100], "value": r["webpage_url"]})
+        gq = self.queue_manager.peek(guild_id)
+        if gq:
+            words = SearchCache.normalize(query).split()
+            for song in gq.history.recent():
+                if all(word in song.title.lower() for word in words):
+                    suggestions.append({"title": f"Recent: {song.title}"[:100], "value": song.url or song.search_query})
+
+        unique, seen = [], set()
+        for s in suggestions:
+            # Choice values are capped at 100 characters too
+            if s["value"] and len(s["value"]) <= 100 and s["value"] not in seen:
+                seen.add(s["value"])
+                unique.append(s)
+        return unique[:count]
+
+    def _autocomplete_done(self, task: asyncio.Task):
+        self._autocomplete_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.debug("Autocomplete lookup failed: %s", task.exception())
 
-            return choices[:10]
-        except Exception:
+    async def play_autocomplete(self, interaction: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+        if len(current) < 2:
             return []
+        user_id = interaction.user.id
+        seq = next(self._autocomplete_seq)
+        self._autocomplete_latest[user_id] = seq
+        # The lookup runs in its own task and is never cancelled: if this
+        # keystroke times out or is superseded, the result still lands in
+        # suggest_cache for the next one
+        task = asyncio.create_task(self.suggest_cache.get(current, AUTOCOMPLETE_LIMIT, self._remote_suggestions))
+        self._autocomplete_tasks.add(task)
+        task.add_done_callback(self._autocomplete_done)
+
+        library = await self._library_suggestions(current, AUTOCOMPLETE_LIMIT // 2)
+        done, _ = await asyncio.wait({task}, timeout=AUTOCOMPLETE_BUDGET)
+        if self._autocomplete_latest.get(user_id) != seq:
+            # A newer keystroke is being answered; Discord ignores this one
+            return []
+        del self._autocomplete_latest[user_id]
+        if task in done and not task.cancelled() and task.exception() is None:
+            # Library and indexed tracks lead, since they can start playing without extraction
+            suggestions = library + self._index_suggestions(current, AUTOCOMPLETE_LIMIT // 2 - len(library))
+            seen = {s["value"] for s in suggestions}
+            suggestions.extend(s for s in task.result() if s["value"] not in seen)
+        else:
+            suggestions = library + self._local_suggestions(interaction.guild_id, current, AUTOCOMPLETE_LIMIT)
+        return [app_commands.Choice(name=s["title"], value=s["value"]) for s in suggestions[:AUTOCOMPLETE_LIMIT]]
 
     @commands.hybrid_command(name="play", description="Play a song from YouTube, Spotify, SoundCloud, or search")
+    @rate_limited("add")
     @app_commands.autocomplete(query=play_autocomplete)
     async def play(self, ctx: commands.Context, *, query: str):
         if ctx.interaction:
@@ -474,6 +919,9 @@ class Music(commands.Cog):
 
         gq = self.queue_manager.get(ctx.guild.id)
 
+        if self.is_collection_url(query) and not await self._admit(ctx, "playlist"):
+            return
+
         # Spotify handling
         if SpotifyResolver.is_spotify_url(query):
             async with ctx.typing():
@@ -481,16 +929,15 @@ class Music(commands.Cog):
             if not searches:
                 await ctx.send("Could not resolve Spotify URL.")
                 return
-            for s, thumb in searches:
-                song = Song(title=s, url="", search_query=s, requester=ctx.author.display_name, thumbnail=thumb)
-                gq.add(song)
+            gq.extend([
+                Song(title=s, url="", search_query=s, requester=ctx.author.display_name, thumbnail=thumb)
+                for s, thumb in searches
+            ])
             await ctx.send(f"Added **{len(searches)}** track(s) from Spotify to the queue.")
             if not vc.is_playing() and not vc.is_paused():
                 next_song = gq.next()
                 if next_song:
                     await self._play_song(ctx, next_song)
-            else:
-                self._emit_event(ctx.guild.id, "queue_update")
             return
 
         # YouTube playlist handling
@@ -500,36 +947,35 @@ class Music(commands.Cog):
             if not entries:
                 await ctx.send("Could not extract playlist.")
                 return
-            for entry in entries:
-                song = Song(
+            gq.extend([
+                Song(
                     title=entry["title"],
                     url=entry["url"],
                     search_query=entry["title"],
                     requester=ctx.author.display_name,
                 )
-                gq.add(song)
+                for entry in entries
+            ])
             await ctx.send(f"Added **{len(entries)}** tracks from playlist to the queue.")
             if not vc.is_playing() and not vc.is_paused():
                 next_song = gq.next()
                 if next_song:
                     await self._play_song(ctx, next_song)
-            else:
-                self._emit_event(ctx.guild.id, "queue_update")
             return
 
         # Single track (URL or search)
-        song = Song(title=query, url=query, search_query=query, requester=ctx.author.display_name)
+        song = await self._make_song(query, ctx.author.display_name)
         gq.add(song)
 
         if vc.is_playing() or vc.is_paused():
-            self._emit_event(ctx.guild.id, "queue_update")
-            await ctx.send(f"Added **{query}** to the queue (position {len(gq.queue)}).")
+            await ctx.send(f"Added **{song.title}** to the queue (position {len(gq.queue)}).")
         else:
             next_song = gq.next()
             if next_song:
                 await self._play_song(ctx, next_song)
 
     @commands.hybrid_command(name="playtop", aliases=["pt"], description="Add a song to the top of the queue")
+    @rate_limited("add")
     @app_commands.autocomplete(query=play_autocomplete)
     async def playtop(self, ctx: commands.Context, *, query: str):
         if ctx.interaction:
@@ -542,13 +988,16 @@ class Music(commands.Cog):
 
         # If nothing is playing, just play normally
         if not vc.is_playing() and not vc.is_paused():
-            song = Song(title=query, url=query, search_query=query, requester=ctx.author.display_name)
+            song = await self._make_song(query, ctx.author.display_name)
             gq.add(song)
             next_song = gq.next()
             if next_song:
                 await self._play_song(ctx, next_song)
             return
 
+        if self.is_collection_url(query) and not await self._admit(ctx, "playlist"):
+            return
+
         # Spotify handling
         if SpotifyResolver.is_spotify_url(query):
             async with ctx.typing():
@@ -562,11 +1011,12 @@ class Music(commands.Cog):
             await ctx.send(f"Added **{len(searches)}** track(s) from Spotify to the top of the queue.")
             return
 
-        song = Song(title=query, url=query, search_query=query, requester=ctx.author.display_name)
+        song = await self._make_song(query, ctx.author.display_name)
         gq.add_top(song)
-        await ctx.send(f"Added **{query}** to the top of the queue.")
+        await ctx.send(f"Added **{song.title}** to the top of the queue.")
 
     @commands.hybrid_command(name="skip", description="Skip the current track")
+    @rate_limited("skip")
     async def skip(self, ctx: commands.Context):
         if not ctx.voice_client or not ctx.voice_client.is_playing():
             await ctx.send("Nothing is playing.")
@@ -583,10 +1033,44 @@ class Music(commands.Cog):
         else:
             await ctx.send(f"Vote skip: **{votes}/{needed}** votes needed.")
 
+    @commands.hybrid_command(name="previous", aliases=["prev", "back"], description="Go back to the previous track")
+    @rate_limited("skip")
+    async def previous(self, ctx: commands.Context):
+        if not ctx.voice_client:
+            await ctx.send("I'm not in a voice channel.")
+            return
+        if not self._check_dj(ctx):
+            await ctx.send("You need the DJ role to go back.")
+            return
+        gq = self.queue_manager.get(ctx.guild.id)
+        song = gq.previous()
+        if not song:
+            await ctx.send("There is no previous track.")
+            return
+        if ctx.voice_client.is_playing() or ctx.voice_client.is_paused():
+            # after_play advances the queue onto the previous track
+            ctx.voice_client.stop()
+        else:
+            next_song = gq.next()
+            if next_song:
+                await self._play_song(ctx, next_song)
+        await ctx.send(f"Going back to **{song.title}**.")
+
+    @commands.hybrid_command(name="norepeat", description="Toggle skipping tracks that were played recently")
+    async def norepeat(self, ctx: commands.Context):
+        if not self._check_dj(ctx):
+            await ctx.send("You need the DJ role to toggle no-repeat.")
+            return
+        gq = self.queue_manager.get(ctx.guild.id)
+        gq.no_repeat = not gq.no_repeat
+        state = "enabled" if gq.no_repeat else "disabled"
+        await ctx.send(f"No-repeat **{state}**. {'Recently played tracks will be skipped.' if gq.no_repeat else ''}".strip())
+
     @commands.hybrid_command(name="pause", description="Pause playback")
     async def pause(self, ctx: commands.Context):
         if ctx.voice_client and ctx.voice_client.is_playing():
             ctx.voice_client.pause()
+            self.queue_manager.get(ctx.guild.id).mark_paused()
             self._emit_event(ctx.guild.id, "player_update")
             await ctx.send("Paused.")
         else:
@@ -596,6 +1080,7 @@ class Music(commands.Cog):
     async def resume(self, ctx: commands.Context):
         if ctx.voice_client and ctx.voice_client.is_paused():
             ctx.voice_client.resume()
+            self.queue_manager.get(ctx.guild.id).mark_resumed()
             self._emit_event(ctx.guild.id, "player_update")
             await ctx.send("Resumed.")
         else:
@@ -648,7 +1133,17 @@ class Music(commands.Cog):
             entries = []
             for i, song in enumerate(gq.queue[:page_size], 1):
                 entries.append(f"`{i}.` [{song.title}]({song.url or 'searching'}) | Requested by {song.requester}")
-            embed.add_field(name="Up Next", value="\n".join(entries), inline=False)
+            if gq.shuffled:
+                # The list stays in queue order; shuffle only changes which entry plays next
+                up_next = gq.peek_next()
+                embed.add_field(
+                    name="Up Next (shuffled)",
+                    value=f"[{up_next.title}]({up_next.url or 'searching'}) | Requested by {up_next.requester}",
+                    inline=False,
+                )
+                embed.add_field(name="Queue (unshuffled order)", value="\n".join(entries), inline=False)
+            else:
+                embed.add_field(name="Up Next", value="\n".join(entries), inline=False)
             if len(gq.queue) > page_size:
                 embed.set_footer(text=f"And {len(gq.queue) - page_size} more...")
         else:
@@ -661,6 +1156,7 @@ class Music(commands.Cog):
         await ctx.send(embed=embed)
 
     @commands.hybrid_command(name="volume", description="Set the volume (0-100)")
+    @rate_limited("volume")
     async def volume(self, ctx: commands.Context, vol: int):
         if not self._check_dj(ctx):
             await ctx.send("You need the DJ role to change volume.")
@@ -673,7 +1169,7 @@ class Music(commands.Cog):
         gq.volume = vol / 100
         if ctx.voice_client and (ctx.voice_client.is_playing() or ctx.voice_client.is_paused()):
             await self._apply_filter(ctx)
-        await self.settings.save(ctx.guild.id, gq.volume, gq.twenty_four_seven)
+        self.settings.update(ctx.guild.id, volume=gq.volume, twenty_four_seven=gq.twenty_four_seven)
         self._emit_event(ctx.guild.id, "volume_update", {"volume": vol})
         await ctx.send(f"Volume set to **{vol}%**.")
 
@@ -684,7 +1180,7 @@ class Music(commands.Cog):
             await ctx.send("Nothing is playing.")
             return
 
-        elapsed = int(time.time() - gq.start_time) if gq.start_time else 0
+        elapsed = int(gq.position())
         duration = gq.current.duration
 
         # Progress bar
@@ -720,25 +1216,31 @@ class Music(commands.Cog):
         except ValueError:
             await ctx.send("Invalid loop mode. Choose `off`, `track`, or `queue`.")
             return
+        await self._ensure_settings(ctx.guild.id)
         gq = self.queue_manager.get(ctx.guild.id)
         gq.loop_mode = loop_mode
+        self.settings.update(ctx.guild.id, loop_mode=mode)
         self._emit_event(ctx.guild.id, "loop_update", {"loop": mode})
         await ctx.send(f"Loop mode set to **{mode}**.")
 
-    @commands.hybrid_command(name="shuffle", description="Shuffle the queue")
+    @commands.hybrid_command(name="shuffle", description="Toggle shuffle mode")
     async def shuffle(self, ctx: commands.Context):
         if not self._check_dj(ctx):
             await ctx.send("You need the DJ role to shuffle.")
             return
         gq = self.queue_manager.get(ctx.guild.id)
-        if not gq.queue:
+        if not gq.queue and not gq.shuffled:
             await ctx.send("The queue is empty.")
             return
-        gq.shuffle()
-        self._emit_event(ctx.guild.id, "queue_update")
-        await ctx.send("Queue shuffled.")
+        enabled = gq.shuffle()
+        self._emit_event(ctx.guild.id, "shuffle_update", {"shuffle": enabled})
+        if enabled:
+            await ctx.send("Shuffle **on**.")
+        else:
+            await ctx.send("Shuffle **off**. The queue is back in its original order.")
 
     @commands.hybrid_command(name="seek", description="Seek to a position (e.g. 1:30)")
+    @rate_limited("seek")
     async def seek(self, ctx: commands.Context, timestamp: str):
         if not ctx.voice_client or not ctx.voice_client.is_playing():
             await ctx.send("Nothing is playing.")
@@ -761,20 +1263,13 @@ class Music(commands.Cog):
         self._restarting.add(ctx.guild.id)
         ctx.voice_client.stop()
         try:
-            source = await YTDLSource.create_source(
-                gq.current.url or gq.current.search_query,
-                loop=self.bot.loop,
-                volume=gq.volume,
-                seek_to=seconds,
-                audio_filter=gq.audio_filter,
-                cache_manager=self.cache_manager,
-            )
+            source = await self._create_source(gq, gq.current, seek_to=seconds)
         except Exception as e:
             self._restarting.discard(ctx.guild.id)
             await ctx.send(f"Error seeking: {e}")
             return
 
-        gq.start_time = time.time() - seconds
+        gq.set_position(seconds)
         self._restarting.discard(ctx.guild.id)
 
         def after_play(error):
@@ -794,15 +1289,18 @@ class Music(commands.Cog):
         gq = self.queue_manager.get(ctx.guild.id)
         removed = gq.remove(position - 1)  # 1-indexed for users
         if removed:
-            self._emit_event(ctx.guild.id, "queue_update")
             await ctx.send(f"Removed **{removed.title}** from the queue.")
         else:
             await ctx.send("Invalid position.")
 
     @commands.hybrid_command(name="search", description="Search YouTube and pick a result")
     async def search(self, ctx: commands.Context, *, query: str):
-        async with ctx.typing():
-            results = await YTDLSource.search_results(query, count=5, loop=self.bot.loop)
+        try:
+            async with ctx.typing():
+                results = await self._search(query, 5, ctx.author.id, ctx.guild.id if ctx.guild else None)
+        except RateLimited as e:
+            await ctx.send(str(e), ephemeral=True)
+            return
 
         if not results:
             await ctx.send("No results found.")
@@ -830,6 +1328,7 @@ class Music(commands.Cog):
         await ctx.send(embed=embed, view=view)
 
     @commands.hybrid_command(name="lyrics", description="Show lyrics for the current track")
+    @rate_limited("lyrics")
     async def lyrics(self, ctx: commands.Context):
         gq = self.queue_manager.get(ctx.guild.id)
         if not gq.current:
@@ -837,7 +1336,7 @@ class Music(commands.Cog):
             return
 
         async with ctx.typing():
-            lyrics = await self.lyrics_fetcher.fetch_lyrics(gq.current.title)
+            lyrics = await self.lyrics_fetcher.fetch_lyrics(gq.current.title, self._track_id(gq.current))
 
         if not lyrics:
             await ctx.send(f"No lyrics found for **{gq.current.title}**.")
@@ -863,25 +1362,18 @@ class Music(commands.Cog):
         if not ctx.voice_client or (not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused()):
             return
 
-        elapsed = int(time.time() - gq.start_time) if gq.start_time else 0
+        elapsed = int(gq.position())
         self._restarting.add(ctx.guild.id)
         ctx.voice_client.stop()
 
         try:
-            source = await YTDLSource.create_source(
-                gq.current.url or gq.current.search_query,
-                loop=self.bot.loop,
-                volume=gq.volume,
-                seek_to=elapsed,
-                audio_filter=gq.audio_filter,
-                cache_manager=self.cache_manager,
-            )
+            source = await self._create_source(gq, gq.current, seek_to=elapsed)
         except Exception as e:
             self._restarting.discard(ctx.guild.id)
             await ctx.send(f"Error applying filter: {e}")
             return
 
-        gq.start_time = time.time() - elapsed
+        gq.set_position(elapsed)
         self._restarting.discard(ctx.guild.id)
 
         def after_play(error):
@@ -893,6 +1385,7 @@ class Music(commands.Cog):
         self._emit_event(ctx.guild.id, "player_update")
 
     @commands.hybrid_command(name="nightcore", description="Apply nightcore effect (speed up + pitch up)")
+    @rate_limited("filter")
     async def nightcore(self, ctx: commands.Context):
         if not ctx.voice_client or (not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused()):
             await ctx.send("Nothing is playing.")
@@ -904,6 +1397,7 @@ class Music(commands.Cog):
         await ctx.send("Applied **Nightcore** effect.")
 
     @commands.hybrid_command(name="vaporwave", description="Apply vaporwave effect (slow down + pitch down)")
+    @rate_limited("filter")
     async def vaporwave(self, ctx: commands.Context):
         if not ctx.voice_client or (not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused()):
             await ctx.send("Nothing is playing.")
@@ -915,6 +1409,7 @@ class Music(commands.Cog):
         await ctx.send("Applied **Vaporwave** effect.")
 
     @commands.hybrid_command(name="bassboost", description="Boost bass frequencies")
+    @rate_limited("filter")
     async def bassboost(self, ctx: commands.Context):
         if not ctx.voice_client or (not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused()):
             await ctx.send("Nothing is playing.")
@@ -926,6 +1421,7 @@ class Music(commands.Cog):
         await ctx.send("Applied **Bass Boost** effect.")
 
     @commands.hybrid_command(name="speed", description="Change playback speed (0.5-2.0)")
+    @rate_limited("filter")
     async def speed(self, ctx: commands.Context, rate: float):
         if not ctx.voice_client or (not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused()):
             await ctx.send("Nothing is playing.")
@@ -940,6 +1436,7 @@ class Music(commands.Cog):
         await ctx.send(f"Applied **Speed {rate}x** effect.")
 
     @commands.hybrid_command(name="tremolo", description="Apply tremolo effect (volume oscillation)")
+    @rate_limited("filter")
     async def tremolo(self, ctx: commands.Context):
         if not ctx.voice_client or (not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused()):
             await ctx.send("Nothing is playing.")
@@ -951,6 +1448,7 @@ class Music(commands.Cog):
         await ctx.send("Applied **Tremolo** effect.")
 
     @commands.hybrid_command(name="vibrato", description="Apply vibrato effect (pitch oscillation)")
+    @rate_limited("filter")
     async def vibrato(self, ctx: commands.Context):
         if not ctx.voice_client or (not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused()):
             await ctx.send("Nothing is playing.")
@@ -962,6 +1460,7 @@ class Music(commands.Cog):
         await ctx.send("Applied **Vibrato** effect.")
 
     @commands.hybrid_command(name="8d", description="Apply 8D audio effect (stereo rotation)")
+    @rate_limited("filter")
     async def eightd(self, ctx: commands.Context):
         if not ctx.voice_client or (not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused()):
             await ctx.send("Nothing is playing.")
@@ -973,6 +1472,7 @@ class Music(commands.Cog):
         await ctx.send("Applied **8D** audio effect.")
 
     @commands.hybrid_command(name="cleareffect", description="Remove all audio effects")
+    @rate_limited("filter")
     async def cleareffect(self, ctx: commands.Context):
         gq = self.queue_manager.get(ctx.guild.id)
         if not gq.audio_filter:
@@ -981,6 +1481,7 @@ class Music(commands.Cog):
         if not ctx.voice_client or (not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused()):
             gq.audio_filter = ""
             gq.audio_filter_name = ""
+            self._emit_event(ctx.guild.id, "player_update")
             await ctx.send("Cleared audio effects.")
             return
         gq.audio_filter = ""
@@ -1007,6 +1508,21 @@ class Music(commands.Cog):
         await self.cache_manager.clear_all()
         await ctx.send("Audio cache cleared.")
 
+    @commands.hybrid_command(name="rescan", description="Rescan the local music library")
+    async def rescan(self, ctx: commands.Context):
+        if not self._check_dj(ctx):
+            await ctx.send("You need the DJ role to rescan the library.")
+            return
+        if not self.library.enabled:
+            await ctx.send("No music library is configured.")
+            return
+        async with ctx.typing():
+            result = await self.library.scan()
+        await ctx.send(
+            f"Library rescanned in {result['seconds']}s: **{result['added']}** added, "
+            f"**{result['updated']}** updated, **{result['removed']}** removed ({result['total']} tracks)."
+        )
+
     @commands.hybrid_command(name="247", description="Toggle 24/7 mode (stay in voice channel)")
     async def twenty_four_seven(self, ctx: commands.Context):
         if not self._check_dj(ctx):
@@ -1015,7 +1531,9 @@ class Music(commands.Cog):
         await self._ensure_settings(ctx.guild.id)
         gq = self.queue_manager.get(ctx.guild.id)
         gq.twenty_four_seven = not gq.twenty_four_seven
-        await self.settings.save(ctx.guild.id, gq.volume, gq.twenty_four_seven)
+        self._update_idle_timer(ctx.guild.id)
+        self._touch_state(ctx.guild.id)
+        self.settings.update(ctx.guild.id, volume=gq.volume, twenty_four_seven=gq.twenty_four_seven)
         state = "enabled" if gq.twenty_four_seven else "disabled"
         await ctx.send(f"24/7 mode **{state}**. {'I will stay in the voice channel.' if gq.twenty_four_seven else 'I will auto-disconnect after inactivity.'}")
 
@@ -1027,12 +1545,15 @@ class Music(commands.Cog):
         if not guild or not guild.voice_client:
             return {"error": "Not in a voice channel"}
         vc = guild.voice_client
+        gq = self.queue_manager.get(guild_id)
         if vc.is_playing():
             vc.pause()
+            gq.mark_paused()
             self._emit_event(guild_id, "player_update")
             return {"status": "paused"}
         elif vc.is_paused():
             vc.resume()
+            gq.mark_resumed()
             self._emit_event(guild_id, "player_update")
             return {"status": "resumed"}
         return {"error": "Nothing is playing"}
@@ -1047,6 +1568,23 @@ class Music(commands.Cog):
         vc.stop()
         return {"status": "skipped"}
 
+    async def api_previous(self, guild_id: int) -> dict:
+        guild = self.bot.get_guild(guild_id)
+        if not guild or not guild.voice_client:
+            return {"error": "Not in a voice channel"}
+        gq = self.queue_manager.get(guild_id)
+        song = gq.previous()
+        if not song:
+            return {"error": "There is no previous track"}
+        vc = guild.voice_client
+        if vc.is_playing() or vc.is_paused():
+            vc.stop()
+        else:
+            next_song = gq.next()
+            if next_song:
+                await self._api_play_song(guild_id, next_song)
+        return {"status": "ok", "title": song.title}
+
     async def api_stop(self, guild_id: int) -> dict:
         guild = self.bot.get_guild(guild_id)
         if not guild or not guild.voice_client:
@@ -1076,19 +1614,12 @@ class Music(commands.Cog):
         self._restarting.add(guild_id)
         vc.stop()
         try:
-            source = await YTDLSource.create_source(
-                gq.current.url or gq.current.search_query,
-                loop=self.bot.loop,
-                volume=gq.volume,
-                seek_to=position,
-                audio_filter=gq.audio_filter,
-                cache_manager=self.cache_manager,
-            )
+            source = await self._create_source(gq, gq.current, seek_to=position)
         except Exception as e:
             self._restarting.discard(guild_id)
             return {"error": str(e)}
 
-        gq.start_time = time.time() - position
+        gq.set_position(position)
         self._restarting.discard(guild_id)
 
         def after_play(error):
@@ -1110,29 +1641,22 @@ class Music(commands.Cog):
         guild = self.bot.get_guild(guild_id)
         vc = guild.voice_client if guild else None
         if vc and gq.current and (vc.is_playing() or vc.is_paused()):
-            elapsed = int(time.time() - gq.start_time) if gq.start_time else 0
+            elapsed = int(gq.position())
             self._restarting.add(guild_id)
             vc.stop()
             try:
-                source = await YTDLSource.create_source(
-                    gq.current.url or gq.current.search_query,
-                    loop=self.bot.loop,
-                    volume=gq.volume,
-                    seek_to=elapsed,
-                    audio_filter=gq.audio_filter,
-                    cache_manager=self.cache_manager,
-                )
+                source = await self._create_source(gq, gq.current, seek_to=elapsed)
             except Exception as e:
                 self._restarting.discard(guild_id)
                 return {"error": str(e)}
-            gq.start_time = time.time() - elapsed
+            gq.set_position(elapsed)
             self._restarting.discard(guild_id)
             def after_play(error):
                 if error:
                     log.error("[Guild %d] Playback error: %s", guild_id, error)
                 asyncio.run_coroutine_threadsafe(self._api_play_next(guild_id), self.bot.loop)
             vc.play(source, after=after_play)
-        await self.settings.save(guild_id, gq.volume, gq.twenty_four_seven)
+        self.settings.update(guild_id, volume=gq.volume, twenty_four_seven=gq.twenty_four_seven)
         self._emit_event(guild_id, "volume_update", {"volume": vol})
         return {"status": "ok", "volume": vol}
 
@@ -1141,34 +1665,72 @@ class Music(commands.Cog):
             loop_mode = LoopMode(mode)
         except ValueError:
             return {"error": "Invalid loop mode"}
+        await self._ensure_settings(guild_id)
         gq = self.queue_manager.get(guild_id)
         gq.loop_mode = loop_mode
+        self.settings.update(guild_id, loop_mode=mode)
         self._emit_event(guild_id, "loop_update", {"loop": mode})
         return {"status": "ok", "loop": mode}
 
     async def api_shuffle(self, guild_id: int) -> dict:
         gq = self.queue_manager.get(guild_id)
-        if not gq.queue:
+        if not gq.queue and not gq.shuffled:
             return {"error": "Queue is empty"}
-        gq.shuffle()
-        self._emit_event(guild_id, "queue_update")
-        return {"status": "shuffled"}
+        enabled = gq.shuffle()
+        self._emit_event(guild_id, "shuffle_update", {"shuffle": enabled})
+        return {"status": "ok", "shuffle": enabled}
 
     async def api_remove(self, guild_id: int, index: int) -> dict:
         gq = self.queue_manager.get(guild_id)
         removed = gq.remove(index)
         if removed:
-            self._emit_event(guild_id, "queue_update")
             return {"status": "removed", "title": removed.title}
         return {"error": "Invalid index"}
 
     async def api_move(self, guild_id: int, from_idx: int, to_idx: int) -> dict:
         gq = self.queue_manager.get(guild_id)
         if gq.move(from_idx, to_idx):
-            self._emit_event(guild_id, "queue_update")
             return {"status": "moved"}
         return {"error": "Invalid indices"}
 
+    async def api_batch(self, guild_id: int, operations: list, requester: str) -> dict:
+        """Apply several queue edits atomically and emit a single queue_delta.
+
+        Supported ops: {"op": "remove", "index"}, {"op": "move", "from", "to"},
+        {"op": "add" | "add_top", "query", "title"?, "thumbnail"?, "duration"?}.
+        Adds take a single URL or search; Spotify/playlist URLs are not expanded."""
+        ops = []
+        for op in operations:
+            if not isinstance(op, dict):
+                return {"error": "Invalid operation"}
+            kind = op.get("op")
+            if kind in ("add", "add_top"):
+                query = op.get("query")
+                if not query or not isinstance(query, str):
+                    return {"error": "Missing query"}
+                # Field types are checked by apply_batch
+                song = Song(title=op.get("title") or query, url=query, search_query=query, requester=requester,
+                            thumbnail=op.get("thumbnail") or "", duration=op.get("duration") or 0)
+                ops.append({"op": "insert", "index": 0 if kind == "add_top" else None, "songs": [song.to_dict()]})
+            elif kind in ("remove", "move"):
+                ops.append(op)
+            else:
+                return {"error": f"Unknown operation: {kind}"}
+
+        gq = self.queue_manager.get(guild_id)
+        err = gq.apply_batch(ops)
+        if err:
+            return {"error": err}
+
+        guild = self.bot.get_guild(guild_id)
+        vc = guild.voice_client if guild else None
+        if vc and not vc.is_playing() and not vc.is_paused() and gq.queue:
+            next_song = gq.next()
+            if next_song:
+                await self._api_play_song(guild_id, next_song)
+
+        return {"status": "ok", "version": gq.version, "applied": len(ops)}
+
     async def api_add_to_queue(self, guild_id: int, query: str, requester: str, top: bool = False, title: str | None = None, thumbnail: str | None = None, duration: int | None = None) -> dict:
         guild = self.bot.get_guild(guild_id)
         if not guild or not guild.voice_client:
@@ -1187,7 +1749,6 @@ class Music(commands.Cog):
                     gq.add_top(song)
                 else:
                     gq.add(song)
-            self._emit_event(guild_id, "queue_update")
 
             vc = guild.voice_client
             if not vc.is_playing() and not vc.is_paused():
@@ -1203,7 +1764,6 @@ class Music(commands.Cog):
             gq.add_top(song)
         else:
             gq.add(song)
-        self._emit_event(guild_id, "queue_update")
 
         vc = guild.voice_client
         if not vc.is_playing() and not vc.is_paused():
@@ -1213,8 +1773,105 @@ class Music(commands.Cog):
 
         return {"status": "added", "count": 1}
 
-    async def api_search(self, query: str) -> list[dict]:
-        results = await YTDLSource.search_results(query, count=10, loop=self.bot.loop)
+    async def api_export_queue(self, guild_id: int):
+        """Yield the current track and queue as NDJSON lines, a chunk at a time."""
+        gq = self.queue_manager.get(guild_id)
+        songs = ([gq.current] if gq.current else []) + list(gq.queue)
+        for i in range(0, len(songs), IMPORT_BATCH_SIZE):
+            lines = []
+            for song in songs[i:i + IMPORT_BATCH_SIZE]:
+                url = song.url if song.url.startswith(("http://", "https://")) else ""
+                lines.append(json.dumps({
+                    "title": song.title,
+                    "url": url,
+                    "query": song.search_query,
+                    "duration": song.duration,
+                    "requester": song.requester,
+                }))
+            yield ("\n".join(lines) + "\n").encode()
+            await asyncio.sleep(0)
+
+    async def api_import_queue(self, guild_id: int, body, requester: str) -> dict:
+        """Enqueue NDJSON lines (title, url, duration, requester) as they stream in.
+
+        Songs are appended in batches, so memory stays bounded by one batch and
+        the event loop gets a turn between batches. URLs whose audio is already
+        cached are pre-resolved so they play without extraction. A line over
+        IMPORT_MAX_LINE ends the import: lines before it are kept (and start
+        playing), and the error is reported alongside the counts."""
+        gq = self.queue_manager.get(guild_id)
+        imported = skipped = 0
+        error = None
+        batch: list[Song] = []
+        buffer = b""
+
+        async def enqueue(songs: list[Song]):
+            keys = {s.url: CacheManager.extract_cache_key(s.url) for s in songs if s.url}
+            cached = await self.cache_manager.cached_keys(list(set(keys.values())))
+            for song in songs:
+                if keys.get(song.url) in cached:
+                    song.cache_key = keys[song.url]
+            gq.extend(songs)
+            await asyncio.sleep(0)
+
+        def parse(line: bytes) -> Song | None:
+            try:
+                entry = json.loads(line)
+                url = entry.get("url") or ""
+                query = entry.get("query") or url or entry["title"]
+                return Song(
+                    title=entry.get("title") or query,
+                    url=url,
+                    search_query=query,
+                    requester=entry.get("requester") or requester,
+                    duration=int(entry.get("duration") or 0),
+                )
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return None
+
+        async for chunk in body:
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if not line.strip():
+                    continue
+                song = parse(line)
+                if song is None:
+                    skipped += 1
+                    continue
+                batch.append(song)
+            if len(buffer) > IMPORT_MAX_LINE:
+                error = "Line too long"
+                buffer = b""
+                break
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                imported += len(batch)
+                await enqueue(batch)
+                batch = []
+        if buffer.strip():
+            song = parse(buffer)
+            if song is None:
+                skipped += 1
+            else:
+                batch.append(song)
+        if batch:
+            imported += len(batch)
+            await enqueue(batch)
+
+        if imported:
+            guild = self.bot.get_guild(guild_id)
+            vc = guild.voice_client if guild else None
+            if vc and not vc.is_playing() and not vc.is_paused():
+                next_song = gq.next()
+                if next_song:
+                    await self._api_play_song(guild_id, next_song)
+        log.info("[Guild %d] Imported %d track(s), skipped %d invalid line(s)", guild_id, imported, skipped)
+        if error:
+            return {"error": error, "imported": imported, "skipped": skipped}
+        return {"status": "ok", "imported": imported, "skipped": skipped}
+
+    async def api_search(self, query: str, user_id: int | None = None, guild_id: int | None = None) -> list[dict]:
+        results = await self._search(query, 10, user_id, guild_id)
         return [
             {
                 "title": r.get("title", "Unknown"),
@@ -1253,23 +1910,16 @@ class Music(commands.Cog):
             return {"error": f"Unknown filter: {filter_name}"}
 
         # Restart playback with new filter
-        elapsed = int(time.time() - gq.start_time) if gq.start_time else 0
+        elapsed = int(gq.position())
         self._restarting.add(guild_id)
         vc.stop()
         try:
-            source = await YTDLSource.create_source(
-                gq.current.url or gq.current.search_query,
-                loop=self.bot.loop,
-                volume=gq.volume,
-                seek_to=elapsed,
-                audio_filter=gq.audio_filter,
-                cache_manager=self.cache_manager,
-            )
+            source = await self._create_source(gq, gq.current, seek_to=elapsed)
         except Exception as e:
             self._restarting.discard(guild_id)
             return {"error": str(e)}
 
-        gq.start_time = time.time() - elapsed
+        gq.set_position(elapsed)
         self._restarting.discard(guild_id)
 
         def after_play(error):
@@ -1290,11 +1940,13 @@ class Music(commands.Cog):
                 gq.volume = vol / 100
         if "twenty_four_seven" in data:
             gq.twenty_four_seven = bool(data["twenty_four_seven"])
-        await self.settings.save(guild_id, gq.volume, gq.twenty_four_seven)
+            self._update_idle_timer(guild_id)
+        self._touch_state(guild_id)
+        self.settings.update(guild_id, volume=gq.volume, twenty_four_seven=gq.twenty_four_seven)
         return {"status": "ok"}
 
-    async def _api_play_song(self, guild_id: int, song: Song):
-        """Play a song without ctx (for dashboard API calls)."""
+    async def _api_play_song(self, guild_id: int, song: Song, seek_to: int = 0):
+        """Play a song without ctx (for dashboard API calls and session resume)."""
         await self._ensure_settings(guild_id)
         gq = self.queue_manager.get(guild_id)
         gq.current = song
@@ -1305,24 +1957,29 @@ class Music(commands.Cog):
             return
 
         vc = guild.voice_client
+        track_id = self._track_id(song)
+        if self._is_repeat(gq, track_id):
+            log.info("[Guild %d] No-repeat: skipping recently played %s", guild_id, song.title)
+            await self._api_play_next(guild_id)
+            return
         try:
-            source = await YTDLSource.create_source(
-                song.url or song.search_query,
-                loop=self.bot.loop,
-                volume=gq.volume,
-                audio_filter=gq.audio_filter,
-                cache_manager=self.cache_manager,
-            )
+            source = await self._create_source(gq, song, seek_to=seek_to)
         except Exception as e:
             log.error("[Guild %d] API play failed for '%s': %s", guild_id, song.title, e)
             await self._api_play_next(guild_id)
             return
 
+        if not track_id and self._is_repeat(gq, source.cache_key):
+            source.cleanup()
+            log.info("[Guild %d] No-repeat: skipping recently played %s", guild_id, source.title)
+            await self._api_play_next(guild_id)
+            return
+
         song.title = source.title
         song.duration = source.duration
         song.thumbnail = source.thumbnail
         song.url = source.webpage_url
-        gq.start_time = time.time()
+        gq.set_position(seek_to)
 
         def after_play(error):
             if error:
@@ -1330,8 +1987,9 @@ class Music(commands.Cog):
             asyncio.run_coroutine_threadsafe(self._api_play_next(guild_id), self.bot.loop)
 
         vc.play(source, after=after_play)
+        self._cancel_idle_timer(guild_id)
         self._emit_event(guild_id, "player_update")
-        self._emit_event(guild_id, "queue_update")
+        self._prefetch_lyrics(gq)
 
         vc_status = f"🎵 {song.title}"
         if len(vc_status) > 500:
@@ -1347,6 +2005,7 @@ class Music(commands.Cog):
         if next_song:
             await self._api_play_song(guild_id, next_song)
         else:
+            self._update_idle_timer(guild_id)
             self._emit_event(guild_id, "player_update")
             guild = self.bot.get_guild(guild_id)
             if guild and guild.voice_client:
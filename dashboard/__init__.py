@@ -7,8 +7,9 @@ from quart import Quart, redirect, session, url_for, render_template
 
 from dashboard.auth import auth_bp
 from dashboard.api import api_bp
-from dashboard.websocket import ws_bp
+from dashboard.websocket import ws_bp, _get_position
 from dashboard.events import EventBus
+from dashboard.guilds import GuildIndex
 
 log = logging.getLogger("bot.dashboard")
 
@@ -24,9 +25,10 @@ def create_app(bot) -> Quart:
     app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
 
     # Store bot reference and event bus
-    event_bus = EventBus()
+    event_bus = EventBus(heartbeat=lambda guild_id: _get_position(bot, guild_id))
     app.config["BOT"] = bot
     app.config["EVENT_BUS"] = event_bus
+    app.config["GUILD_INDEX"] = GuildIndex(bot)
     bot._dashboard_event_bus = event_bus
 
     # Register blueprints
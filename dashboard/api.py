@@ -1,8 +1,11 @@
 """REST API blueprint for the dashboard."""
 
+import functools
 import logging
+import math
 
-from quart import Blueprint, jsonify, request, session, current_app
+import discord
+from quart import Blueprint, Response, jsonify, request, session, current_app
 
 from dashboard.auth import require_auth_api
 
@@ -19,13 +22,16 @@ def _get_music_cog():
     return _get_bot().cogs.get("Music")
 
 
+def _get_guild_index():
+    return current_app.config["GUILD_INDEX"]
+
+
 def _check_guild_access(guild_id: int) -> str | None:
     """Return error message if user cannot access this guild, else None."""
-    user_guild_ids = {int(gid) for gid in session.get("guild_ids", [])}
-    bot_guild_ids = {g.id for g in _get_bot().guilds}
-    if guild_id not in user_guild_ids:
+    guild_index = _get_guild_index()
+    if guild_id not in guild_index.user_guilds().ids:
         return "You are not in this guild"
-    if guild_id not in bot_guild_ids:
+    if guild_id not in guild_index:
         return "Bot is not in this guild"
     return None
 
@@ -44,6 +50,65 @@ def require_guild_access(func):
     return wrapper
 
 
+def require_bot_owner(func):
+    """Decorator (after require_auth_api): only the bot's owner (or its team members)."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not await _get_bot().is_owner(discord.Object(id=int(session["user"]["id"]))):
+            return jsonify({"error": "Only the bot owner can view this"}), 403
+        return await func(*args, **kwargs)
+
+    return wrapper
+
+
+def rate_limited(action):
+    """Decorator (after require_guild_access): charge `action` to the user's and
+    guild's rate limit buckets, answering 429 with Retry-After when they're empty.
+    `action` may be an async callable taking the cog and returning the action name."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(guild_id: int, *args, **kwargs):
+            cog = _get_music_cog()
+            if cog:
+                name = action if isinstance(action, str) else await action(cog)
+                retry_after = cog.rate_limiter.check(session["user"]["id"], guild_id, name)
+                if retry_after:
+                    return _rate_limited_response(retry_after)
+            return await func(guild_id, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _rate_limited_response(retry_after: float) -> Response:
+    seconds = math.ceil(retry_after)
+    resp = jsonify({"error": "Rate limited", "retry_after": seconds})
+    resp.status_code = 429
+    resp.headers["Retry-After"] = str(seconds)
+    return resp
+
+
+async def _add_action(cog) -> str:
+    """Queue adds that expand to a whole playlist cost more than single tracks."""
+    data = await request.get_json(silent=True) or {}
+    return "playlist" if cog.is_collection_url(data.get("query", "")) else "add"
+
+
+def _conditional(etag: str, build) -> Response:
+    """JSON response tagged with `etag`. If the client already has it, answer
+    304 without calling `build`."""
+    if request.if_none_match.contains(etag):
+        resp = Response("", status=304)
+    else:
+        resp = jsonify(build())
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
 # --- User / Guild listing ---
 
 @api_bp.route("/@me")
@@ -55,19 +120,42 @@ async def me():
 @api_bp.route("/guilds")
 @require_auth_api
 async def guilds():
-    bot = _get_bot()
-    user_guild_ids = {int(gid) for gid in session.get("guild_ids", [])}
+    guild_index = _get_guild_index()
+    user_guilds = guild_index.user_guilds()
 
-    shared = []
-    for guild in bot.guilds:
-        if guild.id in user_guild_ids:
+    def build():
+        shared = []
+        for guild in guild_index.shared(user_guilds):
             icon_url = guild.icon.url if guild.icon else None
             shared.append({
                 "id": str(guild.id),
                 "name": guild.name,
                 "icon": icon_url,
             })
-    return jsonify(shared)
+        return shared
+
+    cog = _get_music_cog()
+    if not cog:
+        return jsonify(build())
+    return _conditional(f"{cog.state_epoch}-guilds-{cog.guilds_version}-{user_guilds.key}", build)
+
+
+@api_bp.route("/metrics")
+@require_auth_api
+@require_bot_owner
+async def metrics():
+    event_bus = current_app.config["EVENT_BUS"]
+    metrics = {"events": event_bus.stats()}
+    cog = _get_music_cog()
+    if cog:
+        metrics["search"] = cog.search_cache.stats()
+        metrics["suggest"] = cog.suggest_cache.stats()
+        metrics["tracks"] = cog.track_index.stats()
+        metrics["library"] = await cog.library.get_stats()
+        metrics["lyrics"] = cog.lyrics_fetcher.stats()
+        metrics["storage"] = cog.storage.stats()
+        metrics["ratelimit"] = cog.rate_limiter.stats()
+    return jsonify(metrics)
 
 
 # --- Player state ---
@@ -77,8 +165,10 @@ async def guilds():
 @require_guild_access
 async def player_state(guild_id: int):
     from dashboard.websocket import _get_player_state
-    state = _get_player_state(_get_bot(), guild_id)
-    return jsonify(state)
+    cog = _get_music_cog()
+    if not cog:
+        return jsonify({})
+    return _conditional(f"{cog.state_etag(guild_id)}-player", lambda: _get_player_state(_get_bot(), guild_id))
 
 
 @api_bp.route("/guild/<int:guild_id>/queue")
@@ -87,19 +177,15 @@ async def player_state(guild_id: int):
 async def queue_state(guild_id: int):
     cog = _get_music_cog()
     if not cog:
-        return jsonify([])
+        return jsonify({"error": "Music cog not loaded"}), 500
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", 100, type=int)
+    # Pages only change with the queue itself, not with the rest of the player state
     gq = cog.queue_manager.get(guild_id)
-    queue = [
-        {
-            "title": s.title,
-            "url": s.url,
-            "duration": s.duration,
-            "thumbnail": s.thumbnail,
-            "requester": s.requester,
-        }
-        for s in gq.queue
-    ]
-    return jsonify(queue)
+    return _conditional(
+        f"{cog.state_epoch}-{guild_id}-q{gq.version}-{offset}-{limit}",
+        lambda: cog.api_queue_page(guild_id, offset, limit),
+    )
 
 
 @api_bp.route("/guild/<int:guild_id>/settings")
@@ -110,7 +196,7 @@ async def get_settings(guild_id: int):
     if not cog:
         return jsonify({"error": "Music cog not loaded"}), 500
     gq = cog.queue_manager.get(guild_id)
-    return jsonify({
+    return _conditional(f"{cog.state_etag(guild_id)}-settings", lambda: {
         "volume": int(gq.volume * 100),
         "twenty_four_seven": gq.twenty_four_seven,
     })
@@ -132,6 +218,7 @@ async def pause_resume(guild_id: int):
 @api_bp.route("/guild/<int:guild_id>/player/skip", methods=["POST"])
 @require_auth_api
 @require_guild_access
+@rate_limited("skip")
 async def skip(guild_id: int):
     cog = _get_music_cog()
     if not cog:
@@ -140,6 +227,18 @@ async def skip(guild_id: int):
     return jsonify(result)
 
 
+@api_bp.route("/guild/<int:guild_id>/player/previous", methods=["POST"])
+@require_auth_api
+@require_guild_access
+@rate_limited("skip")
+async def previous(guild_id: int):
+    cog = _get_music_cog()
+    if not cog:
+        return jsonify({"error": "Music cog not loaded"}), 500
+    result = await cog.api_previous(guild_id)
+    return jsonify(result)
+
+
 @api_bp.route("/guild/<int:guild_id>/player/stop", methods=["POST"])
 @require_auth_api
 @require_guild_access
@@ -154,6 +253,7 @@ async def stop(guild_id: int):
 @api_bp.route("/guild/<int:guild_id>/player/seek", methods=["POST"])
 @require_auth_api
 @require_guild_access
+@rate_limited("seek")
 async def seek(guild_id: int):
     cog = _get_music_cog()
     if not cog:
@@ -167,6 +267,7 @@ async def seek(guild_id: int):
 @api_bp.route("/guild/<int:guild_id>/player/volume", methods=["POST"])
 @require_auth_api
 @require_guild_access
+@rate_limited("volume")
 async def volume(guild_id: int):
     cog = _get_music_cog()
     if not cog:
@@ -193,6 +294,7 @@ async def loop(guild_id: int):
 @api_bp.route("/guild/<int:guild_id>/player/filter", methods=["POST"])
 @require_auth_api
 @require_guild_access
+@rate_limited("filter")
 async def apply_filter(guild_id: int):
     cog = _get_music_cog()
     if not cog:
@@ -208,6 +310,7 @@ async def apply_filter(guild_id: int):
 @api_bp.route("/guild/<int:guild_id>/queue/add", methods=["POST"])
 @require_auth_api
 @require_guild_access
+@rate_limited(_add_action)
 async def queue_add(guild_id: int):
     cog = _get_music_cog()
     if not cog:
@@ -227,6 +330,7 @@ async def queue_add(guild_id: int):
 @api_bp.route("/guild/<int:guild_id>/queue/add-top", methods=["POST"])
 @require_auth_api
 @require_guild_access
+@rate_limited(_add_action)
 async def queue_add_top(guild_id: int):
     cog = _get_music_cog()
     if not cog:
@@ -257,6 +361,47 @@ async def queue_move(guild_id: int):
     return jsonify(result)
 
 
+@api_bp.route("/guild/<int:guild_id>/queue/batch", methods=["POST"])
+@require_auth_api
+@require_guild_access
+@rate_limited("batch")
+async def queue_batch(guild_id: int):
+    cog = _get_music_cog()
+    if not cog:
+        return jsonify({"error": "Music cog not loaded"}), 500
+    data = await request.get_json()
+    ops = (data or {}).get("ops")
+    if not isinstance(ops, list) or not ops:
+        return jsonify({"error": "Missing ops"}), 400
+    requester = session["user"]["username"]
+    result = await cog.api_batch(guild_id, ops, requester)
+    return jsonify(result)
+
+
+@api_bp.route("/guild/<int:guild_id>/queue/export")
+@require_auth_api
+@require_guild_access
+async def queue_export(guild_id: int):
+    cog = _get_music_cog()
+    if not cog:
+        return jsonify({"error": "Music cog not loaded"}), 500
+    headers = {"Content-Disposition": f'attachment; filename="queue-{guild_id}.ndjson"'}
+    return Response(cog.api_export_queue(guild_id), mimetype="application/x-ndjson", headers=headers)
+
+
+@api_bp.route("/guild/<int:guild_id>/queue/import", methods=["POST"])
+@require_auth_api
+@require_guild_access
+@rate_limited("import")
+async def queue_import(guild_id: int):
+    cog = _get_music_cog()
+    if not cog:
+        return jsonify({"error": "Music cog not loaded"}), 500
+    requester = session["user"]["username"]
+    result = await cog.api_import_queue(guild_id, request.body, requester)
+    return jsonify(result)
+
+
 @api_bp.route("/guild/<int:guild_id>/queue/shuffle", methods=["POST"])
 @require_auth_api
 @require_guild_access
@@ -285,13 +430,18 @@ async def queue_remove(guild_id: int, index: int):
 @require_auth_api
 @require_guild_access
 async def search(guild_id: int):
+    from cogs.music import RateLimited
     cog = _get_music_cog()
     if not cog:
         return jsonify({"error": "Music cog not loaded"}), 500
     query = request.args.get("q", "")
     if not query:
         return jsonify([])
-    results = await cog.api_search(query)
+    # Charged inside the cog, and only when the search isn't answered from cache
+    try:
+        results = await cog.api_search(query, int(session["user"]["id"]), guild_id)
+    except RateLimited as e:
+        return _rate_limited_response(e.retry_after)
     return jsonify(results)
 
 
@@ -4,8 +4,10 @@ import logging
 import os
 import functools
 
-import aiohttp
-from quart import Blueprint, redirect, request, session, url_for, jsonify
+from quart import Blueprint, current_app, redirect, request, session, url_for, jsonify
+
+from dashboard.guilds import GuildIndex
+from utils.http import get_http_session
 
 log = logging.getLogger("bot.dashboard.auth")
 
@@ -63,38 +65,39 @@ async def callback():
     if not code:
         return "Missing code parameter", 400
 
+    http = get_http_session(current_app.config["BOT"])
+
     # Exchange code for token
-    async with aiohttp.ClientSession() as http:
-        token_resp = await http.post(
-            f"{DISCORD_API}/oauth2/token",
-            data={
-                "client_id": CLIENT_ID,
-                "client_secret": CLIENT_SECRET,
-                "grant_type": "authorization_code",
-                "code": code,
-                "redirect_uri": _redirect_uri(),
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-        )
+    async with http.post(
+        f"{DISCORD_API}/oauth2/token",
+        data={
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "grant_type": "authorization_code",
+            "code": code,
+            "redirect_uri": _redirect_uri(),
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    ) as token_resp:
         if token_resp.status != 200:
             log.error("OAuth2 token exchange failed: %s", await token_resp.text())
             return "Authentication failed", 400
         tokens = await token_resp.json()
 
-        access_token = tokens["access_token"]
+    access_token = tokens["access_token"]
 
-        # Fetch user info
-        user_resp = await http.get(
-            f"{DISCORD_API}/users/@me",
-            headers={"Authorization": f"Bearer {access_token}"},
-        )
+    # Fetch user info
+    async with http.get(
+        f"{DISCORD_API}/users/@me",
+        headers={"Authorization": f"Bearer {access_token}"},
+    ) as user_resp:
         user = await user_resp.json()
 
-        # Fetch guilds
-        guilds_resp = await http.get(
-            f"{DISCORD_API}/users/@me/guilds",
-            headers={"Authorization": f"Bearer {access_token}"},
-        )
+    # Fetch guilds
+    async with http.get(
+        f"{DISCORD_API}/users/@me/guilds",
+        headers={"Authorization": f"Bearer {access_token}"},
+    ) as guilds_resp:
         guilds = await guilds_resp.json()
 
     session["user"] = {
@@ -105,6 +108,9 @@ async def callback():
     }
     # Store only guild IDs to keep the cookie small (4KB limit)
     session["guild_ids"] = [g["id"] for g in guilds]
+    # Keys the server-side cache of the parsed guild set; a new login gets a new one
+    current_app.config["GUILD_INDEX"].forget(session.get("guilds_token"))
+    session["guilds_token"] = GuildIndex.new_session_token()
     session["access_token"] = access_token
 
     return redirect("/")
@@ -112,5 +118,6 @@ async def callback():
 
 @auth_bp.route("/logout")
 async def logout():
+    current_app.config["GUILD_INDEX"].forget(session.get("guilds_token"))
     session.clear()
     return redirect("/login")
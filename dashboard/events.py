@@ -1,41 +1,258 @@
 """In-process event bus connecting Music cog state changes to WebSocket clients."""
 
 import asyncio
+import json
 import logging
-from collections import defaultdict
-from typing import Any
+import os
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable
+
+try:
+    import orjson
+except ImportError:  # optional: faster encoding, same output
+    orjson = None
 
 log = logging.getLogger("bot.dashboard.events")
 
+HEARTBEAT_INTERVAL = 5.0
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "64"))
+# A subscriber whose queue overflows this many times within the window is disconnected
+SLOW_CONSUMER_OVERFLOWS = 3
+SLOW_CONSUMER_WINDOW = 60.0
+
+# Control markers placed on a subscriber queue in place of encoded messages
+RESYNC = object()
+DISCONNECT = object()
+
+Payload = dict[str, Any] | Callable[[], dict[str, Any]]
+
+
+def _merge_deltas(first: dict, second: dict) -> dict:
+    """Combine two consecutive queue_delta payloads into one."""
+    return {"version": second["version"], "ops": first["ops"] + second["ops"]}
+
+
+def encode(msg: dict[str, Any]) -> str:
+    """Serialize a message to the JSON text sent in a WebSocket frame."""
+    if orjson is not None:
+        return orjson.dumps(msg).decode()
+    return json.dumps(msg, separators=(",", ":"))
+
+
+# Event types whose payloads are combined instead of replaced when coalesced
+_MERGERS: dict[str, Callable[[dict, dict], dict]] = {"queue_delta": _merge_deltas}
+
+
+class Subscriber:
+    """One WebSocket's bounded message queue plus its lag accounting.
+
+    When the queue is full the backlog is dropped and replaced by a single
+    RESYNC marker, which the handler answers with a fresh full_state. A
+    subscriber that keeps overflowing gets DISCONNECT instead."""
+
+    def __init__(self, guild_id: int, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.guild_id = guild_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.sent = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.max_lag = 0
+        # Set once DISCONNECT is queued; nothing more is enqueued after it
+        self.closing = False
+        self._overflows: deque[float] = deque(maxlen=SLOW_CONSUMER_OVERFLOWS)
+
+    def put(self, msg: str) -> bool:
+        """Enqueue a message. Returns False if it was dropped."""
+        if self.closing:
+            return False
+        try:
+            self.queue.put_nowait(msg)
+        except asyncio.QueueFull:
+            self._overflow()
+            return False
+        self.max_lag = max(self.max_lag, self.queue.qsize())
+        return True
+
+    def _overflow(self):
+        now = time.monotonic()
+        self._overflows.append(now)
+        # +1 for the message that didn't fit
+        self.dropped += self.queue.qsize() + 1
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        slow = (
+            len(self._overflows) == SLOW_CONSUMER_OVERFLOWS
+            and now - self._overflows[0] <= SLOW_CONSUMER_WINDOW
+        )
+        if slow:
+            self.closing = True
+            self.queue.put_nowait(DISCONNECT)
+        else:
+            self.resyncs += 1
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self):
+        msg = await self.queue.get()
+        self.sent += 1
+        return msg
+
+    def stats(self) -> dict:
+        return {
+            "guild_id": str(self.guild_id),
+            "lag": self.queue.qsize(),
+            "max_lag": self.max_lag,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "resyncs": self.resyncs,
+        }
+
 
 class EventBus:
-    """Simple pub/sub for guild-scoped events."""
+    """Simple pub/sub for guild-scoped events.
+
+    Events are held per guild for a short window (EVENT_COALESCE_MS) and only
+    the latest payload of each type is delivered, so a burst such as a volume
+    slider drag reaches each socket as one update. Each type is delivered at
+    the position of its first publish in the window, so the interleaving of
+    types is preserved; queue deltas are merged rather than dropped.
 
-    def __init__(self):
-        # guild_id -> set of asyncio.Queue
-        self._subscribers: dict[int, set[asyncio.Queue]] = defaultdict(set)
+    While a guild has subscribers, one heartbeat task per guild calls
+    `heartbeat(guild_id)` every HEARTBEAT_INTERVAL seconds.
 
-    def subscribe(self, guild_id: int) -> asyncio.Queue:
-        q: asyncio.Queue = asyncio.Queue()
-        self._subscribers[guild_id].add(q)
+    Every message is encoded to JSON once and the same string is put on each
+    subscriber queue, so serialization cost doesn't grow with the number of
+    open sockets."""
+
+    def __init__(self, coalesce_ms: float = 50, heartbeat: Callable[[int], dict[str, Any]] | None = None):
+        self._subscribers: dict[int, set[Subscriber]] = defaultdict(set)
+        self.coalesce_window = float(os.environ.get("EVENT_COALESCE_MS", coalesce_ms)) / 1000
+        # guild_id -> {event_type: payload} awaiting the end of the window
+        self._pending: dict[int, dict[str, Payload]] = {}
+        self._flush_handles: dict[int, asyncio.TimerHandle] = {}
+        self._heartbeat = heartbeat
+        self._heartbeat_tasks: dict[int, asyncio.Task] = {}
+        # Lazy payloads: how many were built vs. skipped for lack of subscribers
+        self.payloads_built = 0
+        self.payloads_skipped = 0
+        self.events_published = 0
+        self.events_delivered = 0
+        self.slow_disconnects = 0
+
+    def subscribe(self, guild_id: int) -> Subscriber:
+        sub = Subscriber(guild_id)
+        self._subscribers[guild_id].add(sub)
+        if self._heartbeat and guild_id not in self._heartbeat_tasks:
+            self._heartbeat_tasks[guild_id] = asyncio.get_running_loop().create_task(
+                self._heartbeat_loop(guild_id)
+            )
         log.debug("New subscriber for guild %d (total: %d)", guild_id, len(self._subscribers[guild_id]))
-        return q
+        return sub
 
-    def unsubscribe(self, guild_id: int, q: asyncio.Queue):
-        self._subscribers[guild_id].discard(q)
-        if not self._subscribers[guild_id]:
+    def unsubscribe(self, guild_id: int, sub: Subscriber):
+        subscribers = self._subscribers.get(guild_id)
+        if subscribers is None:
+            return
+        subscribers.discard(sub)
+        if not subscribers:
             del self._subscribers[guild_id]
+            self._discard_pending(guild_id)
+            task = self._heartbeat_tasks.pop(guild_id, None)
+            if task:
+                task.cancel()
 
-    def publish(self, guild_id: int, event_type: str, data: dict[str, Any]):
-        msg = {"type": event_type, "data": data}
-        dead: list[asyncio.Queue] = []
-        for q in self._subscribers.get(guild_id, set()):
+    async def _heartbeat_loop(self, guild_id: int):
+        while self._subscribers.get(guild_id):
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
             try:
-                q.put_nowait(msg)
-            except asyncio.QueueFull:
-                dead.append(q)
-        for q in dead:
-            self._subscribers[guild_id].discard(q)
+                msg = encode({"type": "heartbeat", "data": self._heartbeat(guild_id)})
+            except Exception:
+                log.exception("Heartbeat failed for guild %d", guild_id)
+                continue
+            self._deliver_raw(guild_id, msg)
+        self._heartbeat_tasks.pop(guild_id, None)
+
+    def publish(self, guild_id: int, event_type: str, data: Payload):
+        """Queue an event for the guild's subscribers. `data` may be a
+        zero-argument callable, which is only invoked if someone is listening
+        when the coalescing window closes."""
+        if not self._subscribers.get(guild_id):
+            if callable(data):
+                self.payloads_skipped += 1
+            return
+        self.events_published += 1
+        if self.coalesce_window <= 0:
+            self._deliver(guild_id, event_type, self._build(data))
+            return
+
+        pending = self._pending.setdefault(guild_id, {})
+        # Replaced in place: each type keeps the position of its first
+        # buffered publish, so the flush preserves the order between types
+        previous = pending.get(event_type)
+        if previous is not None:
+            merge = _MERGERS.get(event_type)
+            if merge:
+                data = merge(self._build(previous), self._build(data))
+            elif callable(previous):
+                self.payloads_skipped += 1
+        pending[event_type] = data
+        if guild_id not in self._flush_handles:
+            loop = asyncio.get_running_loop()
+            self._flush_handles[guild_id] = loop.call_later(self.coalesce_window, self._flush, guild_id)
+
+    def _build(self, data: Payload) -> dict[str, Any]:
+        if callable(data):
+            self.payloads_built += 1
+            return data()
+        return data
+
+    def _flush(self, guild_id: int):
+        self._flush_handles.pop(guild_id, None)
+        pending = self._pending.pop(guild_id, {})
+        if not self._subscribers.get(guild_id):
+            self.payloads_skipped += sum(callable(d) for d in pending.values())
+            return
+        for event_type, data in pending.items():
+            self._deliver(guild_id, event_type, self._build(data))
+
+    def _discard_pending(self, guild_id: int):
+        handle = self._flush_handles.pop(guild_id, None)
+        if handle:
+            handle.cancel()
+        pending = self._pending.pop(guild_id, {})
+        self.payloads_skipped += sum(callable(d) for d in pending.values())
+
+    def _deliver(self, guild_id: int, event_type: str, data: dict[str, Any]):
+        if self._subscribers.get(guild_id):
+            self._deliver_raw(guild_id, encode({"type": event_type, "data": data}))
+
+    def _deliver_raw(self, guild_id: int, msg: str):
+        """Put an encoded message on every subscriber queue."""
+        subscribers = self._subscribers.get(guild_id)
+        if not subscribers:
+            return
+        for sub in subscribers:
+            if sub.closing:
+                continue
+            if sub.put(msg):
+                self.events_delivered += 1
+            elif sub.closing:
+                # Stays subscribed until its handler reads DISCONNECT and unsubscribes
+                self.slow_disconnects += 1
+                log.warning("Disconnecting slow dashboard subscriber for guild %d", guild_id)
 
     def has_subscribers(self, guild_id: int) -> bool:
         return bool(self._subscribers.get(guild_id))
+
+    def stats(self) -> dict:
+        return {
+            "guilds": len(self._subscribers),
+            "subscribers": sum(len(subs) for subs in self._subscribers.values()),
+            "payloads_built": self.payloads_built,
+            "payloads_skipped": self.payloads_skipped,
+            "events_published": self.events_published,
+            "events_delivered": self.events_delivered,
+            "coalesce_ms": self.coalesce_window * 1000,
+            "slow_disconnects": self.slow_disconnects,
+            "subscriber_stats": [sub.stats() for subs in self._subscribers.values() for sub in subs],
+        }
@@ -0,0 +1,81 @@
+"""Guild membership lookups for dashboard access checks."""
+
+import hashlib
+import logging
+import secrets
+from collections import OrderedDict
+
+from quart import session
+
+log = logging.getLogger("bot.dashboard.guilds")
+
+# Parsed guild sets kept for this many recently active sessions
+SESSION_CACHE_SIZE = 1024
+
+
+class UserGuilds:
+    """A session's guild IDs, parsed once, plus a short digest for ETags."""
+
+    __slots__ = ("ids", "key")
+
+    def __init__(self, raw_ids: list[str]):
+        self.ids = frozenset(int(gid) for gid in raw_ids)
+        self.key = hashlib.sha1(",".join(sorted(map(str, self.ids))).encode()).hexdigest()[:12]
+
+
+class GuildIndex:
+    """Set of guild IDs the bot is in, kept current from gateway events
+    instead of being rebuilt from `bot.guilds` on every request.
+
+    Also caches each session's parsed guild set, keyed by a token stored in
+    the session at login, so the cookie's ID list isn't re-parsed per call."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.ids: set[int] = {g.id for g in bot.guilds}
+        self._sessions: OrderedDict[str, UserGuilds] = OrderedDict()
+        bot.add_listener(self._on_ready, "on_ready")
+        bot.add_listener(self._on_guild_join, "on_guild_join")
+        bot.add_listener(self._on_guild_remove, "on_guild_remove")
+
+    async def _on_ready(self):
+        # Full resync: guilds may have come or gone while disconnected
+        self.ids = {g.id for g in self.bot.guilds}
+        log.debug("Guild index rebuilt (%d guilds)", len(self.ids))
+
+    async def _on_guild_join(self, guild):
+        self.ids.add(guild.id)
+
+    async def _on_guild_remove(self, guild):
+        self.ids.discard(guild.id)
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self.ids
+
+    @staticmethod
+    def new_session_token() -> str:
+        return secrets.token_urlsafe(16)
+
+    def user_guilds(self) -> UserGuilds:
+        """The current session's guilds, parsed once per login."""
+        token = session.get("guilds_token")
+        if token is None:
+            return UserGuilds(session.get("guild_ids", []))
+        cached = self._sessions.get(token)
+        if cached is not None:
+            self._sessions.move_to_end(token)
+            return cached
+        cached = self._sessions[token] = UserGuilds(session.get("guild_ids", []))
+        if len(self._sessions) > SESSION_CACHE_SIZE:
+            self._sessions.popitem(last=False)
+        return cached
+
+    def shared(self, user: UserGuilds) -> list:
+        """Guilds both the user and the bot are in, iterating the smaller set."""
+        small, large = (user.ids, self.ids) if len(user.ids) <= len(self.ids) else (self.ids, user.ids)
+        guilds = (self.bot.get_guild(gid) for gid in small if gid in large)
+        return sorted((g for g in guilds if g is not None), key=lambda g: g.name.lower())
+
+    def forget(self, token: str | None):
+        if token:
+            self._sessions.pop(token, None)
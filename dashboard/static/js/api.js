@@ -2,6 +2,10 @@
  * API wrapper for dashboard REST endpoints.
  */
 const API = {
+    // GET path -> {etag, data}; revalidated with If-None-Match, reused on 304
+    cache: new Map(),
+    CACHE_LIMIT: 200,
+
     async request(method, path, body) {
         const opts = {
             method,
@@ -12,19 +16,36 @@ const API = {
             opts.headers["Content-Type"] = "application/json";
             opts.body = JSON.stringify(body);
         }
+        const cached = method === "GET" ? this.cache.get(path) : undefined;
+        if (method === "GET") {
+            // Revalidation is handled here, not by the browser cache
+            opts.cache = "no-store";
+            if (cached) opts.headers["If-None-Match"] = cached.etag;
+        }
         const resp = await fetch(path, opts);
         if (resp.status === 401) {
             window.location.href = "/login";
             return null;
         }
+        if (resp.status === 304 && cached) return cached.data;
         const data = await resp.json();
         if (data.error) {
             App.toast(data.error, "error");
             return null;
         }
+        const etag = resp.headers.get("ETag");
+        if (method === "GET" && etag) this._remember(path, etag, data);
         return data;
     },
 
+    _remember(path, etag, data) {
+        this.cache.delete(path);
+        this.cache.set(path, { etag, data });
+        if (this.cache.size > this.CACHE_LIMIT) {
+            this.cache.delete(this.cache.keys().next().value);
+        }
+    },
+
     getMe() {
         return this.request("GET", "/api/@me");
     },
@@ -37,8 +58,8 @@ const API = {
         return this.request("GET", `/api/guild/${guildId}/player`);
     },
 
-    getQueue(guildId) {
-        return this.request("GET", `/api/guild/${guildId}/queue`);
+    getQueue(guildId, offset = 0, limit = 100) {
+        return this.request("GET", `/api/guild/${guildId}/queue?offset=${offset}&limit=${limit}`);
     },
 
     getSettings(guildId) {
@@ -53,6 +74,10 @@ const API = {
         return this.request("POST", `/api/guild/${guildId}/player/skip`);
     },
 
+    previous(guildId) {
+        return this.request("POST", `/api/guild/${guildId}/player/previous`);
+    },
+
     stop(guildId) {
         return this.request("POST", `/api/guild/${guildId}/player/stop`);
     },
@@ -85,6 +110,30 @@ const API = {
         return this.request("POST", `/api/guild/${guildId}/queue/move`, { from, to });
     },
 
+    batchQueue(guildId, ops) {
+        return this.request("POST", `/api/guild/${guildId}/queue/batch`, { ops });
+    },
+
+    exportQueueUrl(guildId) {
+        return `/api/guild/${guildId}/queue/export`;
+    },
+
+    async importQueue(guildId, file) {
+        const resp = await fetch(`/api/guild/${guildId}/queue/import`, {
+            method: "POST",
+            credentials: "same-origin",
+            headers: { "Content-Type": "application/x-ndjson" },
+            body: file,
+        });
+        const data = await resp.json();
+        if (data.error) {
+            // Lines before the bad one are still imported
+            App.toast(data.imported ? `${data.error} (imported ${data.imported} track(s) before it)` : data.error, "error");
+            return null;
+        }
+        return data;
+    },
+
     shuffleQueue(guildId) {
         return this.request("POST", `/api/guild/${guildId}/queue/shuffle`);
     },
@@ -119,14 +119,15 @@ const App = {
         this._toggleMenu(false);
 
         // Load initial state
-        const [player, queue, settings] = await Promise.all([
+        const [player, settings] = await Promise.all([
             API.getPlayer(guildId),
-            API.getQueue(guildId),
             API.getSettings(guildId),
         ]);
 
-        if (player) Player.updateFull(player);
-        if (queue) Queue.update(queue);
+        if (player) {
+            Player.updateFull(player);
+            Queue.update(player.queue, player.version, player.queue_total);
+        }
         if (settings) {
             document.getElementById("setting-247").checked = settings.twenty_four_seven;
         }
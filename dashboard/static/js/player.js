@@ -9,6 +9,7 @@ const Player = {
         playing: false,
         volume: 50,
         loop: "off",
+        shuffle: false,
         filter: "",
         timestamp: 0,
         in_voice: false,
@@ -22,6 +23,11 @@ const Player = {
             if (App.guildId) API.pauseResume(App.guildId);
         });
 
+        // Previous
+        document.getElementById("btn-prev").addEventListener("click", () => {
+            if (App.guildId) API.previous(App.guildId);
+        });
+
         // Skip
         document.getElementById("btn-skip").addEventListener("click", () => {
             if (App.guildId) API.skip(App.guildId);
@@ -153,6 +159,9 @@ const Player = {
         // Loop
         document.getElementById("loop-select").value = data.loop || "off";
 
+        // Shuffle
+        this.updateShuffle(!!data.shuffle);
+
         // Filter select
         const filterMap = {
             "": "clear", "Nightcore": "nightcore", "Vaporwave": "vaporwave",
@@ -162,6 +171,7 @@ const Player = {
 
         // Update queue now playing
         Queue.updateNowPlaying(data.current);
+        Queue.updateUpNext(data.up_next, !!data.shuffle);
     },
 
     updatePosition(data) {
@@ -186,6 +196,14 @@ const Player = {
         }
     },
 
+    updateShuffle(enabled) {
+        this.state.shuffle = enabled;
+        ["btn-shuffle", "btn-shuffle-queue"].forEach(id => {
+            document.getElementById(id).classList.toggle("active", enabled);
+        });
+        Queue.updateUpNext(Queue.upNext, enabled);
+    },
+
     updateLoop(mode) {
         this.state.loop = mode;
         document.getElementById("loop-select").value = mode;
@@ -217,6 +235,7 @@ const Player = {
 
         // Clear queue now playing
         Queue.updateNowPlaying(null);
+        Queue.updateUpNext(null, false);
     },
 
     showActive() {
@@ -1,23 +1,160 @@
 /**
- * Queue panel UI with "Now Playing" section, queue list, remove and drag-and-drop reorder.
+ * Queue panel UI with "Now Playing" and shuffled "Up next" sections, queue list, remove and drag-and-drop reorder.
+ * Ctrl/Cmd-click selects several rows; removing or dragging a selection is sent as one batch.
+ * The list is kept current by applying versioned queue_delta ops from the WebSocket.
+ * `items` is a sparse array filled a page at a time, and only the rows in view
+ * (plus some overscan) are in the DOM; row events are delegated to the list.
  */
 const Queue = {
+    ROW_HEIGHT: 48,
+    OVERSCAN: 10,
+    PAGE_SIZE: 100,
+
     items: [],
+    current: null,
+    upNext: null,
+    version: 0,
+    selected: new Set(),
+    loadingPages: new Set(),
+    dragIdx: null,
+    renderQueued: false,
 
     init() {
         document.getElementById("btn-shuffle-queue").addEventListener("click", () => {
             if (App.guildId) API.shuffleQueue(App.guildId);
         });
+        document.getElementById("btn-remove-selected").addEventListener("click", () => {
+            this._removeSelected();
+        });
+
+        // NDJSON export / import
+        document.getElementById("btn-export-queue").addEventListener("click", () => {
+            if (App.guildId) window.location.href = API.exportQueueUrl(App.guildId);
+        });
+        const fileInput = document.getElementById("import-queue-file");
+        document.getElementById("btn-import-queue").addEventListener("click", () => {
+            if (App.guildId) fileInput.click();
+        });
+        fileInput.addEventListener("change", async () => {
+            const file = fileInput.files[0];
+            fileInput.value = "";
+            if (!file || !App.guildId) return;
+            const result = await API.importQueue(App.guildId, file);
+            if (result) App.toast(`Imported ${result.imported} track(s)`);
+        });
+
+        // Re-render the visible window on scroll and when the panel is resized or opened
+        const scroller = document.getElementById("queue-upcoming");
+        scroller.addEventListener("scroll", () => this._scheduleRender(), { passive: true });
+        new ResizeObserver(() => this._scheduleRender()).observe(scroller);
+
+        const list = document.getElementById("queue-list");
+        list.addEventListener("click", (e) => this._onClick(e));
+        list.addEventListener("dragstart", (e) => {
+            const item = e.target.closest(".queue-item[draggable]");
+            if (!item) return;
+            this.dragIdx = parseInt(item.dataset.index);
+            item.classList.add("dragging");
+            e.dataTransfer.effectAllowed = "move";
+        });
+        list.addEventListener("dragend", (e) => {
+            const item = e.target.closest(".queue-item");
+            if (item) item.classList.remove("dragging");
+            this.dragIdx = null;
+        });
+        list.addEventListener("dragover", (e) => {
+            if (!e.target.closest(".queue-item")) return;
+            e.preventDefault();
+            e.dataTransfer.dropEffect = "move";
+        });
+        list.addEventListener("drop", (e) => {
+            const item = e.target.closest(".queue-item");
+            if (!item) return;
+            e.preventDefault();
+            const toIdx = parseInt(item.dataset.index);
+            const dragIdx = this.dragIdx;
+            this.dragIdx = null;
+            if (dragIdx !== null && dragIdx !== toIdx && App.guildId) {
+                const group = this.selected.has(dragIdx) ? [...this.selected] : [dragIdx];
+                const ops = this._moveOps(group, toIdx);
+                if (ops.length) API.batchQueue(App.guildId, ops);
+            }
+        });
     },
 
-    update(queue) {
-        this.items = queue || [];
+    /** Replace the queue with its first page; `total` is the full queue length. */
+    update(queue, version, total) {
+        queue = queue || [];
+        this.items = new Array(total === undefined ? queue.length : total);
+        queue.forEach((song, i) => { this.items[i] = song; });
+        if (version !== undefined) this.version = version;
+        this.loadingPages.clear();
+        this.selected.clear();
         this._render();
     },
 
+    /**
+     * Apply a {version, ops} delta. Returns false if deltas were missed and
+     * the caller should resync; deltas already covered by a resync are ignored.
+     */
+    applyDelta(delta) {
+        if (delta.version <= this.version) return true;
+        if (delta.version !== this.version + delta.ops.length) return false;
+        delta.ops.forEach(op => this._applyOp(op));
+        this.version = delta.version;
+        this.selected.clear();
+        this._scheduleRender();
+        return true;
+    },
+
+    _applyOp(op) {
+        switch (op.op) {
+            case "insert":
+                this.items.splice(op.index, 0, ...op.songs);
+                break;
+            case "remove":
+                this.items.splice(op.index, 1);
+                break;
+            case "move":
+                this.items.splice(op.to, 0, this.items.splice(op.from, 1)[0]);
+                break;
+            case "advance":
+                if (op.requeue && this.current) this.items.push(this.current);
+                this.current = this.items.length ? this.items.splice(op.index, 1)[0] || null : null;
+                break;
+            case "current":
+                this.current = op.song;
+                break;
+            case "clear":
+                this.items = [];
+                this.current = null;
+                break;
+            case "batch":
+                op.ops.forEach(sub => this._applyOp(sub));
+                break;
+            // "shuffle" only changes which index the next advance draws
+        }
+    },
+
     updateNowPlaying(song) {
-        const section = document.getElementById("queue-now-playing");
-        const container = document.getElementById("queue-current");
+        this.current = song;
+        this._renderTrack("queue-now-playing", "queue-current", song);
+    },
+
+    /**
+     * Show the track that plays next when shuffle is on; the list itself stays
+     * in queue order and is labelled that way.
+     */
+    updateUpNext(song, shuffled) {
+        this.upNext = song;
+        this._renderTrack("queue-up-next", "queue-up-next-track", shuffled ? song : null);
+        document.getElementById("queue-list-label").textContent =
+            shuffled ? "Queue (unshuffled order)" : "Next in queue";
+    },
+
+    _renderTrack(sectionId, containerId, song) {
+        const section = document.getElementById(sectionId);
+        const container = document.getElementById(containerId);
 
         if (!song) {
             section.style.display = "none";
@@ -38,26 +175,66 @@ const Queue = {
         `;
     },
 
+    _scheduleRender() {
+        if (this.renderQueued) return;
+        this.renderQueued = true;
+        requestAnimationFrame(() => {
+            this.renderQueued = false;
+            this._render();
+        });
+    },
+
     _render() {
         const list = document.getElementById("queue-list");
         const countEl = document.getElementById("queue-count");
+        const total = this.items.length;
 
-        if (!this.items.length) {
+        if (!total) {
+            list.style.height = "";
+            list.style.paddingTop = "";
             list.innerHTML = '<li class="queue-empty">Queue is empty</li>';
             countEl.textContent = "";
+            this._updateSelectionControls();
             return;
         }
 
-        countEl.textContent = `(${this.items.length})`;
+        countEl.textContent = `(${total})`;
+
+        // Visible window, in rows, relative to the top of the list
+        const scroller = document.getElementById("queue-upcoming");
+        const top = Math.max(0, scroller.scrollTop - list.offsetTop);
+        const start = Math.max(0, Math.floor(top / this.ROW_HEIGHT) - this.OVERSCAN);
+        const end = Math.min(total, Math.ceil((top + scroller.clientHeight) / this.ROW_HEIGHT) + this.OVERSCAN);
 
-        list.innerHTML = this.items.map((song, i) => {
-            const thumb = song.thumbnail || this._ytThumb(song.url);
-            const duration = song.duration ? Player._formatTime(song.duration) : "Queued";
+        list.style.height = `${total * this.ROW_HEIGHT}px`;
+        list.style.paddingTop = `${start * this.ROW_HEIGHT}px`;
+        const rows = [];
+        for (let i = start; i < end; i++) rows.push(this._rowHtml(this.items[i], i));
+        list.innerHTML = rows.join("");
+
+        this._updateSelectionControls();
+        this._loadMissing(start, end);
+    },
+
+    _rowHtml(song, i) {
+        if (!song) {
             return `
-            <li class="queue-item" draggable="true" data-index="${i}">
+            <li class="queue-item placeholder" data-index="${i}">
+                <span class="queue-item-index">${i + 1}</span>
+                <div class="queue-item-thumb"></div>
+                <div class="queue-item-info"><div class="queue-item-meta">Loading&hellip;</div></div>
+            </li>`;
+        }
+        const thumb = song.thumbnail || this._ytThumb(song.url);
+        const duration = song.duration ? Player._formatTime(song.duration) : "Queued";
+        const classes = ["queue-item"];
+        if (this.selected.has(i)) classes.push("selected");
+        if (this.dragIdx === i) classes.push("dragging");
+        return `
+            <li class="${classes.join(" ")}" draggable="true" data-index="${i}">
                 <span class="queue-item-index">${i + 1}</span>
                 ${thumb
-                    ? `<img class="queue-item-thumb" src="${this._esc(thumb)}" alt="">`
+                    ? `<img class="queue-item-thumb" src="${this._esc(thumb)}" alt="" loading="lazy">`
                     : '<div class="queue-item-thumb"></div>'}
                 <div class="queue-item-info">
                     <div class="queue-item-title">${this._esc(song.title)}</div>
@@ -71,41 +248,91 @@ const Queue = {
                     </button>
                 </div>
             </li>`;
-        }).join("");
-
-        // Remove buttons
-        list.querySelectorAll("[data-remove]").forEach(btn => {
-            btn.addEventListener("click", (e) => {
-                e.stopPropagation();
-                const idx = parseInt(btn.dataset.remove);
-                if (App.guildId) API.removeFromQueue(App.guildId, idx);
-            });
-        });
+    },
 
-        // Drag and drop
-        let dragIdx = null;
-        list.querySelectorAll(".queue-item").forEach(item => {
-            item.addEventListener("dragstart", (e) => {
-                dragIdx = parseInt(item.dataset.index);
-                item.classList.add("dragging");
-                e.dataTransfer.effectAllowed = "move";
-            });
-            item.addEventListener("dragend", () => {
-                item.classList.remove("dragging");
-                dragIdx = null;
-            });
-            item.addEventListener("dragover", (e) => {
-                e.preventDefault();
-                e.dataTransfer.dropEffect = "move";
-            });
-            item.addEventListener("drop", (e) => {
-                e.preventDefault();
-                const toIdx = parseInt(item.dataset.index);
-                if (dragIdx !== null && dragIdx !== toIdx && App.guildId) {
-                    API.moveInQueue(App.guildId, dragIdx, toIdx);
+    /** Fetch the pages covering rows [start, end) that haven't been loaded yet. */
+    _loadMissing(start, end) {
+        const guildId = App.guildId;
+        if (!guildId) return;
+        for (let page = Math.floor(start / this.PAGE_SIZE); page * this.PAGE_SIZE < end; page++) {
+            const from = page * this.PAGE_SIZE;
+            if (this.loadingPages.has(page)) continue;
+            let missing = false;
+            for (let i = Math.max(from, start); i < Math.min(from + this.PAGE_SIZE, end); i++) {
+                if (this.items[i] === undefined) { missing = true; break; }
+            }
+            if (!missing) continue;
+
+            this.loadingPages.add(page);
+            API.getQueue(guildId, from, this.PAGE_SIZE).then(data => {
+                this.loadingPages.delete(page);
+                if (!data || guildId !== App.guildId) return;
+                if (data.version !== this.version) {
+                    // The page and our copy disagree on positions; try again once deltas settle
+                    setTimeout(() => this._scheduleRender(), 250);
+                    return;
                 }
+                data.items.forEach((song, i) => {
+                    if (from + i < this.items.length) this.items[from + i] = song;
+                });
+                this._scheduleRender();
             });
+        }
+    },
+
+    _onClick(e) {
+        const removeBtn = e.target.closest("[data-remove]");
+        if (removeBtn) {
+            e.stopPropagation();
+            if (App.guildId) API.removeFromQueue(App.guildId, parseInt(removeBtn.dataset.remove));
+            return;
+        }
+        // Multi-select
+        const item = e.target.closest(".queue-item[draggable]");
+        if (!item || (!e.ctrlKey && !e.metaKey)) return;
+        const idx = parseInt(item.dataset.index);
+        if (this.selected.has(idx)) this.selected.delete(idx);
+        else this.selected.add(idx);
+        item.classList.toggle("selected", this.selected.has(idx));
+        this._updateSelectionControls();
+    },
+
+    _updateSelectionControls() {
+        document.getElementById("btn-remove-selected").style.display =
+            this.selected.size ? "flex" : "none";
+    },
+
+    _removeSelected() {
+        if (!App.guildId || !this.selected.size) return;
+        // Highest index first so earlier removals don't shift later ones
+        const ops = [...this.selected].sort((a, b) => b - a).map(index => ({ op: "remove", index }));
+        this.selected.clear();
+        this._updateSelectionControls();
+        API.batchQueue(App.guildId, ops);
+    },
+
+    /**
+     * Build move ops that put the rows in `group` next to row `toIdx`: below it
+     * when dragging down, above it when dragging up, keeping their relative order.
+     * Each move is simulated so later indices stay valid.
+     */
+    _moveOps(group, toIdx) {
+        if (group.includes(toIdx)) return [];
+        const down = toIdx > Math.min(...group);
+        // Dragging down: largest first, each lands right after the anchor.
+        // Dragging up: smallest first, each lands right before it.
+        const sorted = [...group].sort((a, b) => down ? b - a : a - b);
+        const order = Array.from(this.items, (_, i) => i);
+        const ops = [];
+        sorted.forEach(idx => {
+            const from = order.indexOf(idx);
+            const anchor = order.indexOf(toIdx);
+            const to = (from < anchor ? anchor - 1 : anchor) + (down ? 1 : 0);
+            if (from === to) return;
+            order.splice(to, 0, order.splice(from, 1)[0]);
+            ops.push({ op: "move", from, to });
         });
+        return ops;
     },
 
     _ytThumb(url) {
@@ -6,6 +6,7 @@ const WS = {
     guildId: null,
     reconnectTimer: null,
     reconnectDelay: 1000,
+    resyncing: false,
 
     connect(guildId) {
         this.disconnect();
@@ -58,11 +59,25 @@ const WS = {
         this.reconnectDelay = Math.min(this.reconnectDelay * 2, 30000);
     },
 
+    /** Refetch the full state after a gap in the queue version sequence. */
+    _resync() {
+        if (this.resyncing || !this.guildId) return;
+        this.resyncing = true;
+        const guildId = this.guildId;
+        API.getPlayer(guildId).then(state => {
+            // Deltas applied while the request was in flight may already be newer
+            if (state && guildId === this.guildId && state.version >= Queue.version) {
+                Player.updateFull(state);
+                Queue.update(state.queue, state.version, state.queue_total);
+            }
+        }).finally(() => { this.resyncing = false; });
+    },
+
     _dispatch(msg) {
         switch (msg.type) {
             case "full_state":
                 Player.updateFull(msg.data);
-                Queue.update(msg.data.queue);
+                Queue.update(msg.data.queue, msg.data.version, msg.data.queue_total);
                 break;
             case "player_update":
                 Player.updateFull(msg.data);
@@ -76,17 +91,15 @@ const WS = {
             case "loop_update":
                 Player.updateLoop(msg.data.loop);
                 break;
-            case "queue_update":
-                if (msg.data && msg.data.queue) {
-                    Queue.update(msg.data.queue);
-                } else {
-                    // Refetch queue
-                    API.getQueue(this.guildId).then(q => { if (q) Queue.update(q); });
-                }
+            case "shuffle_update":
+                Player.updateShuffle(msg.data.shuffle);
+                break;
+            case "queue_delta":
+                if (!Queue.applyDelta(msg.data)) this._resync();
+                else Queue.updateUpNext(msg.data.up_next, Player.state.shuffle);
                 break;
             case "disconnected":
                 Player.showIdle();
-                Queue.update([]);
                 break;
         }
     },
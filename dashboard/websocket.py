@@ -1,68 +1,38 @@
 """WebSocket handler for real-time dashboard updates."""
 
 import asyncio
-import json
 import logging
 import time
 
 from quart import Blueprint, websocket, session
 
-from dashboard.events import EventBus
+from dashboard.events import DISCONNECT, RESYNC, EventBus, encode
 
 log = logging.getLogger("bot.dashboard.ws")
 
 ws_bp = Blueprint("ws", __name__)
 
 
-def _get_player_state(bot, guild_id: int) -> dict:
-    """Build a full player state snapshot."""
+def _get_player_state(bot, guild_id: int, include_queue: bool = True) -> dict:
+    """Build a player state snapshot; the full state includes the queue and its version."""
     music_cog = bot.cogs.get("Music")
     if not music_cog:
         return {}
+    return music_cog._build_player_state(guild_id, include_queue=include_queue)
 
-    gq = music_cog.queue_manager.get(guild_id)
+
+def _get_position(bot, guild_id: int) -> dict:
+    """Playback position for heartbeats, without building the rest of the state."""
+    music_cog = bot.cogs.get("Music")
+    gq = music_cog.queue_manager.peek(guild_id) if music_cog else None
     guild = bot.get_guild(guild_id)
     vc = guild.voice_client if guild else None
-
-    current = None
-    if gq.current:
-        current = {
-            "title": gq.current.title,
-            "url": gq.current.url,
-            "duration": gq.current.duration,
-            "thumbnail": gq.current.thumbnail,
-            "requester": gq.current.requester,
-        }
-
-    elapsed = 0
-    if gq.start_time and gq.current:
-        elapsed = time.time() - gq.start_time
-
-    is_paused = vc.is_paused() if vc else False
-    is_playing = vc.is_playing() if vc else False
-
-    queue = [
-        {
-            "title": s.title,
-            "url": s.url,
-            "duration": s.duration,
-            "thumbnail": s.thumbnail,
-            "requester": s.requester,
-        }
-        for s in gq.queue
-    ]
-
+    now = time.time()
     return {
-        "current": current,
-        "elapsed": elapsed,
-        "paused": is_paused,
-        "playing": is_playing,
-        "volume": int(gq.volume * 100),
-        "loop": gq.loop_mode.value,
-        "filter": gq.audio_filter_name,
-        "queue": queue,
-        "in_voice": vc is not None and vc.is_connected(),
-        "timestamp": time.time(),
+        "elapsed": gq.position(now) if gq and gq.current else 0,
+        "paused": vc.is_paused() if vc else False,
+        "playing": vc.is_playing() if vc else False,
+        "timestamp": now,
     }
 
 
@@ -78,33 +48,31 @@ async def ws_handler(guild_id: int):
     event_bus: EventBus = current_app.config["EVENT_BUS"]
 
     # Verify user has access to this guild
-    user_guild_ids = {int(gid) for gid in session.get("guild_ids", [])}
-    bot_guild_ids = {g.id for g in bot.guilds}
-    if guild_id not in user_guild_ids or guild_id not in bot_guild_ids:
+    guild_index = current_app.config["GUILD_INDEX"]
+    if guild_id not in guild_index.user_guilds().ids or guild_id not in guild_index:
         await websocket.close(4003, "No access to this guild")
         return
 
-    # Send initial full state
-    state = _get_player_state(bot, guild_id)
-    await websocket.send_json({"type": "full_state", "data": state})
-
-    # Subscribe to events
-    q = event_bus.subscribe(guild_id)
+    # Subscribe before taking the full state, so no event published in
+    # between is missed; queued deltas the state already covers carry a
+    # version at or below its own and the client skips them. Messages
+    # arrive already encoded as JSON text.
+    sub = event_bus.subscribe(guild_id)
     try:
+        state = _get_player_state(bot, guild_id)
+        await websocket.send_json({"type": "full_state", "data": state})
         while True:
-            try:
-                msg = await asyncio.wait_for(q.get(), timeout=5.0)
-                await websocket.send_json(msg)
-            except asyncio.TimeoutError:
-                # Send heartbeat with current position
+            msg = await sub.get()
+            if msg is RESYNC:
+                # Fell behind and the backlog was dropped: start over from full state
                 state = _get_player_state(bot, guild_id)
-                await websocket.send_json({"type": "heartbeat", "data": {
-                    "elapsed": state["elapsed"],
-                    "paused": state["paused"],
-                    "playing": state["playing"],
-                    "timestamp": state["timestamp"],
-                }})
+                await websocket.send(encode({"type": "full_state", "data": state}))
+            elif msg is DISCONNECT:
+                await websocket.close(4008, "Too slow")
+                return
+            else:
+                await websocket.send(msg)
     except asyncio.CancelledError:
         pass
     finally:
-        event_bus.unsubscribe(guild_id, q)
+        event_bus.unsubscribe(guild_id, sub)
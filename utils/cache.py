@@ -4,16 +4,26 @@ import logging
 import os
 import re
 import time
+from typing import Callable
 
-import aiosqlite
+from urllib.parse import urlparse
+
+import aiohttp
 import yt_dlp
 
+from utils.storage import Storage
+
 log = logging.getLogger("bot.cache")
 
 YOUTUBE_ID_RE = re.compile(
     r"(?:youtube\.com/watch\?.*v=|youtu\.be/|youtube\.com/embed/|youtube\.com/shorts/)([A-Za-z0-9_-]{11})"
 )
 
+# Byte rate allowed for direct downloads: uncompressed CD audio is ~172 KiB/s
+DIRECT_MAX_BYTES_PER_SEC = 200 * 1024
+# Bytes of a direct download collected before each write to disk
+DIRECT_WRITE_BUFFER = 1024 * 1024
+
 YTDL_DOWNLOAD_OPTIONS = {
     "format": "bestaudio[acodec=opus]/bestaudio/best",
     "noplaylist": True,
@@ -25,39 +35,35 @@ YTDL_DOWNLOAD_OPTIONS = {
 class CacheManager:
     def __init__(
         self,
+        storage: Storage,
         cache_dir: str = "./cache",
         max_size_mb: int = 2048,
         max_duration_sec: int = 1800,
+        http: aiohttp.ClientSession | None = None,
     ):
         self.cache_dir = os.environ.get("CACHE_DIR", cache_dir)
         self.max_size_bytes = int(os.environ.get("CACHE_LIMIT_MB", max_size_mb)) * 1024 * 1024
         self.max_duration_sec = int(os.environ.get("MAX_CACHE_DURATION", max_duration_sec))
-        self.db_path = os.path.join(self.cache_dir, "cache.db")
-        self._db: aiosqlite.Connection | None = None
+        self.storage = storage
         self._key_locks: dict[str, asyncio.Lock] = {}
         self._locks_lock = asyncio.Lock()
+        # Used to download direct media URLs without yt-dlp
+        self.http = http
+        # Called as listener(cache_keys) when entries are removed; None means all of them
+        self._removal_listeners: list[Callable[[list[str] | None], None]] = []
         self.hits = 0
         self.misses = 0
 
     async def initialize(self):
         os.makedirs(self.cache_dir, exist_ok=True)
-        self._db = await aiosqlite.connect(self.db_path)
-        await self._db.execute("""
-            CREATE TABLE IF NOT EXISTS cache_entries (
-                cache_key TEXT PRIMARY KEY,
-                file_path TEXT NOT NULL,
-                size_bytes INTEGER NOT NULL,
-                last_accessed REAL NOT NULL,
-                created_at REAL NOT NULL
-            )
-        """)
-        await self._db.commit()
         await self._cleanup()
 
-    async def close(self):
-        if self._db:
-            await self._db.close()
-            self._db = None
+    def add_removal_listener(self, listener: Callable[[list[str] | None], None]):
+        self._removal_listeners.append(listener)
+
+    def _notify_removed(self, cache_keys: list[str] | None):
+        for listener in self._removal_listeners:
+            listener(cache_keys)
 
     async def _get_lock(self, key: str) -> asyncio.Lock:
         async with self._locks_lock:
@@ -73,31 +79,44 @@ class CacheManager:
         return hashlib.sha256(url.encode()).hexdigest()[:16]
 
     async def get_cached_path(self, cache_key: str) -> str | None:
-        if not self._db:
+        if not self.storage.ready:
             return None
-        async with self._db.execute(
-            "SELECT file_path FROM cache_entries WHERE cache_key = ?", (cache_key,)
-        ) as cursor:
-            row = await cursor.fetchone()
+        row = await self.storage.fetchone("SELECT file_path FROM cache_entries WHERE cache_key = ?", (cache_key,))
         if row and os.path.isfile(row[0]):
-            await self._db.execute(
+            # LRU bookkeeping only: no need to wait for it to commit
+            self.storage.execute_nowait(
                 "UPDATE cache_entries SET last_accessed = ? WHERE cache_key = ?",
                 (time.time(), cache_key),
             )
-            await self._db.commit()
             self.hits += 1
             log.debug("Cache hit: %s -> %s", cache_key, row[0])
             return row[0]
         # DB record exists but file is gone — clean up
         if row:
-            await self._db.execute("DELETE FROM cache_entries WHERE cache_key = ?", (cache_key,))
-            await self._db.commit()
+            await self.storage.execute("DELETE FROM cache_entries WHERE cache_key = ?", (cache_key,))
+            self._notify_removed([cache_key])
         self.misses += 1
         return None
 
+    async def cached_keys(self, cache_keys: list[str]) -> set[str]:
+        """Return the subset of cache_keys that have a cache entry."""
+        if not self.storage.ready or not cache_keys:
+            return set()
+        found: set[str] = set()
+        for i in range(0, len(cache_keys), 500):
+            chunk = cache_keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = await self.storage.fetchall(
+                f"SELECT cache_key FROM cache_entries WHERE cache_key IN ({placeholders})", chunk
+            )
+            found.update(row[0] for row in rows)
+        return found
+
     async def download_and_cache(
-        self, cache_key: str, url: str, duration: int | None, is_live: bool
+        self, cache_key: str, url: str, duration: int | None, is_live: bool, direct: bool = False
     ) -> str | None:
+        """Download a track into the cache. `direct` URLs point at a media
+        file and are fetched with a plain HTTP GET instead of yt-dlp."""
         if is_live or (duration is not None and duration == 0):
             return None
         if duration is not None and duration > self.max_duration_sec:
@@ -115,58 +134,101 @@ class CacheManager:
             estimated_bytes = (duration or 300) * 16 * 1024
             await self._evict_lru(estimated_bytes)
 
-            outtmpl = os.path.join(self.cache_dir, f"{cache_key}.%(ext)s")
-            opts = {**YTDL_DOWNLOAD_OPTIONS, "outtmpl": outtmpl}
-
-            loop = asyncio.get_event_loop()
-            try:
-                info = await loop.run_in_executor(None, self._download_sync, opts, url)
-            except Exception as e:
-                log.error("Download failed for %s: %s", cache_key, e)
-                return None
-
-            if not info:
+            if direct and self.http:
+                file_path = await self._download_direct(cache_key, url)
+            else:
+                file_path = await self._download_ytdl(cache_key, url)
+            if not file_path:
                 return None
 
-            # Find the downloaded file
-            ext = info.get("ext", "opus")
-            file_path = os.path.join(self.cache_dir, f"{cache_key}.{ext}")
-            if not os.path.isfile(file_path):
-                # yt-dlp may have used a different extension, scan for it
-                for f in os.listdir(self.cache_dir):
-                    if f.startswith(f"{cache_key}.") and f != "cache.db":
-                        file_path = os.path.join(self.cache_dir, f)
-                        break
-                else:
-                    return None
-
             size_bytes = os.path.getsize(file_path)
             now = time.time()
-            await self._db.execute(
+            await self.storage.execute(
                 "INSERT OR REPLACE INTO cache_entries (cache_key, file_path, size_bytes, last_accessed, created_at) VALUES (?, ?, ?, ?, ?)",
                 (cache_key, file_path, size_bytes, now, now),
             )
-            await self._db.commit()
             log.info("Cached %s (%.1f MB) -> %s", cache_key, size_bytes / (1024 * 1024), file_path)
             return file_path
 
+    async def _download_ytdl(self, cache_key: str, url: str) -> str | None:
+        outtmpl = os.path.join(self.cache_dir, f"{cache_key}.%(ext)s")
+        opts = {**YTDL_DOWNLOAD_OPTIONS, "outtmpl": outtmpl}
+
+        loop = asyncio.get_event_loop()
+        try:
+            info = await loop.run_in_executor(None, self._download_sync, opts, url)
+        except Exception as e:
+            log.error("Download failed for %s: %s", cache_key, e)
+            return None
+
+        if not info:
+            return None
+
+        # Find the downloaded file
+        ext = info.get("ext", "opus")
+        file_path = os.path.join(self.cache_dir, f"{cache_key}.{ext}")
+        if not os.path.isfile(file_path):
+            # yt-dlp may have used a different extension, scan for it
+            for f in os.listdir(self.cache_dir):
+                if f.startswith(f"{cache_key}.") and f != "cache.db":
+                    file_path = os.path.join(self.cache_dir, f)
+                    break
+            else:
+                return None
+        return file_path
+
+    async def _download_direct(self, cache_key: str, url: str) -> str | None:
+        ext = os.path.splitext(urlparse(url).path)[1].lower() or ".audio"
+        file_path = os.path.join(self.cache_dir, f"{cache_key}{ext}")
+        partial_path = f"{file_path}.part"
+        # The probed duration comes from the server, so the size is capped too
+        max_bytes = min(self.max_size_bytes, self.max_duration_sec * DIRECT_MAX_BYTES_PER_SEC)
+        try:
+            async with self.http.get(url, timeout=aiohttp.ClientTimeout(total=None, sock_read=30)) as resp:
+                resp.raise_for_status()
+                if resp.content_length and resp.content_length > max_bytes:
+                    raise ValueError(f"{resp.content_length} bytes exceeds the {max_bytes} byte limit")
+                received = 0
+                buffer = bytearray()
+                # File I/O happens in a worker thread, a buffer's worth at a time
+                f = await asyncio.to_thread(open, partial_path, "wb")
+                try:
+                    async for chunk in resp.content.iter_chunked(64 * 1024):
+                        received += len(chunk)
+                        if received > max_bytes:
+                            raise ValueError(f"download exceeded the {max_bytes} byte limit")
+                        buffer += chunk
+                        if len(buffer) >= DIRECT_WRITE_BUFFER:
+                            await asyncio.to_thread(f.write, bytes(buffer))
+                            buffer.clear()
+                    if buffer:
+                        await asyncio.to_thread(f.write, bytes(buffer))
+                finally:
+                    await asyncio.to_thread(f.close)
+            await asyncio.to_thread(os.replace, partial_path, file_path)
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+            log.error("Download failed for %s: %s", cache_key, e)
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+            return None
+        return file_path
+
     @staticmethod
     def _download_sync(opts: dict, url: str) -> dict | None:
         with yt_dlp.YoutubeDL(opts) as ydl:
             return ydl.extract_info(url, download=True)
 
     async def _evict_lru(self, needed_bytes: int):
-        if not self._db:
+        if not self.storage.ready:
             return
-        async with self._db.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM cache_entries") as cursor:
-            row = await cursor.fetchone()
-            current_size = row[0]
+        (current_size,) = await self.storage.fetchone("SELECT COALESCE(SUM(size_bytes), 0) FROM cache_entries")
 
         while current_size + needed_bytes > self.max_size_bytes:
-            async with self._db.execute(
+            oldest = await self.storage.fetchone(
                 "SELECT cache_key, file_path, size_bytes FROM cache_entries ORDER BY last_accessed ASC LIMIT 1"
-            ) as cursor:
-                oldest = await cursor.fetchone()
+            )
             if not oldest:
                 break
             key, path, size = oldest
@@ -175,38 +237,37 @@ class CacheManager:
                     os.remove(path)
             except OSError:
                 pass
-            await self._db.execute("DELETE FROM cache_entries WHERE cache_key = ?", (key,))
-            await self._db.commit()
+            await self.storage.execute("DELETE FROM cache_entries WHERE cache_key = ?", (key,))
+            self._notify_removed([key])
             current_size -= size
             log.info("Evicted %s (%.1f MB) to free space", key, size / (1024 * 1024))
 
     async def _cleanup(self):
-        if not self._db:
+        if not self.storage.ready:
             return
         # Remove DB records whose files are missing
-        async with self._db.execute("SELECT cache_key, file_path FROM cache_entries") as cursor:
-            rows = await cursor.fetchall()
-        for key, path in rows:
-            if not os.path.isfile(path):
-                await self._db.execute("DELETE FROM cache_entries WHERE cache_key = ?", (key,))
+        rows = await self.storage.fetchall("SELECT cache_key, file_path FROM cache_entries")
+        missing = [(key,) for key, path in rows if not os.path.isfile(path)]
+        if missing:
+            await self.storage.executemany("DELETE FROM cache_entries WHERE cache_key = ?", missing)
+            self._notify_removed([key for (key,) in missing])
 
         # Remove orphan files (no DB record)
         db_files = {path for _, path in rows}
         if os.path.isdir(self.cache_dir):
             for f in os.listdir(self.cache_dir):
                 full = os.path.join(self.cache_dir, f)
-                if full not in db_files and f not in ("cache.db", "cache.db-journal", "cache.db-wal"):
+                # Leave the bot's databases (bot.db, tracks.db, older per-store files and their WAL files) alone
+                if full not in db_files and not f.endswith((".db", ".db-wal", ".db-shm")):
                     try:
                         os.remove(full)
                     except OSError:
                         pass
-        await self._db.commit()
 
     async def get_stats(self) -> dict:
-        if not self._db:
+        if not self.storage.ready:
             return {"count": 0, "total_size_mb": 0, "hits": self.hits, "misses": self.misses}
-        async with self._db.execute("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM cache_entries") as cursor:
-            row = await cursor.fetchone()
+        row = await self.storage.fetchone("SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM cache_entries")
         return {
             "count": row[0],
             "total_size_mb": round(row[1] / (1024 * 1024), 1),
@@ -216,17 +277,16 @@ class CacheManager:
         }
 
     async def clear_all(self):
-        if not self._db:
+        if not self.storage.ready:
             return
-        async with self._db.execute("SELECT file_path FROM cache_entries") as cursor:
-            rows = await cursor.fetchall()
+        rows = await self.storage.fetchall("SELECT file_path FROM cache_entries")
         for (path,) in rows:
             try:
                 if os.path.isfile(path):
                     os.remove(path)
             except OSError:
                 pass
-        await self._db.execute("DELETE FROM cache_entries")
-        await self._db.commit()
+        await self.storage.execute("DELETE FROM cache_entries")
+        self._notify_removed(None)
         self.hits = 0
         self.misses = 0
@@ -0,0 +1,40 @@
+import logging
+
+import aiohttp
+
+log = logging.getLogger("bot.http")
+
+# Connection pool shared by every outbound HTTP call the bot makes
+POOL_LIMIT = 100
+POOL_LIMIT_PER_HOST = 10
+DNS_CACHE_TTL = 300
+KEEPALIVE_TIMEOUT = 30
+DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=5, sock_read=10)
+
+
+def create_http_session() -> aiohttp.ClientSession:
+    """A keep-alive, connection-pooled client with cached DNS and default timeouts.
+    Callers can still pass a tighter `timeout=` per request."""
+    connector = aiohttp.TCPConnector(
+        limit=POOL_LIMIT,
+        limit_per_host=POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=DEFAULT_TIMEOUT)
+
+
+def get_http_session(bot) -> aiohttp.ClientSession:
+    """The bot's shared client, created on first use (must be called on the event loop)."""
+    http = getattr(bot, "http_session", None)
+    if http is None or http.closed:
+        http = bot.http_session = create_http_session()
+        log.debug("Created shared HTTP session")
+    return http
+
+
+async def close_http_session(bot):
+    http = getattr(bot, "http_session", None)
+    if http is not None:
+        bot.http_session = None
+        await http.close()
@@ -0,0 +1,258 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiosqlite
+
+from utils.storage import Storage
+
+try:
+    import mutagen
+except ImportError:  # optional: without it titles come from file names
+    mutagen = None
+
+log = logging.getLogger("bot.library")
+
+AUDIO_EXTENSIONS = {".mp3", ".flac", ".ogg", ".opus", ".m4a", ".aac", ".wav", ".wma", ".webm", ".mka"}
+LIBRARY_URL_PREFIX = "library:"
+# Files per tag-parsing job, and rows per committed transaction
+SCAN_BATCH_SIZE = 256
+SCAN_WORKERS = 4
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# The library table itself is created by a Storage migration
+_FTS_SCHEMA = (
+    """CREATE VIRTUAL TABLE library_fts USING fts5(
+        title, artist, album,
+        content='library', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER library_ai AFTER INSERT ON library BEGIN
+        INSERT INTO library_fts(rowid, title, artist, album) VALUES (new.id, new.title, new.artist, new.album);
+    END""",
+    """CREATE TRIGGER library_ad AFTER DELETE ON library BEGIN
+        INSERT INTO library_fts(library_fts, rowid, title, artist, album)
+        VALUES ('delete', old.id, old.title, old.artist, old.album);
+    END""",
+    """CREATE TRIGGER library_au AFTER UPDATE ON library BEGIN
+        INSERT INTO library_fts(library_fts, rowid, title, artist, album)
+        VALUES ('delete', old.id, old.title, old.artist, old.album);
+        INSERT INTO library_fts(rowid, title, artist, album) VALUES (new.id, new.title, new.artist, new.album);
+    END""",
+    # Index whatever the table already holds (e.g. rows imported from library.db)
+    "INSERT INTO library_fts(library_fts) VALUES ('rebuild')",
+)
+
+
+def _walk(root: str) -> dict[str, tuple[float, int]]:
+    """relative path -> (mtime, size) for every audio file under root."""
+    found: dict[str, tuple[float, int]] = {}
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            log.warning("Cannot read %s: %s", directory, e)
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS:
+                    st = entry.stat()
+                    found[os.path.relpath(entry.path, root)] = (st.st_mtime, st.st_size)
+            except OSError:
+                continue
+    return found
+
+
+def _first(tags, key: str) -> str | None:
+    value = tags.get(key) if tags else None
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if not value:
+        return None
+    return str(value).strip() or None
+
+
+def _parse_tags(root: str, rel_paths: list[str]) -> list[tuple[str, str, str | None, str | None, int]]:
+    """(path, title, artist, album, duration) for each file; runs in the scan pool."""
+    parsed = []
+    for rel in rel_paths:
+        stem = os.path.splitext(os.path.basename(rel))[0]
+        title, artist, album, duration = None, None, None, 0
+        if mutagen is not None:
+            try:
+                audio = mutagen.File(os.path.join(root, rel), easy=True)
+            except Exception:
+                audio = None
+            if audio is not None:
+                title = _first(audio.tags, "title")
+                artist = _first(audio.tags, "artist")
+                album = _first(audio.tags, "album")
+                duration = int(getattr(audio.info, "length", 0) or 0)
+        if not title:
+            # "Artist - Title.ext" is the most common naming scheme
+            if " - " in stem and not artist:
+                artist, title = (part.strip() for part in stem.split(" - ", 1))
+            else:
+                title = stem
+        parsed.append((rel, title, artist, album, duration))
+    return parsed
+
+
+class MusicLibrary:
+    """Catalog of a local music directory (MUSIC_LIBRARY_DIR) in the bot's
+    database, with an FTS5 index over titles, artists and albums.
+
+    Scans are incremental: the directory is walked in a worker thread, only
+    files whose mtime or size changed are re-read, and tag parsing runs in a
+    small thread pool in batches, so large libraries never block the event
+    loop. Tracks are addressed as "library:<id>" and play straight from disk."""
+
+    def __init__(self, storage: Storage, root: str = ""):
+        self.storage = storage
+        self.root = os.environ.get("MUSIC_LIBRARY_DIR", root)
+        self._ready = False
+        self._scan_lock = asyncio.Lock()
+        self.last_scan: dict = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    @staticmethod
+    def is_library_url(url: str) -> bool:
+        return bool(url) and url.startswith(LIBRARY_URL_PREFIX)
+
+    async def initialize(self):
+        if not self.enabled:
+            return
+        if not os.path.isdir(self.root):
+            log.warning("MUSIC_LIBRARY_DIR %s is not a directory; library disabled", self.root)
+            self.root = ""
+            return
+        try:
+            await self.storage.transaction(self._create_index)
+        except aiosqlite.OperationalError as e:
+            # SQLite built without FTS5
+            log.warning("Music library disabled: %s", e)
+            self.root = ""
+            return
+        self._ready = True
+
+    @staticmethod
+    async def _create_index(db: aiosqlite.Connection):
+        async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'library_fts'") as cursor:
+            if await cursor.fetchone():
+                return
+        for statement in _FTS_SCHEMA:
+            await db.execute(statement)
+
+    async def close(self):
+        # Let a running scan finish its writes first
+        async with self._scan_lock:
+            self._ready = False
+
+    async def scan(self) -> dict:
+        """Bring the catalog in line with the directory. Returns counts of
+        added, updated and removed files."""
+        async with self._scan_lock:
+            if not self._ready:
+                return {}
+            started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            on_disk = await loop.run_in_executor(None, _walk, self.root)
+            rows = await self.storage.fetchall("SELECT path, mtime, size FROM library")
+            known = {path: (mtime, size) for path, mtime, size in rows}
+
+            removed = [path for path in known if path not in on_disk]
+            changed = [path for path, stat in on_disk.items() if known.get(path) != stat]
+            for i in range(0, len(removed), SCAN_BATCH_SIZE):
+                await self.storage.executemany(
+                    "DELETE FROM library WHERE path = ?", [(p,) for p in removed[i:i + SCAN_BATCH_SIZE]]
+                )
+
+            batches = [changed[i:i + SCAN_BATCH_SIZE] for i in range(0, len(changed), SCAN_BATCH_SIZE)]
+            with ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="library-scan") as pool:
+                for i in range(0, len(batches), SCAN_WORKERS):
+                    results = await asyncio.gather(*(
+                        loop.run_in_executor(pool, _parse_tags, self.root, batch)
+                        for batch in batches[i:i + SCAN_WORKERS]
+                    ))
+                    rows = [
+                        (path, *on_disk[path], title, artist, album, duration)
+                        for parsed in results
+                        for path, title, artist, album, duration in parsed
+                    ]
+                    await self.storage.executemany(
+                        """INSERT INTO library (path, mtime, size, title, artist, album, duration)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)
+                           ON CONFLICT(path) DO UPDATE SET
+                               mtime = excluded.mtime, size = excluded.size, title = excluded.title,
+                               artist = excluded.artist, album = excluded.album, duration = excluded.duration""",
+                        rows,
+                    )
+
+            self.last_scan = {
+                "added": sum(1 for path in changed if path not in known),
+                "updated": sum(1 for path in changed if path in known),
+                "removed": len(removed),
+                "total": len(on_disk),
+                "seconds": round(time.monotonic() - started, 2),
+            }
+            log.info("Library scan: %s", self.last_scan)
+            return self.last_scan
+
+    @staticmethod
+    def _track(track_id: int, title: str, artist: str | None, duration: int) -> dict:
+        return {
+            "title": f"{artist} - {title}" if artist else title,
+            "webpage_url": f"{LIBRARY_URL_PREFIX}{track_id}",
+            "duration": duration,
+            "thumbnail": "",
+        }
+
+    async def search(self, query: str, limit: int = 10) -> list[dict]:
+        """Matching tracks in the shape of YouTube search results."""
+        tokens = _TOKEN_RE.findall(query.lower())
+        if not self._ready or not tokens:
+            return []
+        expr = " ".join([f'"{t}"' for t in tokens[:-1]] + [f'"{tokens[-1]}"*'])
+        rows = await self.storage.fetchall(
+            """SELECT l.id, l.title, l.artist, l.duration
+               FROM library_fts JOIN library l ON l.id = library_fts.rowid
+               WHERE library_fts MATCH ? ORDER BY bm25(library_fts, 10.0, 5.0, 2.0) LIMIT ?""",
+            (expr, limit),
+        )
+        return [self._track(*row) for row in rows]
+
+    async def get(self, url: str) -> tuple[str, dict] | None:
+        """(absolute file path, metadata) for a "library:<id>" URL."""
+        if not self._ready or not self.is_library_url(url):
+            return None
+        try:
+            track_id = int(url[len(LIBRARY_URL_PREFIX):])
+        except ValueError:
+            return None
+        row = await self.storage.fetchone(
+            "SELECT path, title, artist, duration FROM library WHERE id = ?", (track_id,)
+        )
+        if not row:
+            return None
+        rel_path, title, artist, duration = row
+        path = os.path.realpath(os.path.join(self.root, rel_path))
+        if not path.startswith(os.path.realpath(self.root) + os.sep) or not os.path.isfile(path):
+            return None
+        return path, self._track(track_id, title, artist, duration)
+
+    async def get_stats(self) -> dict:
+        if not self._ready:
+            return {"enabled": False}
+        (count,) = await self.storage.fetchone("SELECT COUNT(*) FROM library")
+        return {"enabled": True, "tracks": count, "last_scan": self.last_scan}
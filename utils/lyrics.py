@@ -1,20 +1,80 @@
 import os
 import asyncio
 import functools
+import logging
+import time
+
 import lyricsgenius
 
+from utils.storage import Storage
+
+log = logging.getLogger("bot.lyrics")
+
+
+class _FetchAbandoned(Exception):
+    """Set on a shared search whose caller was cancelled, so waiters retry it."""
+
 
 class LyricsFetcher:
-    def __init__(self):
+    """Genius lyrics lookups behind a persistent SQLite cache.
+
+    Results are keyed by the track's cache key when known and by its
+    normalized title otherwise, and stored under both. Misses are cached too
+    (for LYRICS_MISS_TTL seconds) so unknown tracks don't hit Genius every
+    time, and concurrent lookups of the same track share one search."""
+
+    def __init__(self, storage: Storage, miss_ttl: float = 86400):
         token = os.getenv("GENIUS_API_TOKEN")
         if token:
             self.genius = lyricsgenius.Genius(token, verbose=False, remove_section_headers=True)
         else:
             self.genius = None
+        self.storage = storage
+        self.miss_ttl = float(os.environ.get("LYRICS_MISS_TTL", miss_ttl))
+        self.prefetch_enabled = os.environ.get("LYRICS_PREFETCH", "0") == "1"
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._prefetch_tasks: set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
 
-    async def fetch_lyrics(self, title: str) -> str | None:
-        if not self.genius:
-            return None
+    async def close(self):
+        for task in self._prefetch_tasks:
+            task.cancel()
+
+    @staticmethod
+    def _keys(title: str, track_id: str = "") -> list[str]:
+        keys = [f"id:{track_id}"] if track_id else []
+        keys.append("title:" + " ".join(title.lower().split()))
+        return keys
+
+    async def _lookup(self, keys: list[str]) -> tuple[str | None, str | None]:
+        """(matching key, lyrics) from the cache; lyrics of None with a key is a cached miss."""
+        if not self.storage.ready:
+            return None, None
+        placeholders = ",".join("?" * len(keys))
+        rows = await self.storage.fetchall(
+            f"SELECT key, lyrics, fetched_at FROM lyrics WHERE key IN ({placeholders})", keys
+        )
+        found = {key: (lyrics, fetched_at) for key, lyrics, fetched_at in rows}
+        for key in keys:
+            if key not in found:
+                continue
+            lyrics, fetched_at = found[key]
+            if lyrics is None and time.time() - fetched_at > self.miss_ttl:
+                continue
+            return key, lyrics
+        return None, None
+
+    async def _store(self, keys: list[str], lyrics: str | None):
+        if not self.storage.ready:
+            return
+        now = time.time()
+        await self.storage.executemany(
+            "INSERT OR REPLACE INTO lyrics (key, lyrics, fetched_at) VALUES (?, ?, ?)",
+            [(key, lyrics, now) for key in keys],
+        )
+
+    async def _search(self, title: str) -> str | None:
         loop = asyncio.get_event_loop()
         partial = functools.partial(self.genius.search_song, title)
         song = await loop.run_in_executor(None, partial)
@@ -22,6 +82,68 @@ class LyricsFetcher:
             return song.lyrics
         return None
 
+    async def fetch_lyrics(self, title: str, track_id: str = "") -> str | None:
+        if not self.genius:
+            return None
+        keys = self._keys(title, track_id)
+        hit, lyrics = await self._lookup(keys)
+        if hit:
+            self.hits += 1
+            # Backfill the ID key when the track was first seen by title only
+            if hit != keys[0] and lyrics is not None:
+                await self._store(keys[:1], lyrics)
+            return lyrics
+
+        # Keyed by the most specific key: different tracks can share a title
+        inflight = self._inflight.get(keys[0])
+        if inflight is not None:
+            try:
+                return await asyncio.shield(inflight)
+            except _FetchAbandoned:
+                return await self.fetch_lyrics(title, track_id)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[keys[0]] = future
+        try:
+            lyrics = await self._search(title)
+        except Exception as e:
+            # Not cached: a Genius outage isn't a miss
+            future.set_exception(e)
+            future.exception()
+            raise
+        else:
+            # Waiters get the lyrics whether or not caching them works
+            future.set_result(lyrics)
+            try:
+                await self._store(keys, lyrics)
+            except Exception as e:
+                log.warning("Failed to cache lyrics for %s: %s", title, e)
+        finally:
+            self._inflight.pop(keys[0], None)
+            if not future.done():
+                # This caller was cancelled: tell waiters to search for themselves
+                future.set_exception(_FetchAbandoned())
+                future.exception()
+        return lyrics
+
+    def prefetch(self, title: str, track_id: str = ""):
+        """Warm the cache for a track in the background (LYRICS_PREFETCH=1)."""
+        if not self.prefetch_enabled or not self.genius:
+            return
+        task = asyncio.create_task(self._prefetch(title, track_id))
+        self._prefetch_tasks.add(task)
+        task.add_done_callback(self._prefetch_tasks.discard)
+
+    async def _prefetch(self, title: str, track_id: str):
+        try:
+            await self.fetch_lyrics(title, track_id)
+        except Exception as e:
+            log.debug("Lyrics prefetch failed for %s: %s", title, e)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "prefetch": self.prefetch_enabled}
+
     @staticmethod
     def split_lyrics(lyrics: str, limit: int = 4096) -> list[str]:
         if len(lyrics) <= limit:
@@ -1,8 +1,10 @@
+import os
 import random
 import time
-from dataclasses import dataclass, field
-from collections import defaultdict
+from collections import deque
+from dataclasses import dataclass, field, asdict
 from enum import Enum
+from typing import Callable
 
 
 class LoopMode(Enum):
@@ -19,6 +21,91 @@ class Song:
     requester: str
     duration: int = 0
     thumbnail: str = ""
+    cache_key: str = ""
+
+    def source_data(self) -> dict:
+        """Resolved metadata in the shape YTDLSource expects, for replaying without extraction."""
+        return {
+            "title": self.title,
+            "webpage_url": self.url,
+            "duration": self.duration,
+            "thumbnail": self.thumbnail,
+        }
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Song":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+
+def _batch_song(data) -> Song:
+    """A Song from client-supplied batch data: text fields must be strings
+    and the duration a whole number of seconds."""
+    if not isinstance(data, dict):
+        raise TypeError("song must be an object")
+    song = Song.from_dict(data)
+    for name in ("title", "url", "search_query", "requester", "thumbnail", "cache_key"):
+        if not isinstance(getattr(song, name), str):
+            raise TypeError(f"{name} must be a string")
+    if isinstance(song.duration, bool):
+        raise TypeError("duration must be a number")
+    song.duration = int(song.duration or 0)
+    return song
+
+
+def _batch_index(value) -> int:
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise TypeError("index must be an integer")
+    return value
+
+
+HISTORY_SIZE = int(os.getenv("HISTORY_SIZE", "50"))
+
+
+class PlayHistory:
+    """Fixed-capacity ring buffer of finished tracks, with a hash index over
+    their cache keys for O(1) "recently played" checks."""
+
+    def __init__(self, capacity: int = HISTORY_SIZE):
+        self._items: deque[Song] = deque(maxlen=capacity)
+        self._index: dict[str, int] = {}
+
+    def _unindex(self, song: Song):
+        if not song.cache_key:
+            return
+        count = self._index.get(song.cache_key, 0) - 1
+        if count > 0:
+            self._index[song.cache_key] = count
+        else:
+            self._index.pop(song.cache_key, None)
+
+    def push(self, song: Song):
+        if len(self._items) == self._items.maxlen:
+            self._unindex(self._items[0])
+        self._items.append(song)
+        if song.cache_key:
+            self._index[song.cache_key] = self._index.get(song.cache_key, 0) + 1
+
+    def pop(self) -> Song | None:
+        """Remove and return the most recently finished track."""
+        if not self._items:
+            return None
+        song = self._items.pop()
+        self._unindex(song)
+        return song
+
+    def recent(self, limit: int | None = None) -> list[Song]:
+        """Finished tracks, newest first."""
+        items = list(reversed(self._items))
+        return items[:limit] if limit is not None else items
+
+    def __contains__(self, cache_key: str) -> bool:
+        return cache_key in self._index
+
+    def __len__(self) -> int:
+        return len(self._items)
 
 
 @dataclass
@@ -28,32 +115,135 @@ class GuildQueue:
     volume: float = 0.5
     loop_mode: LoopMode = LoopMode.OFF
     start_time: float = 0.0
+    # When the current track was paused; the position doesn't advance while set
+    paused_at: float | None = None
     skip_votes: set = field(default_factory=set)
     twenty_four_seven: bool = False
     audio_filter: str = ""
     audio_filter_name: str = ""
+    # Shuffle is a playback mode over the unchanged queue: next() draws a
+    # seeded pseudo-random index instead of 0, so toggling is O(1) and turning
+    # it off leaves the original order intact.
+    shuffle_seed: int | None = None
+    shuffle_draws: int = 0
+    # Set by previous(): the next advance takes queue[0] even when shuffled
+    play_front: bool = field(default=False, repr=False, compare=False)
+    history: PlayHistory = field(default_factory=PlayHistory, repr=False, compare=False)
+    no_repeat: bool = False
+    # Incremented on every recorded mutation
+    version: int = 0
+    guild_id: int = 0
+    # Called as on_mutation(guild_id, op, payload) after every queue mutation
+    on_mutation: Callable[[int, str, dict], None] | None = field(default=None, repr=False, compare=False)
+
+    def position(self, now: float | None = None) -> float:
+        """Seconds into the current track, frozen while paused."""
+        if not self.start_time:
+            return 0.0
+        return (self.paused_at or now or time.time()) - self.start_time
+
+    def set_position(self, seconds: float):
+        """(Re)start the position clock, e.g. when a track starts or is seeked."""
+        self.start_time = time.time() - seconds
+        self.paused_at = None
+
+    def mark_paused(self):
+        if self.paused_at is None:
+            self.paused_at = time.time()
+
+    def mark_resumed(self):
+        if self.paused_at is not None:
+            self.start_time += time.time() - self.paused_at
+            self.paused_at = None
+
+    def _record(self, op: str, **payload):
+        self.version += 1
+        if self.on_mutation:
+            self.on_mutation(self.guild_id, op, payload)
 
     def add(self, song: Song):
+        self._record("insert", index=len(self.queue), songs=[song.to_dict()])
         self.queue.append(song)
 
     def add_top(self, song: Song):
         self.queue.insert(0, song)
+        self._record("insert", index=0, songs=[song.to_dict()])
+
+    def extend(self, songs: list[Song]):
+        """Append several songs as a single mutation."""
+        if not songs:
+            return
+        self._record("insert", index=len(self.queue), songs=[s.to_dict() for s in songs])
+        self.queue.extend(songs)
+
+    @property
+    def shuffled(self) -> bool:
+        return self.shuffle_seed is not None
+
+    def _next_index(self, requeued: bool = False) -> int:
+        if not self.shuffled or len(self.queue) < 2:
+            return 0
+        # Don't immediately replay a track that loop-queue just put back
+        size = len(self.queue) - 1 if requeued else len(self.queue)
+        return random.Random(f"{self.shuffle_seed}:{self.shuffle_draws}").randrange(size)
+
+    def peek_next(self) -> Song | None:
+        """The song next() would advance to, without advancing."""
+        if self.loop_mode == LoopMode.TRACK and self.current:
+            return self.current
+        if not self.queue:
+            return self.current if self.loop_mode == LoopMode.QUEUE else None
+        return self.queue[0 if self.play_front else self._next_index()]
 
     def next(self) -> Song | None:
         if self.loop_mode == LoopMode.TRACK and self.current:
             return self.current
-        if self.loop_mode == LoopMode.QUEUE and self.current:
+        had_current = self.current is not None
+        requeue = self.loop_mode == LoopMode.QUEUE and had_current
+        if had_current:
+            self.history.push(self.current)
+        if requeue:
             self.queue.append(self.current)
+        index = 0
         if self.queue:
-            self.current = self.queue.pop(0)
+            if not self.play_front:
+                index = self._next_index(requeued=requeue)
+            self.current = self.queue.pop(index)
             self.skip_votes.clear()
-            return self.current
+            if self.shuffled:
+                self.shuffle_draws += 1
+        else:
+            self.current = None
+        self.play_front = False
+        if had_current or self.current:
+            self._record("advance", index=index, requeue=requeue)
+        return self.current
+
+    def previous(self) -> Song | None:
+        """Step back to the most recently finished track.
+
+        The previous track is put at the front of the queue (ahead of the
+        current one) and current is cleared, so the next advance plays it
+        (even in shuffle mode) without pushing the interrupted track into
+        history."""
+        song = self.history.pop()
+        if song is None:
+            return None
+        if self.current:
+            self.queue.insert(0, self.current)
+            self._record("insert", index=0, songs=[self.current.to_dict()])
+        self.queue.insert(0, song)
+        self._record("insert", index=0, songs=[song.to_dict()])
         self.current = None
-        return None
+        self.play_front = True
+        self._record("current", song=None)
+        return song
 
     def remove(self, index: int) -> Song | None:
         if 0 <= index < len(self.queue):
-            return self.queue.pop(index)
+            song = self.queue.pop(index)
+            self._record("remove", index=index)
+            return song
         return None
 
     def move(self, from_idx: int, to_idx: int) -> bool:
@@ -61,23 +251,152 @@ class GuildQueue:
             return False
         song = self.queue.pop(from_idx)
         self.queue.insert(to_idx, song)
+        self._record("move", **{"from": from_idx, "to": to_idx})
         return True
 
-    def shuffle(self):
-        random.shuffle(self.queue)
+    def apply_batch(self, ops: list[dict]) -> str | None:
+        """Apply an ordered list of insert/remove/move ops as a single mutation.
+
+        Indices refer to the queue as left by the preceding ops; an insert
+        without an index appends. Everything is validated against a copy
+        first, so on error the queue is untouched and the message is returned."""
+        queue = list(self.queue)
+        applied = []
+        for i, op in enumerate(ops):
+            if not isinstance(op, dict):
+                return f"Operation {i}: not an object"
+            kind = op.get("op")
+            try:
+                if kind == "insert":
+                    index = op.get("index")
+                    index = len(queue) if index is None else _batch_index(index)
+                    if not 0 <= index <= len(queue):
+                        raise IndexError(index)
+                    if not isinstance(op["songs"], list):
+                        raise TypeError("songs must be a list")
+                    songs = [_batch_song(s) for s in op["songs"]]
+                    queue[index:index] = songs
+                    applied.append({"op": "insert", "index": index, "songs": [s.to_dict() for s in songs]})
+                elif kind == "remove":
+                    index = _batch_index(op["index"])
+                    if not 0 <= index < len(queue):
+                        raise IndexError(index)
+                    del queue[index]
+                    applied.append({"op": "remove", "index": index})
+                elif kind == "move":
+                    from_idx, to_idx = _batch_index(op["from"]), _batch_index(op["to"])
+                    if not (0 <= from_idx < len(queue) and 0 <= to_idx < len(queue)):
+                        raise IndexError(from_idx)
+                    queue.insert(to_idx, queue.pop(from_idx))
+                    applied.append({"op": "move", "from": from_idx, "to": to_idx})
+                else:
+                    return f"Operation {i}: unknown op {kind!r}"
+            except (IndexError, KeyError, TypeError, ValueError, AttributeError, OverflowError):
+                return f"Operation {i}: invalid {kind} arguments"
+        self.queue = queue
+        self._record("batch", ops=applied)
+        return None
+
+    def shuffle(self) -> bool:
+        """Toggle shuffle mode. Returns True if shuffle is now on."""
+        self.shuffle_seed = None if self.shuffled else random.getrandbits(32)
+        self.shuffle_draws = 0
+        self._record("shuffle", seed=self.shuffle_seed)
+        return self.shuffled
 
     def clear(self):
         self.queue.clear()
         self.current = None
+        self.play_front = False
         self.skip_votes.clear()
+        self._record("clear")
+
+    # --- Persistence ---
+
+    def apply(self, op: str, payload: dict):
+        """Replay a recorded mutation. Does not notify on_mutation."""
+        if op == "insert":
+            index = payload["index"]
+            self.queue[index:index] = [Song.from_dict(s) for s in payload["songs"]]
+        elif op == "remove":
+            del self.queue[payload["index"]]
+        elif op == "move":
+            song = self.queue.pop(payload["from"])
+            self.queue.insert(payload["to"], song)
+        elif op == "advance":
+            if self.current:
+                self.history.push(self.current)
+            if payload["requeue"] and self.current:
+                self.queue.append(self.current)
+            self.current = self.queue.pop(payload["index"]) if self.queue else None
+            if self.shuffled:
+                self.shuffle_draws += 1
+        elif op == "batch":
+            for sub in payload["ops"]:
+                self.apply(sub["op"], sub)
+        elif op == "current":
+            self.current = Song.from_dict(payload["song"]) if payload["song"] else None
+        elif op == "shuffle":
+            self.shuffle_seed = payload["seed"]
+            self.shuffle_draws = 0
+        elif op == "clear":
+            self.queue.clear()
+            self.current = None
+        else:
+            raise ValueError(f"Unknown queue op: {op}")
+
+    def snapshot(self) -> dict:
+        return {
+            "queue": [s.to_dict() for s in self.queue],
+            "current": self.current.to_dict() if self.current else None,
+            "shuffle_seed": self.shuffle_seed,
+            "shuffle_draws": self.shuffle_draws,
+        }
+
+    def restore(self, snapshot: dict):
+        self.queue = [Song.from_dict(s) for s in snapshot.get("queue", [])]
+        current = snapshot.get("current")
+        self.current = Song.from_dict(current) if current else None
+        self.shuffle_seed = snapshot.get("shuffle_seed")
+        self.shuffle_draws = snapshot.get("shuffle_draws", 0)
 
 
 class QueueManager:
     def __init__(self):
-        self._queues: dict[int, GuildQueue] = defaultdict(GuildQueue)
+        self._queues: dict[int, GuildQueue] = {}
+        self._listeners: list[Callable[[int, str, dict], None]] = []
+        # Last version of removed queues, so a recreated queue keeps counting up
+        self._retired_versions: dict[int, int] = {}
+
+    def add_listener(self, listener: Callable[[int, str, dict], None]):
+        """Register a callback invoked as listener(guild_id, op, payload) on every queue mutation."""
+        self._listeners.append(listener)
+
+    def _notify(self, guild_id: int, op: str, payload: dict):
+        for listener in self._listeners:
+            listener(guild_id, op, payload)
 
     def get(self, guild_id: int) -> GuildQueue:
-        return self._queues[guild_id]
+        gq = self._queues.get(guild_id)
+        if gq is None:
+            gq = self._queues[guild_id] = GuildQueue(
+                guild_id=guild_id,
+                on_mutation=self._notify,
+                version=self._retired_versions.pop(guild_id, 0),
+            )
+        return gq
+
+    def peek(self, guild_id: int) -> GuildQueue | None:
+        """Return the guild's queue without creating one."""
+        return self._queues.get(guild_id)
 
     def remove(self, guild_id: int):
-        self._queues.pop(guild_id, None)
+        gq = self._queues.get(guild_id)
+        if gq is None:
+            return
+        # Record the clear while the queue is still registered, so listeners
+        # (dashboard deltas, the journal) see it before the queue goes away
+        if gq.queue or gq.current:
+            gq.clear()
+        del self._queues[guild_id]
+        self._retired_versions[guild_id] = gq.version
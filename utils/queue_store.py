@@ -0,0 +1,157 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+
+import aiosqlite
+
+from utils.storage import Storage
+
+log = logging.getLogger("bot.queue_store")
+
+
+class QueueStore:
+    """Persists guild queues as an append-only journal of mutations, compacted
+    into a per-guild snapshot once a guild has accumulated enough ops. Recovery
+    loads each snapshot and replays at most `snapshot_every` ops on top of it."""
+
+    def __init__(self, storage: Storage, snapshot_every: int = 200):
+        self.storage = storage
+        self.snapshot_every = int(os.environ.get("QUEUE_SNAPSHOT_EVERY", snapshot_every))
+        self._pending: list[tuple[int, str, str, float]] = []
+        self._ops_since_snapshot: dict[int, int] = defaultdict(int)
+        self._flush_lock = asyncio.Lock()
+
+    async def initialize(self):
+        rows = await self.storage.fetchall("SELECT guild_id, COUNT(*) FROM queue_journal GROUP BY guild_id")
+        for guild_id, count in rows:
+            self._ops_since_snapshot[guild_id] = count
+
+    async def close(self):
+        await self.flush()
+
+    def record(self, guild_id: int, op: str, payload: dict):
+        """QueueManager listener: buffer a mutation until the next flush."""
+        self._pending.append((guild_id, op, json.dumps(payload), time.time()))
+        self._ops_since_snapshot[guild_id] += 1
+
+    async def flush(self, queue_manager=None):
+        """Write buffered journal entries in one transaction and compact guilds
+        whose journal has grown past `snapshot_every` (requires queue_manager)."""
+        if not self.storage.ready:
+            return
+        async with self._flush_lock:
+            # Swap the buffer and capture snapshots together, before any await,
+            # so each snapshot reflects exactly the ops written in this flush.
+            pending, self._pending = self._pending, []
+            snapshots: dict[int, dict | None] = {}
+            compacted: dict[int, int] = {}
+            if queue_manager is not None:
+                for guild_id, count in list(self._ops_since_snapshot.items()):
+                    if count >= self.snapshot_every:
+                        gq = queue_manager.peek(guild_id)
+                        snapshots[guild_id] = gq.snapshot() if gq and (gq.queue or gq.current) else None
+                        compacted[guild_id] = self._ops_since_snapshot.pop(guild_id)
+
+            if not pending and not snapshots:
+                return
+            now = time.time()
+
+            async def write(db: aiosqlite.Connection):
+                if pending:
+                    await db.executemany(
+                        "INSERT INTO queue_journal (guild_id, op, payload, created_at) VALUES (?, ?, ?, ?)",
+                        pending,
+                    )
+                for guild_id, state in snapshots.items():
+                    async with db.execute(
+                        "SELECT COALESCE(MAX(id), 0) FROM queue_journal WHERE guild_id = ?", (guild_id,)
+                    ) as cursor:
+                        (journal_id,) = await cursor.fetchone()
+                    if state is None:
+                        await db.execute("DELETE FROM queue_snapshots WHERE guild_id = ?", (guild_id,))
+                    else:
+                        await db.execute(
+                            "INSERT OR REPLACE INTO queue_snapshots (guild_id, state, journal_id, created_at) VALUES (?, ?, ?, ?)",
+                            (guild_id, json.dumps(state), journal_id, now),
+                        )
+                    await db.execute(
+                        "DELETE FROM queue_journal WHERE guild_id = ? AND id <= ?", (guild_id, journal_id)
+                    )
+
+            try:
+                await self.storage.transaction(write)
+            except Exception:
+                # Nothing was written: put the entries back ahead of any
+                # recorded since, and keep the counts so compaction is retried
+                self._pending[:0] = pending
+                for guild_id, count in compacted.items():
+                    self._ops_since_snapshot[guild_id] += count
+                raise
+            if snapshots:
+                log.debug("Compacted queue journal for %d guild(s)", len(snapshots))
+
+    async def save_sessions(self, sessions: list[tuple]):
+        """Replace the set of active playback sessions.
+
+        Each row is (guild_id, voice_channel_id, position, paused, loop_mode,
+        audio_filter, audio_filter_name, updated_at)."""
+        if not self.storage.ready:
+            return
+
+        async def write(db: aiosqlite.Connection):
+            await db.execute("DELETE FROM queue_sessions")
+            if sessions:
+                await db.executemany(
+                    "INSERT INTO queue_sessions (guild_id, voice_channel_id, position, paused, loop_mode, "
+                    "audio_filter, audio_filter_name, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    sessions,
+                )
+
+        await self.storage.transaction(write)
+
+    async def restore(self, queue_manager) -> dict[int, dict]:
+        """Rebuild queues from snapshots + journal. Returns saved sessions by guild ID."""
+        if not self.storage.ready:
+            return {}
+        started = time.perf_counter()
+        snapshots = await self.storage.fetchall("SELECT guild_id, state FROM queue_snapshots")
+        for guild_id, state in snapshots:
+            queue_manager.get(guild_id).restore(json.loads(state))
+
+        replayed = 0
+        journal = await self.storage.fetchall("""
+            SELECT j.guild_id, j.op, j.payload FROM queue_journal j
+            LEFT JOIN queue_snapshots s ON s.guild_id = j.guild_id
+            WHERE j.id > COALESCE(s.journal_id, 0)
+            ORDER BY j.id
+        """)
+        for guild_id, op, payload in journal:
+            try:
+                queue_manager.get(guild_id).apply(op, json.loads(payload))
+                replayed += 1
+            except (IndexError, KeyError, ValueError) as e:
+                log.warning("[Guild %d] Skipping unreplayable queue op %s: %s", guild_id, op, e)
+
+        rows = await self.storage.fetchall(
+            "SELECT guild_id, voice_channel_id, position, paused, loop_mode, audio_filter, audio_filter_name "
+            "FROM queue_sessions"
+        )
+        sessions = {
+            row[0]: {
+                "voice_channel_id": row[1],
+                "position": row[2],
+                "paused": bool(row[3]),
+                "loop_mode": row[4],
+                "audio_filter": row[5],
+                "audio_filter_name": row[6],
+            }
+            for row in rows
+        }
+        log.info(
+            "Restored %d queue snapshot(s), replayed %d op(s), %d session(s) in %.0f ms",
+            len(snapshots), replayed, len(sessions), (time.perf_counter() - started) * 1000,
+        )
+        return sessions
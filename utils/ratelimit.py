@@ -0,0 +1,90 @@
+import logging
+import os
+import time
+
+log = logging.getLogger("bot.ratelimit")
+
+# Token cost of each rate-limited action, roughly proportional to the
+# yt-dlp / FFmpeg / external API work it can trigger
+ACTION_COSTS = {
+    "add": 1.0,
+    "batch": 2.0,
+    "filter": 3.0,
+    "import": 10.0,
+    "lyrics": 2.0,
+    "playlist": 5.0,
+    "search": 2.0,
+    "seek": 2.0,
+    "skip": 1.0,
+    "volume": 1.0,
+}
+
+# Drop idle (fully refilled) buckets once this many are tracked
+PRUNE_THRESHOLD = 10_000
+
+
+class RateLimiter:
+    """Token buckets per user and per guild.
+
+    An action is admitted only if both the user's and the guild's bucket hold
+    enough tokens for its cost, so one user can't drain a guild's budget and
+    a busy guild can't starve the extraction executor for everyone else."""
+
+    def __init__(self, user_rate: float = 1.0, user_burst: float = 10.0, guild_rate: float = 3.0, guild_burst: float = 30.0):
+        self.user_rate = float(os.environ.get("RATE_LIMIT_USER_RATE", user_rate))
+        self.user_burst = float(os.environ.get("RATE_LIMIT_USER_BURST", user_burst))
+        self.guild_rate = float(os.environ.get("RATE_LIMIT_GUILD_RATE", guild_rate))
+        self.guild_burst = float(os.environ.get("RATE_LIMIT_GUILD_BURST", guild_burst))
+        # (scope, id) -> [tokens, last update]
+        self._buckets: dict[tuple[str, int], list[float]] = {}
+        self.admitted = 0
+        self.rejected = 0
+
+    def _limits(self, scope: str) -> tuple[float, float]:
+        return (self.user_rate, self.user_burst) if scope == "user" else (self.guild_rate, self.guild_burst)
+
+    def _tokens(self, key: tuple[str, int], now: float) -> float:
+        rate, burst = self._limits(key[0])
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return burst
+        tokens, updated = bucket
+        return min(burst, tokens + (now - updated) * rate)
+
+    def check(self, user_id: int | str, guild_id: int, action: str) -> float:
+        """Charge `action` to the user's and guild's buckets.
+
+        Returns 0 if admitted, otherwise the number of seconds until it would be
+        (nothing is charged on rejection)."""
+        now = time.monotonic()
+        keys = (("user", int(user_id)), ("guild", guild_id))
+        waits = []
+        for key in keys:
+            rate, burst = self._limits(key[0])
+            cost = min(ACTION_COSTS.get(action, 1.0), burst)
+            waits.append((cost - self._tokens(key, now)) / rate)
+        retry_after = max(waits)
+        if retry_after > 0:
+            self.rejected += 1
+            log.debug("Rate limited %s for user %s in guild %d (retry in %.1fs)", action, user_id, guild_id, retry_after)
+            return retry_after
+
+        for key in keys:
+            cost = min(ACTION_COSTS.get(action, 1.0), self._limits(key[0])[1])
+            self._buckets[key] = [self._tokens(key, now) - cost, now]
+        self.admitted += 1
+        if len(self._buckets) > PRUNE_THRESHOLD:
+            self._prune(now)
+        return 0.0
+
+    def _prune(self, now: float):
+        full = [key for key in self._buckets if self._tokens(key, now) >= self._limits(key[0])[1]]
+        for key in full:
+            del self._buckets[key]
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "buckets": len(self._buckets),
+        }
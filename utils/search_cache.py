@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+log = logging.getLogger("bot.search_cache")
+
+SearchFetch = Callable[[str, int], Awaitable[list[dict]]]
+
+
+class _FetchAbandoned(Exception):
+    """Set on a shared fetch whose caller was cancelled, so waiters retry it."""
+
+
+class SearchCache:
+    """Shared LRU + TTL cache of search results keyed by normalized query.
+
+    Concurrent lookups for the same query share one fetch (single-flight). On
+    a miss, results cached for a shorter prefix of the query (e.g. from an
+    earlier keystroke) are filtered locally and reused if enough of them still
+    match every word of the longer query."""
+
+    def __init__(self, max_entries: int = 512, ttl: float = 600, env_prefix: str = "SEARCH_CACHE"):
+        self.max_entries = int(os.environ.get(f"{env_prefix}_SIZE", max_entries))
+        self.ttl = float(os.environ.get(f"{env_prefix}_TTL", ttl))
+        # query -> (expires_at, count fetched, results)
+        self._entries: OrderedDict[str, tuple[float, int, list[dict]]] = OrderedDict()
+        # query -> (count being fetched, future)
+        self._inflight: dict[str, tuple[int, asyncio.Future]] = {}
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _lookup(self, key: str, count: int) -> list[dict] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, fetched, results = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        # A list fetched with fewer results can't answer a larger request
+        # unless it came back short (i.e. there were no more to find)
+        if fetched < count and len(results) >= fetched:
+            return None
+        self._entries.move_to_end(key)
+        return results[:count]
+
+    def _from_prefix(self, key: str, count: int) -> list[dict] | None:
+        words = key.split()
+        for end in range(len(key) - 1, 1, -1):
+            results = self._lookup(key[:end], count)
+            if results is None:
+                continue
+            matching = [
+                r for r in results
+                if all(word in (r.get("title") or "").lower() for word in words)
+            ]
+            if len(matching) >= max(1, count // 2):
+                return matching
+            return None
+        return None
+
+    def _store(self, key: str, count: int, results: list[dict]):
+        self._entries[key] = (time.monotonic() + self.ttl, count, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def would_hit(self, query: str, count: int) -> bool:
+        """True if get() could answer without starting a fetch (cached, reusable
+        from a prefix, or joining one in flight). Doesn't count as a lookup."""
+        key = self.normalize(query)
+        inflight = self._inflight.get(key)
+        return (
+            self._lookup(key, count) is not None
+            or self._from_prefix(key, count) is not None
+            or (inflight is not None and inflight[0] >= count)
+        )
+
+    async def get(self, query: str, count: int, fetch: SearchFetch) -> list[dict]:
+        """Return up to `count` results for `query`, calling fetch(query, count) on a miss."""
+        key = self.normalize(query)
+        results = self._lookup(key, count)
+        if results is not None:
+            self.hits += 1
+            return list(results)
+        results = self._from_prefix(key, count)
+        if results is not None:
+            self.prefix_hits += 1
+            return list(results)
+
+        # Join a fetch for the same query only if it asked for at least as many results
+        inflight = self._inflight.get(key)
+        if inflight is not None and inflight[0] >= count:
+            self.coalesced += 1
+            try:
+                return list((await asyncio.shield(inflight[1]))[:count])
+            except _FetchAbandoned:
+                return await self.get(query, count, fetch)
+
+        self.misses += 1
+        log.debug("Search cache miss: %s", key)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (count, future)
+        try:
+            results = await fetch(query, count)
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters re-raise it; mark retrieved so it isn't logged when nobody waits
+            future.exception()
+            raise
+        else:
+            self._store(key, count, results)
+            future.set_result(results)
+        finally:
+            if self._inflight.get(key, (0, None))[1] is future:
+                del self._inflight[key]
+            if not future.done():
+                # This caller was cancelled: tell waiters to fetch for themselves
+                future.set_exception(_FetchAbandoned())
+                future.exception()
+        return list(results)
+
+    def matching(self, query: str, limit: int) -> list[dict]:
+        """Cached results (of any query) whose title contains every word of
+        `query`, most recently used first. Never fetches."""
+        words = self.normalize(query).split()
+        now = time.monotonic()
+        found, seen = [], set()
+        for expires_at, _, results in reversed(self._entries.values()):
+            if expires_at < now:
+                continue
+            for r in results:
+                title = (r.get("title") or "").lower()
+                if title in seen or not all(word in title for word in words):
+                    continue
+                seen.add(title)
+                found.append(r)
+                if len(found) >= limit:
+                    return found
+        return found
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.prefix_hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "prefix_hits": self.prefix_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": round((lookups - self.misses) / lookups, 3) if lookups else 0.0,
+        }
@@ -1,48 +1,61 @@
-import os
+import json
+import logging
 
-import aiosqlite
+from utils.storage import Storage
+
+log = logging.getLogger("bot.settings")
+
+# Stored settings are JSON documents, so new keys only need a default here
+DEFAULTS = {
+    "volume": 0.5,
+    "twenty_four_seven": False,
+    "loop_mode": "off",
+}
 
 
 class GuildSettings:
-    def __init__(self, cache_dir: str = "./cache"):
-        self.cache_dir = os.environ.get("CACHE_DIR", cache_dir)
-        self.db_path = os.path.join(self.cache_dir, "settings.db")
-        self._db: aiosqlite.Connection | None = None
+    """Per-guild settings held in memory and written behind.
+
+    Every row is loaded in one query at startup; updates only touch memory
+    and mark the guild dirty, and dirty guilds are written in a single
+    statement by flush() (called periodically and on close)."""
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self._settings: dict[int, dict] = {}
+        self._dirty: set[int] = set()
 
     async def initialize(self):
-        os.makedirs(self.cache_dir, exist_ok=True)
-        self._db = await aiosqlite.connect(self.db_path)
-        await self._db.execute("""
-            CREATE TABLE IF NOT EXISTS guild_settings (
-                guild_id INTEGER PRIMARY KEY,
-                volume REAL DEFAULT 0.5,
-                twenty_four_seven BOOLEAN DEFAULT 0
-            )
-        """)
-        await self._db.commit()
+        rows = await self.storage.fetchall("SELECT guild_id, data FROM settings")
+        for guild_id, data in rows:
+            self._settings[guild_id] = {**DEFAULTS, **json.loads(data)}
+        log.info("Loaded settings for %d guilds", len(self._settings))
 
     async def close(self):
-        if self._db:
-            await self._db.close()
-            self._db = None
-
-    async def load(self, guild_id: int) -> dict | None:
-        if not self._db:
-            return None
-        async with self._db.execute(
-            "SELECT volume, twenty_four_seven FROM guild_settings WHERE guild_id = ?",
-            (guild_id,),
-        ) as cursor:
-            row = await cursor.fetchone()
-        if row:
-            return {"volume": row[0], "twenty_four_seven": bool(row[1])}
-        return None
-
-    async def save(self, guild_id: int, volume: float, twenty_four_seven: bool):
-        if not self._db:
+        await self.flush()
+
+    def get(self, guild_id: int) -> dict | None:
+        """The guild's saved settings (with defaults filled in), or None if it has none."""
+        return self._settings.get(guild_id)
+
+    def update(self, guild_id: int, **fields):
+        """Change settings in memory; they're written on the next flush()."""
+        settings = self._settings.setdefault(guild_id, dict(DEFAULTS))
+        changed = {k: v for k, v in fields.items() if settings.get(k) != v}
+        if changed:
+            settings.update(changed)
+            self._dirty.add(guild_id)
+
+    async def flush(self):
+        if not self.storage.ready or not self._dirty:
             return
-        await self._db.execute(
-            "INSERT OR REPLACE INTO guild_settings (guild_id, volume, twenty_four_seven) VALUES (?, ?, ?)",
-            (guild_id, volume, int(twenty_four_seven)),
-        )
-        await self._db.commit()
+        dirty, self._dirty = self._dirty, set()
+        try:
+            await self.storage.executemany(
+                "INSERT OR REPLACE INTO settings (guild_id, data) VALUES (?, ?)",
+                [(guild_id, json.dumps(self._settings[guild_id])) for guild_id in dirty],
+            )
+        except Exception:
+            # Retry these on the next flush
+            self._dirty |= dirty
+            raise
@@ -0,0 +1,351 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import aiosqlite
+
+log = logging.getLogger("bot.storage")
+
+# Most writes committed together in one transaction
+MAX_BATCH = 256
+READ_CONNECTIONS = 2
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA busy_timeout=5000",
+)
+
+Transaction = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+@dataclass
+class Migration:
+    """One schema version: the DDL to run, plus rows to import from the
+    per-store database file that held these tables before (if it exists).
+    `copy` maps a legacy table name to the INSERT ... SELECT that imports it."""
+
+    schema: str
+    legacy_file: str = ""
+    copy: dict[str, str] = field(default_factory=dict)
+
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    Migration(
+        schema="""
+            CREATE TABLE cache_entries (
+                cache_key TEXT PRIMARY KEY,
+                file_path TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                last_accessed REAL NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX idx_cache_entries_accessed ON cache_entries (last_accessed);
+        """,
+        legacy_file="cache.db",
+        copy={
+            "cache_entries": "INSERT OR IGNORE INTO cache_entries "
+                             "SELECT cache_key, file_path, size_bytes, last_accessed, created_at FROM legacy.cache_entries",
+        },
+    ),
+    Migration(
+        schema="""
+            CREATE TABLE settings (
+                guild_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+        """,
+        legacy_file="settings.db",
+        copy={
+            "settings": "INSERT OR IGNORE INTO settings SELECT guild_id, data FROM legacy.settings",
+            # The original one-column-per-setting layout
+            "guild_settings": "INSERT OR IGNORE INTO settings SELECT guild_id, json_object("
+                              "'volume', volume, 'twenty_four_seven', json(CASE WHEN twenty_four_seven THEN 'true' ELSE 'false' END)"
+                              ") FROM legacy.guild_settings",
+        },
+    ),
+    Migration(
+        schema="""
+            CREATE TABLE queue_journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                guild_id INTEGER NOT NULL,
+                op TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX idx_queue_journal_guild ON queue_journal (guild_id, id);
+            CREATE TABLE queue_snapshots (
+                guild_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL,
+                journal_id INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE queue_sessions (
+                guild_id INTEGER PRIMARY KEY,
+                voice_channel_id INTEGER NOT NULL,
+                position REAL NOT NULL,
+                paused BOOLEAN DEFAULT 0,
+                loop_mode TEXT DEFAULT 'off',
+                audio_filter TEXT DEFAULT '',
+                audio_filter_name TEXT DEFAULT '',
+                updated_at REAL NOT NULL
+            );
+        """,
+        legacy_file="queues.db",
+        copy={
+            "queue_journal": "INSERT INTO queue_journal (id, guild_id, op, payload, created_at) "
+                             "SELECT id, guild_id, op, payload, created_at FROM legacy.queue_journal",
+            "queue_snapshots": "INSERT OR IGNORE INTO queue_snapshots "
+                               "SELECT guild_id, state, journal_id, created_at FROM legacy.queue_snapshots",
+            "queue_sessions": "INSERT OR IGNORE INTO queue_sessions "
+                              "SELECT guild_id, voice_channel_id, position, paused, loop_mode, audio_filter, "
+                              "audio_filter_name, updated_at FROM legacy.queue_sessions",
+        },
+    ),
+    Migration(
+        schema="""
+            CREATE TABLE lyrics (
+                key TEXT PRIMARY KEY,
+                lyrics TEXT,
+                fetched_at REAL NOT NULL
+            );
+        """,
+        legacy_file="lyrics.db",
+        copy={"lyrics": "INSERT OR IGNORE INTO lyrics SELECT key, lyrics, fetched_at FROM legacy.lyrics"},
+    ),
+    Migration(
+        # The full-text index over it needs FTS5, so MusicLibrary creates that
+        # when a library is configured rather than every bot requiring it
+        schema="""
+            CREATE TABLE library (
+                id INTEGER PRIMARY KEY,
+                path TEXT NOT NULL UNIQUE,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                artist TEXT,
+                album TEXT,
+                duration INTEGER NOT NULL DEFAULT 0
+            );
+        """,
+        legacy_file="library.db",
+        copy={
+            # Ids are kept: queued "library:<id>" URLs refer to them
+            "library": "INSERT OR IGNORE INTO library "
+                       "SELECT id, path, mtime, size, title, artist, album, duration FROM legacy.library",
+        },
+    ),
+]
+
+
+@dataclass
+class _Write:
+    sql: str = ""
+    params: Any = ()
+    many: bool = False
+    fn: Transaction | None = None
+    future: asyncio.Future | None = None
+
+
+class Storage:
+    """The bot's SQLite database (cache/bot.db), shared by every store.
+
+    All writes go through one writer task, which takes whatever writes are
+    queued and commits them as one transaction (each in its own savepoint,
+    so one failing write doesn't undo the others). Reads use a small pool of
+    separate connections, which WAL lets run alongside the writer. Each
+    connection keeps its prepared statements cached, so the fixed SQL the
+    stores use is compiled once. The schema is versioned with PRAGMA
+    user_version; see MIGRATIONS."""
+
+    def __init__(self, cache_dir: str = "./cache", readers: int = READ_CONNECTIONS):
+        self.cache_dir = os.environ.get("CACHE_DIR", cache_dir)
+        self.db_path = os.path.join(self.cache_dir, "bot.db")
+        self._readers_count = readers
+        self._writer: aiosqlite.Connection | None = None
+        self._readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._reader_conns: list[aiosqlite.Connection] = []
+        self._writes: asyncio.Queue[_Write | None] = asyncio.Queue()
+        self._writer_task: asyncio.Task | None = None
+        self.writes = 0
+        self.commits = 0
+        self.reads = 0
+
+    async def _connect(self) -> aiosqlite.Connection:
+        # isolation_level=None: transactions are started explicitly by the writer
+        db = await aiosqlite.connect(self.db_path, isolation_level=None, cached_statements=256)
+        for pragma in PRAGMAS:
+            await db.execute(pragma)
+        return db
+
+    async def initialize(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._writer = await self._connect()
+        await self._migrate()
+        for _ in range(self._readers_count):
+            reader = await self._connect()
+            self._reader_conns.append(reader)
+            self._readers.put_nowait(reader)
+        self._writer_task = asyncio.create_task(self._write_loop())
+
+    async def _migrate(self):
+        async with self._writer.execute("PRAGMA user_version") as cursor:
+            (version,) = await cursor.fetchone()
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            legacy_path = os.path.join(self.cache_dir, migration.legacy_file) if migration.legacy_file else ""
+            attached = bool(legacy_path) and os.path.isfile(legacy_path)
+            if attached:
+                # ATTACH isn't allowed inside a transaction
+                await self._writer.execute("ATTACH DATABASE ? AS legacy", (legacy_path,))
+            try:
+                await self._writer.execute("BEGIN IMMEDIATE")
+                for statement in filter(str.strip, migration.schema.split(";")):
+                    await self._writer.execute(statement)
+                if attached:
+                    async with self._writer.execute("SELECT name FROM legacy.sqlite_master WHERE type = 'table'") as cursor:
+                        legacy_tables = {row[0] for row in await cursor.fetchall()}
+                    for table, sql in migration.copy.items():
+                        if table in legacy_tables:
+                            await self._writer.execute(sql)
+                await self._writer.execute(f"PRAGMA user_version = {number}")
+                await self._writer.execute("COMMIT")
+            except Exception:
+                await self._writer.execute("ROLLBACK")
+                raise
+            finally:
+                if attached:
+                    await self._writer.execute("DETACH DATABASE legacy")
+            if attached:
+                log.info("Imported %s into %s (the old file can be deleted)", migration.legacy_file, self.db_path)
+            log.info("Storage schema migrated to version %d", number)
+
+    async def close(self):
+        if self._writer_task:
+            self._writes.put_nowait(None)
+            await self._writer_task
+            self._writer_task = None
+        for reader in self._reader_conns:
+            await reader.close()
+        self._reader_conns.clear()
+        if self._writer:
+            await self._writer.close()
+            self._writer = None
+
+    @property
+    def ready(self) -> bool:
+        return self._writer_task is not None
+
+    # --- Writes ---
+
+    def _submit(self, write: _Write) -> asyncio.Future:
+        if self._writer_task is None:
+            raise RuntimeError("Storage is not initialized")
+        write.future = asyncio.get_running_loop().create_future()
+        self._writes.put_nowait(write)
+        return write.future
+
+    async def execute(self, sql: str, params: Any = ()) -> int:
+        """Run a write and wait until it's committed. Returns the row count."""
+        return await self._submit(_Write(sql, params))
+
+    async def executemany(self, sql: str, seq_of_params) -> int:
+        return await self._submit(_Write(sql, list(seq_of_params), many=True))
+
+    def execute_nowait(self, sql: str, params: Any = ()) -> asyncio.Future:
+        """Queue a write without waiting for it (e.g. bookkeeping updates)."""
+        future = self._submit(_Write(sql, params))
+        future.add_done_callback(_log_failure)
+        return future
+
+    async def transaction(self, fn: Transaction):
+        """Run `fn(connection)` on the writer inside the next batch, for
+        writes that must read and write atomically. `fn` must not commit."""
+        return await self._submit(_Write(fn=fn))
+
+    async def _write_loop(self):
+        while True:
+            write = await self._writes.get()
+            if write is None:
+                return
+            batch = [write]
+            stop = False
+            while len(batch) < MAX_BATCH and not self._writes.empty():
+                write = self._writes.get_nowait()
+                if write is None:
+                    stop = True
+                    break
+                batch.append(write)
+            await self._run_batch(batch)
+            if stop:
+                return
+
+    async def _run_batch(self, batch: list[_Write]):
+        db = self._writer
+        results: list[tuple[_Write, Any, BaseException | None]] = []
+        try:
+            await db.execute("BEGIN")
+            for write in batch:
+                await db.execute("SAVEPOINT write")
+                try:
+                    if write.fn is not None:
+                        result = await write.fn(db)
+                    elif write.many:
+                        result = (await db.executemany(write.sql, write.params)).rowcount
+                    else:
+                        result = (await db.execute(write.sql, write.params)).rowcount
+                except Exception as e:
+                    await db.execute("ROLLBACK TO write")
+                    results.append((write, None, e))
+                else:
+                    results.append((write, result, None))
+                await db.execute("RELEASE write")
+            await db.execute("COMMIT")
+        except Exception as e:
+            log.error("Storage batch of %d write(s) failed: %s", len(batch), e)
+            if db.in_transaction:
+                await db.execute("ROLLBACK")
+            results = [(write, None, e) for write in batch]
+        else:
+            self.commits += 1
+            self.writes += len(batch)
+
+        for write, result, error in results:
+            if write.future.done():
+                continue
+            if error is not None:
+                write.future.set_exception(error)
+            else:
+                write.future.set_result(result)
+
+    # --- Reads ---
+
+    async def fetchall(self, sql: str, params: Any = ()) -> list[tuple]:
+        reader = await self._readers.get()
+        try:
+            # One hop to the connection's thread instead of execute + fetch + close
+            rows = list(await reader.execute_fetchall(sql, params))
+        finally:
+            self._readers.put_nowait(reader)
+        self.reads += 1
+        return rows
+
+    async def fetchone(self, sql: str, params: Any = ()) -> tuple | None:
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+    def stats(self) -> dict:
+        return {
+            "writes": self.writes,
+            "commits": self.commits,
+            "writes_per_commit": round(self.writes / self.commits, 1) if self.commits else 0.0,
+            "reads": self.reads,
+            "queued": self._writes.qsize(),
+        }
+
+
+def _log_failure(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        log.warning("Background write failed: %s", future.exception())
@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import time
+
+log = logging.getLogger("bot.track_index")
+
+# bm25 column weights: title, artist, uploader, tags
+BM25_WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+# Subtracted from the bm25 score (lower is better) of tracks whose audio is on disk
+CACHED_BONUS = 5.0
+# Column order of a buffered row; `cached` is updated in place on eviction
+_CACHED_COLUMN = 8
+
+_UPSERT_SQL = """INSERT INTO tracks (cache_key, title, artist, uploader, tags, webpage_url, duration, thumbnail, cached, last_seen)
+   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+   ON CONFLICT(cache_key) DO UPDATE SET
+       title = excluded.title,
+       artist = COALESCE(excluded.artist, artist),
+       uploader = COALESCE(excluded.uploader, uploader),
+       tags = COALESCE(excluded.tags, tags),
+       webpage_url = excluded.webpage_url,
+       duration = excluded.duration,
+       thumbnail = COALESCE(excluded.thumbnail, thumbnail),
+       cached = excluded.cached,
+       last_seen = excluded.last_seen"""
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class TrackIndex:
+    """SQLite FTS5 index over every track the bot has extracted.
+
+    Filled from resolved yt-dlp metadata as tracks play, and searched by title,
+    artist, uploader and tags with cached tracks ranked first. Hits carry the
+    cache key and metadata needed to replay the track without extraction.
+
+    Unlike the other stores, reads use a plain sqlite3 connection on the
+    event loop thread: the queries are small indexed lookups that finish well
+    under a millisecond, less than the hop to an aiosqlite worker thread would
+    cost on every autocomplete keystroke. Writes are buffered and committed
+    together by flush() (called periodically and on close) on a second
+    connection in a worker thread, so neither playback nor the loop waits on
+    a commit; WAL lets the reader carry on meanwhile."""
+
+    def __init__(self, cache_dir: str = "./cache"):
+        self.cache_dir = os.environ.get("CACHE_DIR", cache_dir)
+        self.db_path = os.path.join(self.cache_dir, "tracks.db")
+        self._db: sqlite3.Connection | None = None
+        self._writer: sqlite3.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        # cache_key -> row waiting for the next flush
+        self._pending: dict[str, list] = {}
+        # Rows being written by the flush in progress
+        self._flushing: dict[str, list] = {}
+        # Keys whose audio was removed from the cache since the last flush
+        self._uncached: set[str] = set()
+        self._all_uncached = False
+        self.queries = 0
+        self.hits = 0
+
+    async def initialize(self):
+        connections = await asyncio.to_thread(self._open)
+        if connections:
+            self._db, self._writer = connections
+
+    def _open(self) -> tuple[sqlite3.Connection, sqlite3.Connection] | None:
+        """Create the schema and both connections (in a worker thread)."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        writer = sqlite3.connect(self.db_path, check_same_thread=False)
+        writer.execute("PRAGMA journal_mode=WAL")
+        writer.execute("PRAGMA synchronous=NORMAL")
+        try:
+            writer.executescript("""
+                CREATE TABLE IF NOT EXISTS tracks (
+                    cache_key TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    artist TEXT,
+                    uploader TEXT,
+                    tags TEXT,
+                    webpage_url TEXT NOT NULL,
+                    duration INTEGER NOT NULL DEFAULT 0,
+                    thumbnail TEXT,
+                    cached INTEGER NOT NULL DEFAULT 0,
+                    last_seen REAL NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+                    title, artist, uploader, tags,
+                    content='tracks', content_rowid='rowid',
+                    tokenize='unicode61 remove_diacritics 2'
+                );
+                CREATE TRIGGER IF NOT EXISTS tracks_ai AFTER INSERT ON tracks BEGIN
+                    INSERT INTO tracks_fts(rowid, title, artist, uploader, tags)
+                    VALUES (new.rowid, new.title, new.artist, new.uploader, new.tags);
+                END;
+                CREATE TRIGGER IF NOT EXISTS tracks_ad AFTER DELETE ON tracks BEGIN
+                    INSERT INTO tracks_fts(tracks_fts, rowid, title, artist, uploader, tags)
+                    VALUES ('delete', old.rowid, old.title, old.artist, old.uploader, old.tags);
+                END;
+                CREATE TRIGGER IF NOT EXISTS tracks_au AFTER UPDATE ON tracks BEGIN
+                    INSERT INTO tracks_fts(tracks_fts, rowid, title, artist, uploader, tags)
+                    VALUES ('delete', old.rowid, old.title, old.artist, old.uploader, old.tags);
+                    INSERT INTO tracks_fts(rowid, title, artist, uploader, tags)
+                    VALUES (new.rowid, new.title, new.artist, new.uploader, new.tags);
+                END;
+            """)
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5: run without a local index
+            log.warning("Track index disabled: %s", e)
+            writer.close()
+            return None
+        writer.commit()
+        # Only used on the event loop thread once opened
+        reader = sqlite3.connect(self.db_path, check_same_thread=False)
+        reader.row_factory = sqlite3.Row
+        return reader, writer
+
+    async def close(self):
+        if self._db:
+            await self.flush()
+            self._db.close()
+            self._db = None
+            await asyncio.to_thread(self._writer.close)
+            self._writer = None
+
+    def record(self, cache_key: str, data: dict, cached: bool):
+        """Add or refresh a track from resolved metadata (written on the next
+        flush). Fields missing from `data` (e.g. when replayed from cache) keep
+        their indexed values."""
+        if not self._db or not cache_key or not data.get("webpage_url"):
+            return
+        tags = data.get("tags")
+        self._pending[cache_key] = [
+            cache_key,
+            data.get("title") or "Unknown",
+            data.get("artist") or data.get("creator"),
+            data.get("uploader") or data.get("channel"),
+            " ".join(tags) if tags else None,
+            data["webpage_url"],
+            int(data.get("duration") or 0),
+            data.get("thumbnail") or None,
+            int(cached),
+            time.time(),
+        ]
+        if cached:
+            self._uncached.discard(cache_key)
+
+    def mark_uncached(self, cache_keys: list[str] | None):
+        """CacheManager removal listener: these tracks' audio is gone from
+        the cache (None means all of it)."""
+        if cache_keys is None:
+            self._all_uncached = True
+            self._uncached.clear()
+            cache_keys = list(self._pending)
+        else:
+            self._uncached.update(cache_keys)
+        for key in cache_keys:
+            row = self._pending.get(key)
+            if row:
+                row[_CACHED_COLUMN] = 0
+
+    async def flush(self):
+        """Write buffered changes in one transaction, off the event loop."""
+        async with self._write_lock:
+            if not self._writer or not (self._pending or self._uncached or self._all_uncached):
+                return
+            pending, self._pending = self._pending, {}
+            uncached, self._uncached = self._uncached, set()
+            all_uncached, self._all_uncached = self._all_uncached, False
+            self._flushing = pending
+            try:
+                await asyncio.to_thread(self._write, pending, uncached, all_uncached)
+            except Exception:
+                # Keep the changes for the next flush; anything recorded since is newer
+                self._pending = {**pending, **self._pending}
+                self._uncached |= uncached
+                self._all_uncached |= all_uncached
+                raise
+            finally:
+                self._flushing = {}
+
+    def _write(self, pending: dict[str, list], uncached: set[str], all_uncached: bool):
+        with self._writer:
+            if all_uncached:
+                self._writer.execute("UPDATE tracks SET cached = 0 WHERE cached = 1")
+            if uncached:
+                self._writer.executemany("UPDATE tracks SET cached = 0 WHERE cache_key = ?", [(k,) for k in uncached])
+            # After the updates: a row recorded since an eviction is newer
+            if pending:
+                self._writer.executemany(_UPSERT_SQL, pending.values())
+
+    @staticmethod
+    def _match_expr(query: str) -> str | None:
+        # Every word must match, the last one as a prefix (it may still be being typed)
+        tokens = _TOKEN_RE.findall(query.lower())
+        if not tokens:
+            return None
+        terms = [f'"{t}"' for t in tokens[:-1]] + [f'"{tokens[-1]}"*']
+        return " ".join(terms)
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        """Best matches for `query`, in the shape of YouTube search results
+        plus `cache_key` and `cached`."""
+        if not self._db:
+            return []
+        expr = self._match_expr(query)
+        if not expr:
+            return []
+        self.queries += 1
+        rows = self._db.execute(
+            f"""SELECT t.cache_key, t.title, t.webpage_url, t.duration, t.thumbnail, t.cached
+                FROM tracks_fts JOIN tracks t ON t.rowid = tracks_fts.rowid
+                WHERE tracks_fts MATCH ?
+                ORDER BY bm25(tracks_fts, {', '.join(map(str, BM25_WEIGHTS))}) - t.cached * ?
+                LIMIT ?""",
+            (expr, CACHED_BONUS, limit),
+        ).fetchall()
+        if rows:
+            self.hits += 1
+        return [
+            {
+                "cache_key": r["cache_key"],
+                "title": r["title"],
+                "webpage_url": r["webpage_url"],
+                "duration": r["duration"],
+                "thumbnail": r["thumbnail"] or "",
+                "cached": bool(r["cached"]),
+            }
+            for r in rows
+        ]
+
+    def get(self, cache_key: str) -> dict | None:
+        """Indexed metadata for a track, in the shape Song.source_data() returns."""
+        if not self._db or not cache_key:
+            return None
+        pending = self._pending.get(cache_key) or self._flushing.get(cache_key)
+        if pending:
+            return {
+                "title": pending[1],
+                "webpage_url": pending[5],
+                "duration": pending[6],
+                "thumbnail": pending[7] or "",
+            }
+        row = self._db.execute(
+            "SELECT title, webpage_url, duration, thumbnail FROM tracks WHERE cache_key = ?",
+            (cache_key,),
+        ).fetchone()
+        if not row:
+            return None
+        return {
+            "title": row["title"],
+            "webpage_url": row["webpage_url"],
+            "duration": row["duration"],
+            "thumbnail": row["thumbnail"] or "",
+        }
+
+    def stats(self) -> dict:
+        tracks = self._db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0] if self._db else 0
+        return {"tracks": tracks, "queries": self.queries, "hits": self.hits}
@@ -1,6 +1,11 @@
 import asyncio
 import functools
+import json
 import logging
+import os
+from urllib.parse import unquote, urlparse
+
+import aiohttp
 import discord
 import yt_dlp
 
@@ -34,17 +39,91 @@ YTDL_PLAYLIST_OPTIONS = {
 FFMPEG_BEFORE_OPTIONS_STREAM = "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -probesize 200000 -thread_queue_size 4096"
 FFMPEG_BEFORE_OPTIONS_LOCAL = "-probesize 200000 -thread_queue_size 4096"
 
+# Direct links to audio files or HLS playlists skip yt-dlp entirely
+DIRECT_MEDIA_EXTENSIONS = {".mp3", ".ogg", ".opus", ".m4a", ".aac", ".flac", ".wav", ".m3u8"}
+DIRECT_MEDIA_TYPES = ("audio/", "application/vnd.apple.mpegurl", "application/x-mpegurl", "application/ogg")
+FFPROBE_TIMEOUT = 10
+
 ytdl = yt_dlp.YoutubeDL(YTDL_OPTIONS)
 ytdl_search = yt_dlp.YoutubeDL(YTDL_SEARCH_OPTIONS)
 ytdl_playlist = yt_dlp.YoutubeDL(YTDL_PLAYLIST_OPTIONS)
 
 
+def is_direct_media_url(url: str) -> bool:
+    parsed = urlparse(url)
+    return parsed.scheme in ("http", "https") and os.path.splitext(parsed.path)[1].lower() in DIRECT_MEDIA_EXTENSIONS
+
+
+async def _ffprobe(url: str) -> dict:
+    """Duration and title tags of a media URL, or {} if ffprobe is unavailable or fails."""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "ffprobe", "-v", "error", "-of", "json",
+            "-show_entries", "format=duration:format_tags=title,artist",
+            url,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+    except OSError as e:
+        log.debug("ffprobe unavailable: %s", e)
+        return {}
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), FFPROBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return {}
+    try:
+        return json.loads(stdout).get("format", {})
+    except ValueError:
+        return {}
+
+
+async def probe_direct_media(url: str, http: aiohttp.ClientSession) -> dict | None:
+    """Metadata for a direct media URL from one HEAD request and ffprobe, in
+    the shape extract_info returns. None if the URL isn't actually media."""
+    try:
+        async with http.head(url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+            if resp.status >= 400:
+                return None
+            content_type = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            final_url = str(resp.url)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.debug("HEAD failed for %s: %s", url, e)
+        return None
+    # Servers often send octet-stream for files; trust the extension then
+    if content_type and not content_type.startswith(DIRECT_MEDIA_TYPES) and content_type != "application/octet-stream":
+        return None
+
+    is_hls = final_url.lower().split("?")[0].endswith(".m3u8") or "mpegurl" in content_type
+    info = await _ffprobe(final_url)
+    tags = {k.lower(): v for k, v in info.get("tags", {}).items()}
+    try:
+        duration = int(float(info.get("duration", 0)))
+    except ValueError:  # "N/A" for live streams
+        duration = 0
+    filename = unquote(os.path.basename(urlparse(url).path))
+    title = os.path.splitext(filename)[0] or url
+    if tags.get("title"):
+        title = f"{tags['artist']} - {tags['title']}" if tags.get("artist") else tags["title"]
+    return {
+        "title": title,
+        "url": final_url,
+        "webpage_url": url,
+        "duration": duration,
+        "thumbnail": "",
+        # An HLS playlist without a duration is a live stream
+        "is_live": is_hls and not duration,
+        "direct": not is_hls,
+    }
+
+
 class YTDLSource(discord.AudioSource):
     """Wraps FFmpegOpusAudio with track metadata. Volume and filters are baked
     into the FFmpeg -af chain at creation time, so is_opus() returns True and
     discord.py skips its own Opus re-encode step entirely."""
 
-    def __init__(self, source: discord.FFmpegOpusAudio, *, data: dict):
+    def __init__(self, source: discord.FFmpegOpusAudio, *, data: dict, cache_key: str = "", is_local: bool = False):
         self._source = source
         self.data = data
         self.title = data.get("title", "Unknown")
@@ -52,6 +131,8 @@ class YTDLSource(discord.AudioSource):
         self.webpage_url = data.get("webpage_url", "")
         self.duration = data.get("duration") or 0
         self.thumbnail = data.get("thumbnail", "")
+        self.cache_key = cache_key
+        self.is_local = is_local
 
     def read(self) -> bytes:
         return self._source.read()
@@ -63,33 +144,55 @@ class YTDLSource(discord.AudioSource):
         self._source.cleanup()
 
     @classmethod
-    async def create_source(cls, search: str, *, loop: asyncio.AbstractEventLoop = None, volume: float = 0.5, seek_to: int = 0, audio_filter: str = "", cache_manager=None):
+    async def create_source(cls, search: str, *, loop: asyncio.AbstractEventLoop = None, volume: float = 0.5, seek_to: int = 0, audio_filter: str = "", cache_manager=None, cache_key: str = "", metadata: dict | None = None, http: aiohttp.ClientSession | None = None):
         loop = loop or asyncio.get_event_loop()
-        log.debug("Extracting info for: %s", search)
-        partial = functools.partial(ytdl.extract_info, search, download=False)
-        data = await loop.run_in_executor(None, partial)
 
-        if "entries" in data:
-            data = data["entries"][0]
+        # Fast path: a previously resolved track whose audio is already on disk
+        # can be played straight from the cache without a yt-dlp round trip.
+        if cache_manager and cache_key and metadata:
+            cached = await cache_manager.get_cached_path(cache_key)
+            if cached:
+                log.info("Using cached file for %s (no extraction): %s", cache_key, cached)
+                return cls._from_path(
+                    cached, data={**metadata, "url": cached}, is_local=True, cache_key=cache_key,
+                    volume=volume, seek_to=seek_to, audio_filter=audio_filter,
+                )
+
+        data = None
+        if http and is_direct_media_url(search):
+            data = await probe_direct_media(search, http)
+            if data:
+                log.info("Direct media URL (no extraction): %s", search)
+
+        if data is None:
+            log.debug("Extracting info for: %s", search)
+            partial = functools.partial(ytdl.extract_info, search, download=False)
+            data = await loop.run_in_executor(None, partial)
+
+            if "entries" in data:
+                data = data["entries"][0]
 
         # Determine audio source: cached local file or stream URL
         audio_path = data["url"]
         is_local = False
+        resolved_key = ""
 
         if cache_manager and data.get("webpage_url"):
             from utils.cache import CacheManager
-            cache_key = CacheManager.extract_cache_key(data["webpage_url"])
-            cached = await cache_manager.get_cached_path(cache_key)
+            resolved_key = CacheManager.extract_cache_key(data["webpage_url"])
+            # Skip the lookup if the fast path above already missed on this key
+            cached = None if resolved_key == cache_key and metadata else await cache_manager.get_cached_path(resolved_key)
             if cached:
                 audio_path = cached
                 is_local = True
-                log.info("Using cached file for %s: %s", cache_key, cached)
+                log.info("Using cached file for %s: %s", resolved_key, cached)
             else:
                 downloaded = await cache_manager.download_and_cache(
-                    cache_key,
+                    resolved_key,
                     data["webpage_url"],
                     data.get("duration"),
                     data.get("is_live", False),
+                    direct=data.get("direct", False),
                 )
                 if downloaded:
                     audio_path = downloaded
@@ -98,6 +201,21 @@ class YTDLSource(discord.AudioSource):
         if not is_local:
             log.info("Streaming from URL for: %s", data.get("title", search))
 
+        return cls._from_path(
+            audio_path, data=data, is_local=is_local, cache_key=resolved_key,
+            volume=volume, seek_to=seek_to, audio_filter=audio_filter,
+        )
+
+    @classmethod
+    def create_local_source(cls, path: str, *, data: dict, volume: float = 0.5, seek_to: int = 0, audio_filter: str = ""):
+        """Play a file from disk (e.g. the music library) with no extraction at all."""
+        return cls._from_path(
+            path, data={**data, "url": path}, is_local=True, cache_key=data.get("webpage_url", ""),
+            volume=volume, seek_to=seek_to, audio_filter=audio_filter,
+        )
+
+    @classmethod
+    def _from_path(cls, audio_path: str, *, data: dict, is_local: bool, cache_key: str = "", volume: float = 0.5, seek_to: int = 0, audio_filter: str = ""):
         before_options = FFMPEG_BEFORE_OPTIONS_LOCAL if is_local else FFMPEG_BEFORE_OPTIONS_STREAM
         if seek_to > 0:
             before_options = f"-ss {seek_to} {before_options}"
@@ -122,7 +240,7 @@ class YTDLSource(discord.AudioSource):
             before_options=before_options,
             options=options,
         )
-        return cls(opus_source, data=data)
+        return cls(opus_source, data=data, cache_key=cache_key, is_local=is_local)
 
     @classmethod
     async def search_results(cls, query: str, count: int = 5, *, loop: asyncio.AbstractEventLoop = None):